@@ -12,8 +12,12 @@ jwt = JWTManager()
 # BLOCKLIST will be imported after auth_routes to avoid premature import issues if any
 # It's defined in auth_routes.py
 
-def create_app(config_name='development'):
-    """Application factory function."""
+def create_app(config_name='development', config_overrides=None):
+    """Application factory function.
+
+    config_overrides (optional dict) is applied on top of the config class, e.g. to point
+    a throwaway app at an in-memory database.
+    """
     project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
     frontend_build_path = os.path.join(project_root, 'frontend', 'build')
     
@@ -25,6 +29,8 @@ def create_app(config_name='development'):
     # Fallback to 'default' config (DevelopmentConfig) if config_name is invalid
     actual_config = config_by_name.get(config_name, config_by_name['default'])
     app.config.from_object(actual_config)
+    if config_overrides:
+        app.config.from_mapping(config_overrides)
 
     try:
         # Ensure instance folder exists (for SQLite DB, logs, etc.)
@@ -37,6 +43,39 @@ def create_app(config_name='development'):
         
     db.init_app(app)
     migrate.init_app(app, db)
+
+    from . import clinics
+    clinics.init_app(app)
+
+    from . import jobs
+    jobs.init_app(app)
+
+    from . import compression
+    compression.init_app(app)
+
+    from . import ratelimit
+    ratelimit.init_app(app)
+
+    from . import idempotency
+    idempotency.init_app(app)
+
+    from . import profiling
+    profiling.init_app(app)
+
+    from . import slow_queries
+    slow_queries.init_app(app)
+
+    from . import tiering
+    tiering.init_app(app)
+
+    from . import audit
+    audit.init_app(app)
+
+    from . import reminders
+    reminders.init_app(app)
+
+    from . import duplicates
+    duplicates.init_app(app)
     
     # Configure CORS
     # The CORS_ORIGINS value is validated in ProductionConfig for security.
@@ -63,7 +102,8 @@ def create_app(config_name='development'):
     if not final_origins_setting and app.debug:
         final_origins_setting = '*'
     
-    CORS(app, resources={r"/api/*": {"origins": final_origins_setting}}, supports_credentials=True)
+    CORS(app, resources={r"/api/*": {"origins": final_origins_setting}}, supports_credentials=True,
+         expose_headers=['ETag']) # Clients echo it back in If-Match
     
     jwt.init_app(app)
 
@@ -74,6 +114,12 @@ def create_app(config_name='development'):
         jti = jwt_payload['jti']
         return jti in BLOCKLIST
 
+    @jwt.token_verification_loader
+    def check_clinic_claim(jwt_header, jwt_payload):
+        # Tokens naming a clinic this deployment no longer serves are rejected.
+        clinic = jwt_payload.get('clinic')
+        return clinic is None or clinics.is_known_clinic(clinic)
+
     # Register Blueprints for API
     from .routes.auth_routes import auth_bp
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
@@ -96,6 +142,15 @@ def create_app(config_name='development'):
     from .routes.report_routes import report_bp
     app.register_blueprint(report_bp, url_prefix='/api/reports')
 
+    from .routes.batch_routes import batch_bp
+    app.register_blueprint(batch_bp, url_prefix='/api/batch')
+
+    from .routes.admin_routes import admin_bp
+    app.register_blueprint(admin_bp, url_prefix='/api/admin')
+
+    from .query_plans import check_query_plans_command
+    app.cli.add_command(check_query_plans_command)
+
     @app.route('/api/health', methods=['GET'])
     def health_check():
         return jsonify({"status": "healthy", "message": "Eye Clinic API is running!"}), 200
@@ -0,0 +1,84 @@
+from sqlalchemy import select, update, delete, func
+
+from flask import current_app
+
+from .audit import audit_rows
+from .catalog_cache import bump_catalog_version
+from .database import db
+from .models import Patient, Appointment, AppointmentSeries, Bill, BillItem, InventoryItem
+from .sync import record_tombstones_from_select
+from .tiering import purge_cold_rows_for_patients
+from .utils import chunked
+
+
+def restore_inventory_for_bills(bill_ids):
+    """Returns the stock consumed by the given bills in one aggregated, correlated UPDATE."""
+    consumed = (
+        select(func.sum(BillItem.quantity))
+        .where(BillItem.bill_id.in_(bill_ids), BillItem.inventory_item_id == InventoryItem.id)
+        .scalar_subquery()
+    )
+    affected_items = select(BillItem.inventory_item_id).where(
+        BillItem.bill_id.in_(bill_ids), BillItem.inventory_item_id.isnot(None)
+    )
+    db.session.execute(
+        update(InventoryItem)
+        .where(InventoryItem.id.in_(affected_items))
+        .values(quantity_on_hand=InventoryItem.quantity_on_hand + consumed, version_id=InventoryItem.version_id + 1)
+        .execution_options(synchronize_session=False)
+    )
+    bump_catalog_version('inventory')
+
+
+def delete_bills(bill_ids, restore_inventory=True):
+    """Deletes bills and their items with set-based statements, recording tombstones.
+
+    Runs in the caller's transaction; the caller commits.
+    """
+    if restore_inventory:
+        restore_inventory_for_bills(bill_ids)
+    record_tombstones_from_select('bills', select(Bill.id).where(Bill.id.in_(bill_ids)))
+    audit_rows(Bill, 'delete', Bill.id.in_(bill_ids))
+    db.session.execute(delete(BillItem).where(BillItem.bill_id.in_(bill_ids)).execution_options(synchronize_session=False))
+    db.session.execute(delete(Bill).where(Bill.id.in_(bill_ids)).execution_options(synchronize_session=False))
+
+
+def _purge_patient_chunk(patient_ids):
+    bills_of_chunk = select(Bill.id).where(Bill.patient_id.in_(patient_ids))
+    appointments_of_chunk = select(Appointment.id).where(Appointment.patient_id.in_(patient_ids))
+
+    record_tombstones_from_select('bills', bills_of_chunk)
+    record_tombstones_from_select('appointments', appointments_of_chunk)
+    record_tombstones_from_select('patients', select(Patient.id).where(Patient.id.in_(patient_ids)))
+    audit_rows(Bill, 'delete', Bill.patient_id.in_(patient_ids))
+    audit_rows(Appointment, 'delete', Appointment.patient_id.in_(patient_ids))
+    audit_rows(Patient, 'delete', Patient.id.in_(patient_ids))
+
+    # Children first, so the statements are valid with or without enforced foreign keys.
+    statements = (
+        delete(BillItem).where(BillItem.bill_id.in_(bills_of_chunk)),
+        delete(Bill).where(Bill.patient_id.in_(patient_ids)),
+        delete(Appointment).where(Appointment.patient_id.in_(patient_ids)),
+        delete(AppointmentSeries).where(AppointmentSeries.patient_id.in_(patient_ids)),
+        delete(Patient).where(Patient.id.in_(patient_ids)),
+    )
+    for statement in statements:
+        db.session.execute(statement.execution_options(synchronize_session=False))
+    purge_cold_rows_for_patients(patient_ids)
+
+
+def purge_patients(patient_ids, commit_each_chunk=False):
+    """Hard-deletes patients with all appointments, series, bills and bill items.
+
+    Works in chunks of PURGE_CHUNK_SIZE patients using ``DELETE ... WHERE patient_id IN``
+    statements instead of loading every child row through the ORM cascade. Stock is not
+    returned to inventory: purged bills describe goods that were actually dispensed.
+    With commit_each_chunk, each chunk is its own transaction so a large purge never
+    holds the write lock for long; otherwise the caller commits.
+    """
+    patient_ids = list(patient_ids)
+    for chunk in chunked(patient_ids, current_app.config['PURGE_CHUNK_SIZE']):
+        _purge_patient_chunk(chunk)
+        if commit_each_chunk:
+            db.session.commit()
+    return len(patient_ids)
@@ -0,0 +1,298 @@
+"""Audit trail of who viewed or changed patient, appointment and bill records.
+
+Reads are recorded by an after_request hook for the endpoints in AUDITED_VIEWS; changes
+by session events: ORM flushes are inspected for new, modified and deleted records, and
+set-based statements (bulk updates, purges) stage their rows with audit_rows(). Changes
+are held on the session until it commits and dropped on rollback.
+
+Recording never touches the database on the request thread: an event is a tuple put on
+a bounded in-memory queue. A background writer drains it and inserts each clinic's
+events in batches into the append-only audit_events table, looking up the patient of
+viewed appointments and bills per batch. When the queue is full a
+request waits up to AUDIT_ENQUEUE_TIMEOUT_MS for room, then drops the event (counted in
+audit.dropped). Queued events are flushed when the process exits.
+"""
+import atexit
+import queue
+import threading
+import time
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import DDL, event, insert, inspect, select, text
+
+from .clinics import current_clinic, default_clinic
+from .database import ClinicRoutingSession, db
+from .metrics import metrics
+from .models import Appointment, AuditEvent, Bill, Patient
+from .sync import utcnow_naive
+
+# Audited model -> (resource name, attribute holding the record's patient id)
+AUDITED_MODELS = {
+    Patient: ('patients', 'id'),
+    Appointment: ('appointments', 'patient_id'),
+    Bill: ('bills', 'patient_id'),
+}
+MODELS_BY_RESOURCE = {resource: model for model, (resource, _) in AUDITED_MODELS.items()}
+
+# Read endpoint -> (resource, URL variable holding the record id, or None for listings)
+AUDITED_VIEWS = {
+    'patient_bp.get_patients': ('patients', None),
+    'patient_bp.get_patient': ('patients', 'patient_id'),
+    'patient_bp.get_patient_overview': ('patients', 'patient_id'),
+    'appointment_bp.get_appointments': ('appointments', None),
+    'appointment_bp.get_calendar_range': ('appointments', None),
+    'appointment_bp.get_appointment': ('appointments', 'appointment_id'),
+    'billing_bp.get_bills': ('bills', None),
+    'billing_bp.get_bill': ('bills', 'bill_id'),
+}
+
+EVENT_COLUMNS = ('occurred_at', 'user_id', 'action', 'resource', 'resource_id', 'patient_id', 'endpoint')
+PENDING_KEY = 'audit_pending'
+_STOP = object()
+
+# The audit trail is append-only: refuse edits at the database level where we can.
+APPEND_ONLY_TRIGGERS = {
+    f'audit_events_no_{operation.lower()}': (
+        f"CREATE TRIGGER IF NOT EXISTS audit_events_no_{operation.lower()} BEFORE {operation} ON audit_events "
+        f"BEGIN SELECT RAISE(ABORT, 'audit_events is append-only'); END"
+    )
+    for operation in ('UPDATE', 'DELETE')
+}
+for _statement in APPEND_ONLY_TRIGGERS.values():
+    event.listen(AuditEvent.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+
+
+def ensure_append_only(app, engine, clinic):
+    """Adds the append-only triggers to an existing audit_events table that lacks them.
+
+    Tables created by migrations never fire after_create, so every engine is checked
+    when it is opened; the triggers are only written if one is missing.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    with engine.connect() as connection:
+        existing = set(connection.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'audit_events'"
+        )).scalars())
+        if existing >= APPEND_ONLY_TRIGGERS.keys() or not inspect(connection).has_table(AuditEvent.__tablename__):
+            return
+        for name, statement in APPEND_ONLY_TRIGGERS.items():
+            if name not in existing:
+                connection.execute(text(statement))
+        connection.commit()
+    app.logger.info(f'Added the append-only triggers to audit_events for clinic {clinic}')
+
+
+class AuditWriter:
+    """Bounded queue of (clinic, event row) tuples drained by one background thread."""
+
+    def __init__(self, app, queue_size, batch_size, flush_interval, enqueue_timeout):
+        self._app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+        self._thread.start()
+
+    def enqueue(self, clinic, row):
+        try:
+            self._queue.put((clinic, row), timeout=self.enqueue_timeout)
+        except queue.Full:
+            metrics.increment('audit.dropped')
+            self._app.logger.error(f'Audit queue full; dropped {row[2]} event for {row[3]} {row[4]}')
+
+    def flush(self, timeout=None):
+        """Blocks until everything queued so far is written. Returns False on timeout."""
+        written = threading.Event()
+        self._queue.put(written)
+        return written.wait(timeout)
+
+    def close(self, timeout=None):
+        """Writes what is queued and stops the writer thread."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and not isinstance(batch[-1], threading.Event) and batch[-1] is not _STOP:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            by_clinic = {}
+            for item in batch:
+                if isinstance(item, tuple):
+                    by_clinic.setdefault(item[0], []).append(dict(zip(EVENT_COLUMNS, item[1])))
+            for clinic, rows in by_clinic.items():
+                self._write(clinic, rows)
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+            if batch[-1] is _STOP:
+                return
+
+    def _write(self, clinic, rows):
+        with self._app.app_context():
+            g.clinic = clinic
+            try:
+                _resolve_patients(rows)
+                db.session.execute(insert(AuditEvent), rows)
+                db.session.commit()
+                metrics.increment('audit.written', len(rows))
+            except Exception as e:
+                db.session.rollback()
+                metrics.increment('audit.dropped', len(rows))
+                self._app.logger.error(f'Writing {len(rows)} audit events for clinic {clinic} failed: {e}')
+
+
+def _resolve_patients(rows):
+    """Fills in the patient of viewed appointments and bills with one query per resource."""
+    unresolved = {}
+    for row in rows:
+        if row['patient_id'] is None and row['resource_id'] is not None and row['resource'] != 'patients':
+            unresolved.setdefault(row['resource'], []).append(row)
+    for resource, pending in unresolved.items():
+        model = MODELS_BY_RESOURCE[resource]
+        ids = {row['resource_id'] for row in pending}
+        patients = dict(db.session.execute(select(model.id, model.patient_id).where(model.id.in_(ids))).all())
+        for row in pending:
+            row['patient_id'] = patients.get(row['resource_id'])
+
+
+def _writer():
+    return current_app.extensions.get('audit') if has_app_context() else None
+
+
+def _actor():
+    try:
+        identity_ = get_jwt_identity()
+    except RuntimeError: # No verified token in this context (CLI, background job)
+        return None
+    return str(identity_) if identity_ is not None else None
+
+
+def _event(action, resource, resource_id, patient_id):
+    return (utcnow_naive(), _actor(), action, resource, resource_id, patient_id,
+            request.endpoint if has_request_context() else None)
+
+
+def _stage(session, rows):
+    session.info.setdefault(PENDING_KEY, []).extend(rows)
+
+
+def audit_rows(model, action, *criteria):
+    """Stages ``action`` for the rows of ``model`` matching ``criteria``; a no-op for unaudited models.
+
+    For set-based statements the ORM flush hooks don't see. Call it before a delete, or
+    before an update that changes which rows the criteria match.
+    """
+    audited = AUDITED_MODELS.get(model)
+    if audited is None or _writer() is None:
+        return
+    resource, patient_attribute = audited
+    rows = db.session.execute(select(model.id, getattr(model, patient_attribute)).where(*criteria)).all()
+    _stage(db.session(), [_event(action, resource, row_id, patient_id) for row_id, patient_id in rows])
+
+
+@event.listens_for(ClinicRoutingSession, 'after_flush')
+def _collect_flushed(session, flush_context):
+    if _writer() is None:
+        return
+    rows = []
+    for action, objects in (('create', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objects:
+            audited = AUDITED_MODELS.get(type(obj))
+            if audited is None:
+                continue
+            if action == 'update' and not session.is_modified(obj, include_collections=False):
+                continue
+            resource, patient_attribute = audited
+            rows.append(_event(action, resource, obj.id, getattr(obj, patient_attribute)))
+    if rows:
+        _stage(session, rows)
+
+
+@event.listens_for(ClinicRoutingSession, 'after_commit')
+def _enqueue_committed(session):
+    rows = session.info.pop(PENDING_KEY, None)
+    writer = _writer()
+    if rows and writer is not None:
+        clinic = current_clinic()
+        for row in rows:
+            writer.enqueue(clinic, row)
+
+
+@event.listens_for(ClinicRoutingSession, 'after_rollback')
+def _discard_rolled_back(session):
+    session.info.pop(PENDING_KEY, None)
+
+
+def query_events(patient_id=None, resource=None, resource_id=None, user_id=None, since=None, until=None, limit=100):
+    """The current clinic's audit events matching the filters, newest first."""
+    query = AuditEvent.query
+    if patient_id is not None:
+        query = query.filter(AuditEvent.patient_id == patient_id)
+    if resource is not None:
+        query = query.filter(AuditEvent.resource == resource)
+        if resource_id is not None:
+            query = query.filter(AuditEvent.resource_id == resource_id)
+    if user_id is not None:
+        query = query.filter(AuditEvent.user_id == user_id)
+    if since is not None:
+        query = query.filter(AuditEvent.occurred_at >= since)
+    if until is not None:
+        query = query.filter(AuditEvent.occurred_at < until)
+    return query.order_by(AuditEvent.occurred_at.desc(), AuditEvent.id.desc()).limit(limit).all()
+
+
+def _patient_of(resource, resource_id):
+    if resource == 'patients':
+        return resource_id
+    if resource_id is None:
+        return request.args.get('patient_id', type=int)
+    return None # Looked up by the writer, off the request path
+
+
+def record_view(response):
+    """after_request hook: records successful reads of audited endpoints."""
+    audited = AUDITED_VIEWS.get(request.endpoint)
+    if audited is None or request.method != 'GET' or response.status_code >= 400:
+        return response
+    resource, id_argument = audited
+    resource_id = request.view_args.get(id_argument) if id_argument else None
+    current_app.extensions['audit'].enqueue(
+        current_clinic(), _event('view', resource, resource_id, _patient_of(resource, resource_id))
+    )
+    return response
+
+
+def init_app(app):
+    with app.app_context():
+        ensure_append_only(app, db.engine, default_clinic())
+    app.extensions['clinic_engines'].engine_hooks.append(ensure_append_only)
+
+    config = app.config
+    if not config['AUDIT_ENABLED']:
+        return
+    writer = AuditWriter(
+        app,
+        queue_size=config['AUDIT_QUEUE_SIZE'],
+        batch_size=config['AUDIT_BATCH_SIZE'],
+        flush_interval=config['AUDIT_FLUSH_INTERVAL_MS'] / 1000,
+        enqueue_timeout=config['AUDIT_ENQUEUE_TIMEOUT_MS'] / 1000,
+    )
+    app.extensions['audit'] = writer
+    app.after_request(record_view)
+    atexit.register(writer.close, config['AUDIT_SHUTDOWN_TIMEOUT_SECONDS']) # Write what is still queued on exit
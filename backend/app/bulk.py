@@ -0,0 +1,54 @@
+from flask import current_app
+from sqlalchemy import select, update
+
+from .audit import audit_rows
+from .database import db
+from .sync import utcnow_naive
+from .utils import chunked
+
+
+class BulkRequestError(ValueError):
+    """Raised for a malformed bulk request; the message is safe to return to the client."""
+
+
+def parse_id_list(raw_ids):
+    if not isinstance(raw_ids, list) or not raw_ids or not all(isinstance(row_id, int) for row_id in raw_ids):
+        raise BulkRequestError("'ids' must be a non-empty list of integers")
+    return list(dict.fromkeys(raw_ids)) # De-duplicate, keep order
+
+
+def resolve_target_ids(model, ids, criteria):
+    """Returns the ids of rows to update: the given ids (if any) that also match ``criteria``.
+
+    Raises BulkRequestError if neither ids nor criteria were given (an unfiltered
+    table-wide update is never intended) or if too many rows match.
+    """
+    if ids is None and not criteria:
+        raise BulkRequestError("Provide 'ids' or at least one 'filter' predicate")
+
+    max_rows = current_app.config['BULK_UPDATE_MAX_ROWS']
+    if ids is None:
+        target_ids = db.session.scalars(select(model.id).where(*criteria).order_by(model.id).limit(max_rows + 1)).all()
+    else:
+        target_ids = []
+        for chunk in chunked(ids, current_app.config['BULK_UPDATE_CHUNK_SIZE']):
+            target_ids.extend(db.session.scalars(select(model.id).where(model.id.in_(chunk), *criteria)).all())
+    if len(target_ids) > max_rows:
+        raise BulkRequestError(f'A bulk update may affect at most {max_rows} rows')
+    return target_ids
+
+
+def update_rows(model, ids, values):
+    """Applies ``values`` to the given rows with one UPDATE per chunk, stamping updated_at set-wise.
+
+    Versioned models get their version_id advanced, invalidating outstanding ETags.
+    Runs in the caller's transaction; the caller commits.
+    """
+    values = dict(values, updated_at=utcnow_naive())
+    if 'version_id' in model.__table__.c:
+        values['version_id'] = model.version_id + 1
+    for chunk in chunked(ids, current_app.config['BULK_UPDATE_CHUNK_SIZE']):
+        audit_rows(model, 'update', model.id.in_(chunk))
+        db.session.execute(
+            update(model).where(model.id.in_(chunk)).values(**values).execution_options(synchronize_session=False)
+        )
@@ -0,0 +1,63 @@
+"""Process-local read-through cache for the doctor and inventory catalogs.
+
+Full catalog lists are read on nearly every scheduling and billing screen but change
+only a few times a day. Each worker keeps the serialized JSON of each list together
+with the catalog version it was built from. The version lives in the one-row
+catalog_versions table and is bumped in the same transaction as every write to
+the catalog. A read therefore costs one primary-key lookup while the version is
+unchanged, and every worker sees a write as soon as it commits.
+"""
+import threading
+
+from flask import current_app
+
+from .clinics import current_clinic
+from .database import db
+from .metrics import metrics
+from .models import CatalogVersion
+
+CATALOGS = ('doctors', 'inventory')
+
+_entries = {} # (clinic, catalog) -> (version, body bytes)
+_lock = threading.Lock()
+
+
+def catalog_version(catalog):
+    column = getattr(CatalogVersion, catalog)
+    return db.session.execute(db.select(column).where(CatalogVersion.id == 1)).scalar() or 0
+
+
+def bump_catalog_version(catalog):
+    """Invalidates a catalog in every worker. Runs in the caller's transaction; the caller commits."""
+    column = getattr(CatalogVersion, catalog)
+    result = db.session.execute(
+        db.update(CatalogVersion).where(CatalogVersion.id == 1).values({column: column + 1})
+    )
+    if result.rowcount == 0:
+        db.session.add(CatalogVersion(id=1, **{catalog: 1}))
+
+
+def cached_catalog_response(catalog, build):
+    """Returns the catalog as a JSON response, calling ``build()`` only if the cached copy is stale.
+
+    ``build`` returns the JSON-serializable list to cache.
+    """
+    key = (current_clinic(), catalog)
+    version = catalog_version(catalog) # Read before building, so a concurrent write is never cached as current
+    entry = _entries.get(key)
+    if entry is not None and entry[0] == version:
+        metrics.increment(f'catalog_cache.{catalog}.hits')
+        body = entry[1]
+    else:
+        metrics.increment(f'catalog_cache.{catalog}.misses')
+        body = current_app.json.dumps(build()).encode('utf-8')
+        with _lock:
+            current = _entries.get(key)
+            if current is None or current[0] <= version:
+                _entries[key] = (version, body)
+    return current_app.response_class(body, mimetype='application/json')
+
+
+def clear():
+    with _lock:
+        _entries.clear()
@@ -0,0 +1,180 @@
+"""Multi-clinic partitioning.
+
+Each clinic (branch) keeps its patients, appointments, inventory and bills in its
+own database, so every branch's hot tables only hold that branch's rows. Users and
+report jobs stay in the main database. The clinic of a request comes from the
+``clinic`` claim of its JWT; requests without one use the default clinic, whose
+data lives in the main database, so a single-branch deployment is unchanged.
+
+``flask db upgrade`` only migrates the main database. Clinic databases are brought up
+to the models by ``flask upgrade-clinics`` (run by startup.sh after it), which diffs
+each clinic's tables against the models the way ``flask db migrate`` does and applies
+the difference.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import sqlalchemy as sa
+from alembic.autogenerate import produce_migrations
+from alembic.migration import MigrationContext
+from alembic.operations import Operations, ops
+from flask import current_app, g
+from flask_jwt_extended import get_jwt
+
+from .database import db, SHARED_TABLES
+
+
+def default_clinic():
+    return current_app.config['CLINICS'][0]
+
+
+def is_known_clinic(clinic):
+    return clinic in current_app.config['CLINICS']
+
+
+def current_clinic():
+    """The clinic the current request or job works on.
+
+    ``g.clinic`` (set by background workers and fan-out) wins over the JWT claim.
+    """
+    clinic = g.get('clinic')
+    if clinic is not None:
+        return clinic
+    try:
+        claims = get_jwt()
+    except RuntimeError: # No verified token in this context
+        claims = {}
+    return claims.get('clinic') or default_clinic()
+
+
+class ClinicEngineRegistry:
+    """Creates clinic engines on first use and keeps at most ``max_open`` of them open.
+
+    The least recently used engine is disposed when the cap is exceeded; it is simply
+    recreated if that clinic is used again. Connections still checked out from a
+    disposed engine finish normally and are closed when returned.
+    """
+
+    def __init__(self, app):
+        self._app = app
+        self._engines = OrderedDict()
+        self._lock = threading.Lock()
+        self._uri_template = app.config['CLINIC_DATABASE_URI_TEMPLATE']
+        self._max_open = app.config['CLINIC_MAX_OPEN_ENGINES']
+        self.engine_hooks = [] # Called as hook(app, engine, clinic) for each new engine, e.g. to attach databases
+
+    def engine_for_current_clinic(self):
+        """Engine for the current clinic, or None for the default clinic (which uses db.engine)."""
+        clinic = current_clinic()
+        if clinic == default_clinic():
+            return None
+        return self.get_engine(clinic)
+
+    def get_engine(self, clinic):
+        with self._lock:
+            engine = self._engines.get(clinic)
+            if engine is not None:
+                self._engines.move_to_end(clinic)
+                return engine
+            if clinic not in self._app.config['CLINICS']:
+                raise ValueError(f'Unknown clinic: {clinic}')
+            engine = self._create_engine(clinic)
+            self._engines[clinic] = engine
+            while len(self._engines) > self._max_open:
+                _, evicted = self._engines.popitem(last=False)
+                evicted.dispose()
+            return engine
+
+    def _create_engine(self, clinic):
+        engine = sa.create_engine(
+            self._uri_template.format(clinic=clinic),
+            **self._app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        )
+        for hook in self.engine_hooks:
+            hook(self._app, engine, clinic)
+        # New branches get their schema from the models; existing ones are upgraded by upgrade_clinic_schema().
+        partitioned_tables = [table for table in db.metadata.sorted_tables if table.name not in SHARED_TABLES]
+        db.metadata.create_all(engine, tables=partitioned_tables)
+        return engine
+
+    def open_clinics(self):
+        with self._lock:
+            return list(self._engines)
+
+    def dispose_all(self):
+        with self._lock:
+            for engine in self._engines.values():
+                engine.dispose()
+            self._engines.clear()
+
+
+def _include_partitioned(obj, name, type_, reflected, compare_to):
+    if type_ == 'table':
+        # Shared tables live in the main database; tables the models no longer have are left alone.
+        return name not in SHARED_TABLES and compare_to is not None
+    return True
+
+
+def upgrade_clinic_schema(engine):
+    """Applies the differences between a clinic database and the models. Returns the number of changes.
+
+    Table changes go through batch mode, which recreates the table where SQLite can't ALTER it.
+    """
+    changes = 0
+    with engine.begin() as connection:
+        context = MigrationContext.configure(connection, opts={
+            'compare_type': True,
+            'include_object': _include_partitioned,
+        })
+        operations = Operations(context)
+        for operation in produce_migrations(context, db.metadata).upgrade_ops.ops:
+            if isinstance(operation, ops.ModifyTableOps):
+                with operations.batch_alter_table(operation.table_name) as batch:
+                    for table_operation in operation.ops:
+                        batch.invoke(table_operation)
+                changes += len(operation.ops)
+            else:
+                operations.invoke(operation)
+                changes += 1
+    return changes
+
+
+@click.command('upgrade-clinics')
+@click.option('--clinic', 'clinics', multiple=True, help='Clinic to upgrade (repeatable); default: all but the default clinic.')
+def upgrade_clinics_command(clinics):
+    """Bring clinic databases up to the current models (the default clinic uses flask db upgrade)."""
+    registry = current_app.extensions['clinic_engines']
+    for clinic in clinics or current_app.config['CLINICS'][1:]:
+        if clinic == default_clinic():
+            click.echo(f'{clinic}: skipped, the default clinic is upgraded by flask db upgrade.')
+            continue
+        changes = upgrade_clinic_schema(registry.get_engine(clinic))
+        click.echo(f'{clinic}: applied {changes} schema changes.')
+
+
+def run_in_clinics(fn, clinics):
+    """Calls ``fn()`` once per clinic in parallel and returns {clinic: result}.
+
+    Each call gets its own app context (and so its own DB session) with ``g.clinic``
+    set, so everything ``fn`` queries is routed to that clinic's database.
+    """
+    app = current_app._get_current_object()
+
+    def run(clinic):
+        with app.app_context():
+            g.clinic = clinic
+            return fn()
+
+    max_workers = max(1, min(len(clinics), app.config['CLINIC_FANOUT_MAX_WORKERS']))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='clinic-fanout') as executor:
+        results = list(executor.map(run, clinics))
+    return dict(zip(clinics, results))
+
+
+def init_app(app):
+    if not app.config['CLINICS']:
+        raise ValueError('CLINICS must name at least one clinic')
+    app.extensions['clinic_engines'] = ClinicEngineRegistry(app)
+    app.cli.add_command(upgrade_clinics_command)
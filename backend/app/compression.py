@@ -0,0 +1,155 @@
+"""Negotiated compression of /api/* responses (gzip always; brotli and zstd when installed)."""
+import time
+import zlib
+
+from flask import current_app, request
+
+from .metrics import metrics
+
+try:
+    import brotli
+except ImportError: # Optional: pip install brotli
+    brotli = None
+
+try:
+    import zstandard
+except ImportError: # Optional: pip install zstandard
+    zstandard = None
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/csv', 'text/plain'}
+
+
+class _GzipCompressor:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class _ZstdCompressor:
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+def available_codecs():
+    """Content-codings this process can produce, most preferred first (used to break q-value ties)."""
+    codecs = {}
+    if zstandard is not None:
+        codecs['zstd'] = _ZstdCompressor
+    if brotli is not None:
+        codecs['br'] = _BrotliCompressor
+    codecs['gzip'] = _GzipCompressor
+    return codecs
+
+
+CODECS = available_codecs()
+
+
+def negotiate_encoding(accept_encodings):
+    """Picks the codec with the highest client q-value; returns None if the client accepts none."""
+    best, best_quality = None, 0
+    for name in CODECS:
+        quality = accept_encodings[name]
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+def _record(encoding, size_in, size_out, seconds):
+    metrics.increment(f'compression.{encoding}.responses')
+    metrics.increment(f'compression.{encoding}.bytes_in', size_in)
+    metrics.increment(f'compression.{encoding}.bytes_out', size_out)
+    metrics.observe(f'compression.{encoding}.seconds', seconds)
+    if size_in:
+        metrics.observe(f'compression.{encoding}.ratio', size_out / size_in)
+
+
+def _compress_stream(chunks, compressor, encoding):
+    """Compresses a streamed body chunk by chunk, so exports never sit fully in memory."""
+    size_in = size_out = 0
+    seconds = 0.0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            started = time.perf_counter()
+            compressed = compressor.compress(chunk)
+            seconds += time.perf_counter() - started
+            size_in += len(chunk)
+            size_out += len(compressed)
+            if compressed:
+                yield compressed
+        started = time.perf_counter()
+        tail = compressor.finish()
+        seconds += time.perf_counter() - started
+        size_out += len(tail)
+        yield tail
+        _record(encoding, size_in, size_out, seconds)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def compress_response(response):
+    """after_request hook: compresses eligible /api/* responses for the negotiated codec."""
+    config = current_app.config
+    if not config['COMPRESSION_ENABLED'] or not request.path.startswith('/api/'):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    compressor = CODECS[encoding](config['COMPRESSION_LEVELS'][encoding])
+
+    if response.direct_passthrough or response.is_streamed:
+        if response.content_length is not None and response.content_length < config['COMPRESSION_MIN_SIZE']:
+            return response
+        response.response = _compress_stream(response.response, compressor, encoding)
+        response.direct_passthrough = False
+        response.headers.pop('Content-Length', None)
+        response.headers.pop('Accept-Ranges', None) # Byte ranges of the encoded body aren't supported
+    else:
+        data = response.get_data()
+        if len(data) < config['COMPRESSION_MIN_SIZE']:
+            return response
+        started = time.perf_counter()
+        compressed = compressor.compress(data) + compressor.finish()
+        _record(encoding, len(data), len(compressed), time.perf_counter() - started)
+        response.set_data(compressed)
+
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True) # The encoded body differs byte-wise from the identity one
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
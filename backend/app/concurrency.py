@@ -0,0 +1,30 @@
+"""Optimistic concurrency for single-record edits.
+
+Versioned models register a ``version_id`` column as the mapper's version_id_col, so
+every ORM flush of a change is ``UPDATE ... WHERE id = ? AND version_id = ?`` and raises
+StaleDataError if another writer committed first; no row lock is taken. The version is
+served as the record's ETag, and PUT routes refuse an If-Match naming an older version.
+"""
+from flask import jsonify, request
+
+
+def etag_for(obj):
+    return str(obj.version_id)
+
+
+def if_match_failed(obj):
+    """True if the request carries If-Match and it doesn't name ``obj``'s current version.
+
+    Weak tags are accepted too: compressed responses carry a weakened ETag.
+    """
+    if not request.if_match:
+        return False
+    return not (request.if_match.star_tag or request.if_match.contains_weak(etag_for(obj)))
+
+
+def versioned_response(obj, body, status):
+    """A JSON response for ``body`` carrying ``obj``'s version as its ETag."""
+    response = jsonify(body)
+    response.status_code = status
+    response.set_etag(etag_for(obj))
+    return response
@@ -74,6 +74,131 @@ class Config:
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)
     CORS_ORIGINS = os.environ.get('CORS_ORIGINS', '*') # Default to all origins for development convenience
+    # Delta sync: tombstones older than this are pruned; clients offline longer get a full reset.
+    SYNC_TOMBSTONE_RETENTION_DAYS = int(os.environ.get('SYNC_TOMBSTONE_RETENTION_DAYS', 90))
+    # /api/batch: maximum sub-requests per call and threads used for concurrent reads.
+    BATCH_MAX_REQUESTS = int(os.environ.get('BATCH_MAX_REQUESTS', 20))
+    BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', 4))
+    # Widest window /api/appointments/calendar will serve in one call.
+    CALENDAR_MAX_RANGE_DAYS = int(os.environ.get('CALENDAR_MAX_RANGE_DAYS', 62))
+    # Recurring series: max occurrences per series, and how close two bookings for a doctor may be.
+    SERIES_MAX_OCCURRENCES = int(os.environ.get('SERIES_MAX_OCCURRENCES', 104))
+    APPOINTMENT_SLOT_MINUTES = int(os.environ.get('APPOINTMENT_SLOT_MINUTES', 30))
+    # Patients per set-based DELETE batch when purging.
+    PURGE_CHUNK_SIZE = int(os.environ.get('PURGE_CHUNK_SIZE', 200))
+    # Bulk PATCH endpoints: ids per UPDATE statement and maximum rows per request.
+    BULK_UPDATE_CHUNK_SIZE = int(os.environ.get('BULK_UPDATE_CHUNK_SIZE', 500))
+    BULK_UPDATE_MAX_ROWS = int(os.environ.get('BULK_UPDATE_MAX_ROWS', 5000))
+    # Per-section row limits for /api/patients/<id>/overview.
+    PATIENT_OVERVIEW_DEFAULT_LIMIT = int(os.environ.get('PATIENT_OVERVIEW_DEFAULT_LIMIT', 5))
+    PATIENT_OVERVIEW_MAX_LIMIT = int(os.environ.get('PATIENT_OVERVIEW_MAX_LIMIT', 50))
+    # Background report jobs: concurrent workers, queue cap, and how long results are kept.
+    REPORT_JOB_MAX_WORKERS = int(os.environ.get('REPORT_JOB_MAX_WORKERS', 2))
+    REPORT_JOB_MAX_PENDING = int(os.environ.get('REPORT_JOB_MAX_PENDING', 20))
+    REPORT_JOB_RETENTION_HOURS = int(os.environ.get('REPORT_JOB_RETENTION_HOURS', 24))
+    # A job not finished this long after it was queued is treated as lost to a restart or crash:
+    # it stops counting against REPORT_JOB_MAX_PENDING and is marked failed.
+    REPORT_JOB_TIMEOUT_MINUTES = int(os.environ.get('REPORT_JOB_TIMEOUT_MINUTES', 60))
+    # reorder_forecast report (see app/forecast.py): days of bill history it covers when no
+    # start_date is given, and the half-life in days of its exponential smoothing of usage.
+    REORDER_FORECAST_WINDOW_DAYS = int(os.environ.get('REORDER_FORECAST_WINDOW_DAYS', 90))
+    REORDER_FORECAST_HALF_LIFE_DAYS = float(os.environ.get('REORDER_FORECAST_HALF_LIFE_DAYS', 14))
+    # doctor_utilization report: hours per day a doctor can be booked (the utilization
+    # denominator), the range covered when no dates are given, and the longest range allowed.
+    DOCTOR_BOOKABLE_HOURS_PER_DAY = float(os.environ.get('DOCTOR_BOOKABLE_HOURS_PER_DAY', 8))
+    DOCTOR_UTILIZATION_DEFAULT_DAYS = int(os.environ.get('DOCTOR_UTILIZATION_DEFAULT_DAYS', 30))
+    DOCTOR_UTILIZATION_MAX_RANGE_DAYS = int(os.environ.get('DOCTOR_UTILIZATION_MAX_RANGE_DAYS', 366))
+    # Response compression for /api/*: bodies smaller than COMPRESSION_MIN_SIZE bytes are sent as-is.
+    # Levels are per codec; brotli and zstd are only offered if their packages are installed.
+    COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', 'true').lower() == 'true'
+    COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+    COMPRESSION_LEVELS = {
+        'gzip': int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6)),
+        'br': int(os.environ.get('COMPRESSION_BROTLI_LEVEL', 5)),
+        'zstd': int(os.environ.get('COMPRESSION_ZSTD_LEVEL', 3)),
+    }
+    # Multi-clinic: ids accepted in the JWT 'clinic' claim. The first is the default clinic, whose
+    # data stays in SQLALCHEMY_DATABASE_URI; each other clinic gets CLINIC_DATABASE_URI_TEMPLATE.
+    CLINICS = [clinic.strip() for clinic in os.environ.get('CLINICS', 'main').split(',') if clinic.strip()]
+    CLINIC_MAX_OPEN_ENGINES = int(os.environ.get('CLINIC_MAX_OPEN_ENGINES', 8))
+    # Threads used when an admin report fans out across all clinics.
+    CLINIC_FANOUT_MAX_WORKERS = int(os.environ.get('CLINIC_FANOUT_MAX_WORKERS', 4))
+    # Admission control: token buckets per (client, endpoint). 'memory' limits each worker
+    # process separately; 'sqlite' shares buckets between workers through instance/ratelimit.sqlite.
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', 'true').lower() == 'true'
+    RATELIMIT_BACKEND = os.environ.get('RATELIMIT_BACKEND', 'memory')
+    # Budget -> refill rate (requests/second), burst size, and max in-flight requests per client.
+    RATELIMIT_BUDGETS = {
+        'default': {'rate': 10, 'burst': 40, 'concurrency': 8},
+        'expensive': {'rate': 0.2, 'burst': 3, 'concurrency': 1},
+        'export': {'rate': 1, 'burst': 5, 'concurrency': 2},
+    }
+    # Endpoints that draw on a budget other than 'default'.
+    RATELIMIT_ENDPOINT_BUDGETS = {
+        'report_bp.generate_report': 'expensive',
+        'report_bp.create_report_job': 'expensive',
+        'report_bp.get_report_job_result': 'export',
+        'report_bp.refresh_billing_cube': 'expensive',
+    }
+    # Idempotency-Key on POST /api/bills and /api/appointments: how long a stored response is
+    # replayed, how long a duplicate waits for the original to finish, and how often expired
+    # keys are purged in the background.
+    IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', 24))
+    IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 10))
+    IDEMPOTENCY_PURGE_INTERVAL_SECONDS = int(os.environ.get('IDEMPOTENCY_PURGE_INTERVAL_SECONDS', 900))
+    # Request profiling (see app/profiling.py). Off by default; when off no hooks are installed.
+    # PROFILING_SAMPLE_RATES profiles a random fraction of an endpoint's requests, e.g.
+    # "billing_bp.create_bill=0.01,report_bp.generate_report=0.1". PROFILING_MODE is 'sampling' or 'cprofile'.
+    PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+    PROFILING_MODE = os.environ.get('PROFILING_MODE', 'sampling')
+    PROFILING_SAMPLE_RATES = {
+        endpoint.strip(): float(rate)
+        for endpoint, _, rate in (item.partition('=') for item in os.environ.get('PROFILING_SAMPLE_RATES', '').split(','))
+        if endpoint.strip() and rate.strip()
+    }
+    PROFILING_SAMPLE_INTERVAL_MS = float(os.environ.get('PROFILING_SAMPLE_INTERVAL_MS', 5))
+    PROFILING_MAX_FILES = int(os.environ.get('PROFILING_MAX_FILES', 200))
+    # Slow-query log (see app/slow_queries.py): statements at or over the threshold are kept in a
+    # ring buffer of SLOW_QUERY_BUFFER_SIZE entries and appended to instance/slow_queries.log.
+    SLOW_QUERY_LOG_ENABLED = os.environ.get('SLOW_QUERY_LOG_ENABLED', 'true').lower() == 'true'
+    SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 200))
+    SLOW_QUERY_BUFFER_SIZE = int(os.environ.get('SLOW_QUERY_BUFFER_SIZE', 500))
+    SLOW_QUERY_EXPLAIN = os.environ.get('SLOW_QUERY_EXPLAIN', 'true').lower() == 'true'
+    SLOW_QUERY_LOG_FILE = os.environ.get('SLOW_QUERY_LOG_FILE', 'true').lower() == 'true'
+    SLOW_QUERY_LOG_MAX_BYTES = int(os.environ.get('SLOW_QUERY_LOG_MAX_BYTES', 5 * 1024 * 1024))
+    SLOW_QUERY_LOG_BACKUPS = int(os.environ.get('SLOW_QUERY_LOG_BACKUPS', 3))
+    # Hot/cold tiering (see app/tiering.py): `flask move-cold-data` moves settled appointments and bills older
+    # than the horizon into instance/archive_<clinic>.db, TIERING_CHUNK_SIZE rows per transaction.
+    TIERING_ENABLED = os.environ.get('TIERING_ENABLED', 'true').lower() == 'true'
+    TIERING_HORIZON_DAYS = int(os.environ.get('TIERING_HORIZON_DAYS', 730))
+    TIERING_CHUNK_SIZE = int(os.environ.get('TIERING_CHUNK_SIZE', 500))
+    # Audit log (see app/audit.py): events are queued in memory (at most AUDIT_QUEUE_SIZE) and
+    # inserted by a background writer in batches of AUDIT_BATCH_SIZE at least every AUDIT_FLUSH_INTERVAL_MS.
+    # A request waits up to AUDIT_ENQUEUE_TIMEOUT_MS for room in a full queue before the event is dropped.
+    AUDIT_ENABLED = os.environ.get('AUDIT_ENABLED', 'true').lower() == 'true'
+    AUDIT_QUEUE_SIZE = int(os.environ.get('AUDIT_QUEUE_SIZE', 10000))
+    AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', 500))
+    AUDIT_FLUSH_INTERVAL_MS = int(os.environ.get('AUDIT_FLUSH_INTERVAL_MS', 1000))
+    AUDIT_ENQUEUE_TIMEOUT_MS = int(os.environ.get('AUDIT_ENQUEUE_TIMEOUT_MS', 50))
+    AUDIT_SHUTDOWN_TIMEOUT_SECONDS = int(os.environ.get('AUDIT_SHUTDOWN_TIMEOUT_SECONDS', 10))
+    # Appointment reminders (see app/reminders.py): every REMINDER_POLL_SECONDS the process holding the
+    # scheduler lease queues reminders for appointments starting within REMINDER_LEAD_HOURS and hands
+    # due ones to REMINDER_SENDER. Failed sends are retried with exponential backoff up to REMINDER_MAX_ATTEMPTS.
+    # REMINDERS_ENABLED applies to serving processes (run.py) and `flask run-reminders`, not other CLI commands.
+    REMINDERS_ENABLED = os.environ.get('REMINDERS_ENABLED', 'true').lower() == 'true'
+    REMINDER_LEAD_HOURS = int(os.environ.get('REMINDER_LEAD_HOURS', 24))
+    REMINDER_POLL_SECONDS = int(os.environ.get('REMINDER_POLL_SECONDS', 60))
+    REMINDER_LEASE_SECONDS = int(os.environ.get('REMINDER_LEASE_SECONDS', 180))
+    REMINDER_BATCH_SIZE = int(os.environ.get('REMINDER_BATCH_SIZE', 500))
+    REMINDER_MAX_ATTEMPTS = int(os.environ.get('REMINDER_MAX_ATTEMPTS', 5))
+    REMINDER_RETRY_BASE_SECONDS = int(os.environ.get('REMINDER_RETRY_BASE_SECONDS', 60))
+    REMINDER_SENDER = os.environ.get('REMINDER_SENDER', 'file') # A key of app.reminders.SENDERS
+    # Duplicate-patient detection (see app/duplicates.py). Blocks larger than DUPLICATE_MAX_BLOCK_SIZE
+    # (e.g. a shared placeholder phone number) are skipped; 0 workers means one per CPU.
+    DUPLICATE_MIN_SCORE = float(os.environ.get('DUPLICATE_MIN_SCORE', 0.65))
+    DUPLICATE_MAX_BLOCK_SIZE = int(os.environ.get('DUPLICATE_MAX_BLOCK_SIZE', 50))
+    DUPLICATE_SCAN_WORKERS = int(os.environ.get('DUPLICATE_SCAN_WORKERS', 0))
+    DUPLICATE_SCORE_CHUNK_SIZE = int(os.environ.get('DUPLICATE_SCORE_CHUNK_SIZE', 20000))
 
     # Ensure the instance folder exists. This code runs when the Config class is defined (module import time).
     if not os.path.exists(INSTANCE_FOLDER_PATH):
@@ -97,10 +222,22 @@ class Config:
             _default_raw_uri, INSTANCE_FOLDER_PATH, INSTANCE_FOLDER_NAME, "Config (default)"
         )
 
+    # {clinic} is replaced with the clinic id; relative SQLite paths land in the instance folder.
+    CLINIC_DATABASE_URI_TEMPLATE = _resolve_sqlite_uri(
+        os.environ.get('CLINIC_DATABASE_URI_TEMPLATE', 'sqlite:///clinic_{clinic}.db'),
+        INSTANCE_FOLDER_PATH, INSTANCE_FOLDER_NAME, "Config (clinics)"
+    )
+
 
 class DevelopmentConfig(Config):
     DEBUG = True
     FLASK_ENV = 'development'
+    # Local traffic doesn't need the smallest payloads; favour fast compression.
+    COMPRESSION_LEVELS = {
+        'gzip': int(os.environ.get('COMPRESSION_GZIP_LEVEL', 1)),
+        'br': int(os.environ.get('COMPRESSION_BROTLI_LEVEL', 1)),
+        'zstd': int(os.environ.get('COMPRESSION_ZSTD_LEVEL', 1)),
+    }
     # SQLALCHEMY_DATABASE_URI is inherited from Config and resolved there.
 
 
@@ -119,8 +256,14 @@ class TestingConfig(Config):
             _default_raw_uri_testing, INSTANCE_FOLDER_PATH, INSTANCE_FOLDER_NAME, "TestingConfig (default)"
         )
 
+    CLINIC_DATABASE_URI_TEMPLATE = _resolve_sqlite_uri(
+        os.environ.get('TEST_CLINIC_DATABASE_URI_TEMPLATE', 'sqlite:///test_clinic_{clinic}.db'),
+        INSTANCE_FOLDER_PATH, INSTANCE_FOLDER_NAME, "TestingConfig (clinics)"
+    )
+
     JWT_SECRET_KEY = 'test_jwt_secret_key_for_testing_do_not_use_in_prod'
     SECRET_KEY = 'test_secret_key_for_testing_do_not_use_in_prod'
+    REMINDERS_ENABLED = os.environ.get('REMINDERS_ENABLED', 'false').lower() == 'true' # Tests run ticks explicitly
 
 
 class ProductionConfig(Config):
@@ -0,0 +1,395 @@
+"""Columnar billing cube for ad-hoc slicing by month, item category, payment status and age band.
+
+One fact row per bill item, stored as NumPy arrays (one ``.npy`` file per column) under
+``instance/cube/<clinic>/<generation>/`` and memory-mapped on load. ``CURRENT`` names the
+live generation; a refresh writes a complete new generation and then swaps ``CURRENT``
+atomically, so readers never see a half-written cube.
+
+Refreshes are incremental: only bills whose ``updated_at`` moved past the cube's
+watermark are re-read, and bills tombstoned in the deletion log are dropped. Category
+and age band are captured when a bill's rows are loaded; a full rebuild
+(POST /api/reports/cube/refresh) picks up later category or date-of-birth edits.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import func, select
+
+from .clinics import current_clinic
+from .database import db
+from .models import Bill, BillItem, DeletionLog, InventoryItem, Patient
+from .sync import parse_iso_timestamp, utcnow_naive
+from .tiering import ArchivedBill, ArchivedBillItem, reaches_cold_tier
+from .utils import chunked
+
+DIMENSIONS = ('month', 'category', 'payment_status', 'age_band')
+COLUMN_TYPES = {
+    'bill_item_id': np.int64,
+    'bill_id': np.int64,
+    'month': np.int32, # year * 12 + (month - 1)
+    'category': np.int32, # Code into meta['dictionaries']['category']
+    'payment_status': np.int32, # Code into meta['dictionaries']['payment_status']
+    'age_band': np.int8, # Index into AGE_BANDS
+    'quantity': np.int64,
+    'amount_cents': np.int64,
+}
+# (label, lowest age in band); the last band is for patients without a date of birth.
+AGE_BANDS = (('0-17', 0), ('18-34', 18), ('35-49', 35), ('50-64', 50), ('65+', 65), ('Unknown', None))
+SERVICE_CATEGORY = 'Services' # Bill items not linked to an inventory item
+UNCATEGORIZED = 'Uncategorized'
+# Above this many group-by cells, fall back from bincount to a sort-based group-by.
+MAX_DENSE_CELLS = 1 << 22
+# Generations kept after a refresh: the new one and the one readers may still be opening.
+KEEP_GENERATIONS = 2
+# Never delete a generation younger than this; another process may still be writing it.
+GENERATION_GRACE_SECONDS = 300
+# Bills are stamped with updated_at at flush but become visible at commit, so the stored
+# watermark trails the read by this much; bills re-read because of it replace their old rows.
+WATERMARK_MARGIN = timedelta(seconds=60)
+LOAD_ATTEMPTS = 3
+
+_refresh_lock = threading.Lock()
+_loaded = {} # cube directory -> Cube
+
+
+def _age_band(bill_date, date_of_birth):
+    if date_of_birth is None:
+        return len(AGE_BANDS) - 1
+    age = bill_date.year - date_of_birth.year - ((bill_date.month, bill_date.day) < (date_of_birth.month, date_of_birth.day))
+    band = 0
+    for index, (_, lowest_age) in enumerate(AGE_BANDS[:-1]):
+        if age >= lowest_age:
+            band = index
+    return band
+
+
+def month_code(year, month):
+    return year * 12 + month - 1
+
+
+def month_label(code):
+    return f'{code // 12:04d}-{code % 12 + 1:02d}'
+
+
+def parse_month(raw_value):
+    """'YYYY-MM' -> month code. Raises ValueError if malformed."""
+    year, month = raw_value.split('-')
+    year, month = int(year), int(month)
+    if not 1 <= month <= 12:
+        raise ValueError(f'Invalid month: {raw_value}')
+    return month_code(year, month)
+
+
+def cube_dir(clinic=None):
+    return os.path.join(current_app.instance_path, 'cube', clinic or current_clinic())
+
+
+class Cube:
+    """One loaded cube generation: memory-mapped columns plus their dictionaries."""
+
+    def __init__(self, directory, generation, meta, columns):
+        self.directory = directory
+        self.generation = generation
+        self.meta = meta
+        self.columns = columns
+
+    @property
+    def rows(self):
+        return self.meta['rows']
+
+    @property
+    def watermark(self):
+        return parse_iso_timestamp(self.meta['watermark'])
+
+    def labels(self, dimension):
+        if dimension == 'age_band':
+            return [label for label, _ in AGE_BANDS]
+        return self.meta['dictionaries'][dimension]
+
+    @classmethod
+    def load(cls, directory):
+        """Loads the generation named by CURRENT, or returns None if there is no usable cube.
+
+        A generation can disappear between reading CURRENT and opening its files when
+        another process refreshes the cube meanwhile, so CURRENT is re-read a few times.
+        None (the caller rebuilds) if CURRENT keeps naming a missing generation.
+        """
+        for _ in range(LOAD_ATTEMPTS):
+            try:
+                return cls._load_current(directory)
+            except FileNotFoundError:
+                continue
+        return None
+
+    @classmethod
+    def _load_current(cls, directory):
+        try:
+            with open(os.path.join(directory, 'CURRENT')) as current_file:
+                generation = current_file.read().strip()
+        except FileNotFoundError:
+            return None
+        cached = _loaded.get(directory)
+        if cached is not None and cached.generation == generation:
+            return cached
+
+        generation_dir = os.path.join(directory, generation)
+        with open(os.path.join(generation_dir, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+        # Zero-length files can't be memory-mapped; an empty cube is loaded normally.
+        mmap_mode = 'r' if meta['rows'] else None
+        columns = {
+            name: np.load(os.path.join(generation_dir, f'{name}.npy'), mmap_mode=mmap_mode)
+            for name in COLUMN_TYPES
+        }
+        cube = cls(directory, generation, meta, columns)
+        _loaded[directory] = cube
+        return cube
+
+    def _filter_mask(self, filters, month_from, month_to):
+        """Boolean mask of the rows matching the filters, or None if nothing is filtered."""
+        conditions = []
+        if month_from is not None:
+            conditions.append(self.columns['month'] >= month_from)
+        if month_to is not None:
+            conditions.append(self.columns['month'] <= month_to)
+        for dimension, wanted in (filters or {}).items():
+            labels = self.labels(dimension)
+            codes = [labels.index(label) for label in wanted if label in labels]
+            if len(codes) == 1:
+                conditions.append(self.columns[dimension] == codes[0])
+            else: # A lookup table is several times faster than np.isin on large columns
+                lookup = np.zeros(max(len(labels), 1), dtype=bool)
+                lookup[codes] = True
+                conditions.append(lookup[self.columns[dimension]])
+        mask = None
+        for condition in conditions:
+            mask = condition if mask is None else mask & condition
+        return mask
+
+    def query(self, group_by=(), filters=None, month_from=None, month_to=None):
+        """Filters and groups the fact rows; returns {'rows': [...], 'total': {...}}.
+
+        ``filters`` maps a dimension to a list of labels to keep. Measures are the summed
+        amount, summed quantity and number of bill items per group.
+        """
+        mask = self._filter_mask(filters, month_from, month_to)
+        amount, quantity = self.columns['amount_cents'], self.columns['quantity']
+        if not group_by:
+            where = True if mask is None else mask
+            items = self.rows if mask is None else int(np.count_nonzero(mask))
+            return {'rows': [], 'total': _measures(items, np.sum(amount, where=where), np.sum(quantity, where=where))}
+
+        # Mixed-radix key over the grouped dimensions, computed on the full columns (masking
+        # every column first would copy them); filtered-out rows go to one extra overflow cell.
+        radixes, offsets = [], []
+        for dimension in group_by:
+            if dimension == 'month':
+                offset = self.meta['month_min']
+                radixes.append(self.meta['month_max'] - offset + 1)
+            else:
+                offset = 0
+                radixes.append(max(len(self.labels(dimension)), 1))
+            offsets.append(offset)
+        cells = int(np.prod(radixes, dtype=np.int64))
+
+        keys = None
+        for dimension, radix, offset in zip(group_by, radixes, offsets):
+            values = self.columns[dimension].astype(np.intp) # bincount's native index type
+            if offset:
+                values -= offset
+            keys = values if keys is None else keys * radix + values
+        if mask is not None:
+            keys = np.where(mask, keys, cells)
+
+        if cells <= MAX_DENSE_CELLS:
+            counts = np.bincount(keys, minlength=cells + 1)[:cells]
+            group_keys = np.flatnonzero(counts)
+            counts = counts[group_keys]
+            amounts = np.bincount(keys, weights=amount, minlength=cells + 1)[group_keys]
+            quantities = np.bincount(keys, weights=quantity, minlength=cells + 1)[group_keys]
+        else:
+            group_keys, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+            amounts = np.bincount(inverse, weights=amount)
+            quantities = np.bincount(inverse, weights=quantity)
+            if len(group_keys) and group_keys[-1] == cells:
+                group_keys, counts, amounts, quantities = group_keys[:-1], counts[:-1], amounts[:-1], quantities[:-1]
+
+        decoded = []
+        remaining = group_keys.astype(np.int64)
+        for dimension, radix, offset in reversed(list(zip(group_by, radixes, offsets))):
+            decoded.append((dimension, remaining % radix + offset))
+            remaining //= radix
+        decoded.reverse()
+
+        rows = []
+        for index in range(len(group_keys)):
+            row = {}
+            for dimension, codes in decoded:
+                code = int(codes[index])
+                row[dimension] = month_label(code) if dimension == 'month' else self.labels(dimension)[code]
+            row.update(_measures(counts[index], amounts[index], quantities[index]))
+            rows.append(row)
+        total = _measures(int(counts.sum()), amounts.sum(), quantities.sum())
+        return {'rows': rows, 'total': total}
+
+
+def _measures(items, amount_cents, quantity):
+    return {'amount': f'{int(round(amount_cents)) / 100:.2f}', 'quantity': int(round(quantity)), 'items': int(items)}
+
+
+def _fact_rows(bill_ids=None):
+    """Yields lists of fact tuples for bill items (of ``bill_ids``, or all), joined with bill, item and patient.
+
+    A full build includes the cold tier; bills changed since a build are always hot.
+    """
+    if bill_ids is not None:
+        for chunk in chunked(bill_ids, current_app.config['BULK_UPDATE_CHUNK_SIZE']):
+            yield from _fact_rows_where(BillItem, Bill, BillItem.bill_id.in_(chunk))
+    else:
+        yield from _fact_rows_where(BillItem, Bill, None)
+        if reaches_cold_tier('bills', None):
+            yield from _fact_rows_where(ArchivedBillItem, ArchivedBill, None)
+
+
+def _fact_rows_where(item_model, bill_model, condition):
+    stmt = (
+        select(item_model.id, item_model.bill_id, bill_model.bill_date, bill_model.payment_status,
+               item_model.inventory_item_id, InventoryItem.category, Patient.date_of_birth,
+               item_model.quantity, item_model.sub_total)
+        .join(bill_model, item_model.bill_id == bill_model.id)
+        .outerjoin(InventoryItem, item_model.inventory_item_id == InventoryItem.id)
+        .outerjoin(Patient, bill_model.patient_id == Patient.id)
+    )
+    if condition is not None:
+        stmt = stmt.where(condition)
+    result = db.session.execute(stmt.execution_options(yield_per=20000))
+    yield from result.partitions()
+
+
+def _encode(partitions, dictionaries):
+    """Turns fact tuples into column arrays, extending the dictionaries with new labels."""
+    codes = {dimension: {label: code for code, label in enumerate(labels)} for dimension, labels in dictionaries.items()}
+
+    def code_for(dimension, label):
+        code = codes[dimension].get(label)
+        if code is None:
+            code = codes[dimension][label] = len(dictionaries[dimension])
+            dictionaries[dimension].append(label)
+        return code
+
+    chunks = {name: [] for name in COLUMN_TYPES}
+    for partition in partitions:
+        for (item_id, bill_id, bill_date, status, inventory_item_id, category, date_of_birth, quantity, sub_total) in partition:
+            if inventory_item_id is None:
+                category = SERVICE_CATEGORY
+            chunks['bill_item_id'].append(item_id)
+            chunks['bill_id'].append(bill_id)
+            chunks['month'].append(month_code(bill_date.year, bill_date.month))
+            chunks['category'].append(code_for('category', category or UNCATEGORIZED))
+            chunks['payment_status'].append(code_for('payment_status', status))
+            chunks['age_band'].append(_age_band(bill_date, date_of_birth))
+            chunks['quantity'].append(quantity or 0)
+            chunks['amount_cents'].append(int(round((sub_total or 0) * 100)))
+    return {name: np.array(values, dtype=COLUMN_TYPES[name]) for name, values in chunks.items()}
+
+
+def _write_generation(directory, columns, meta):
+    generation = f"{utcnow_naive():%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+    months = columns['month']
+    meta = dict(meta, generation=generation, rows=int(len(months)),
+                month_min=int(months.min()) if len(months) else 0, month_max=int(months.max()) if len(months) else 0)
+    generation_dir = os.path.join(directory, generation)
+    os.makedirs(generation_dir)
+    for name, values in columns.items():
+        np.save(os.path.join(generation_dir, f'{name}.npy'), values)
+    with open(os.path.join(generation_dir, 'meta.json'), 'w') as meta_file:
+        json.dump(meta, meta_file)
+
+    current_path = os.path.join(directory, 'CURRENT')
+    with open(f'{current_path}.tmp', 'w') as current_file:
+        current_file.write(generation)
+    os.replace(f'{current_path}.tmp', current_path)
+
+    _remove_old_generations(directory)
+    return Cube.load(directory)
+
+
+def _remove_old_generations(directory):
+    """Deletes generations older than the newest KEEP_GENERATIONS, except the live one.
+
+    The previous generation is kept for readers that read CURRENT just before the swap;
+    open memory maps stay valid after their files are unlinked. Recent directories are
+    left alone: another process may be writing one or have just published it.
+    """
+    with open(os.path.join(directory, 'CURRENT')) as current_file:
+        live = current_file.read().strip()
+    generations = sorted(entry for entry in os.listdir(directory) if os.path.isdir(os.path.join(directory, entry)))
+    cutoff = time.time() - GENERATION_GRACE_SECONDS
+    for entry in generations[:-KEEP_GENERATIONS]: # Names start with a timestamp, so they sort by age
+        path = os.path.join(directory, entry)
+        try:
+            if entry != live and os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass # Removed by another process meanwhile
+
+
+def rebuild_cube():
+    """Builds the current clinic's cube from scratch."""
+    with _refresh_lock:
+        return _build(cube_dir())
+
+
+def _build(directory):
+    built_at = utcnow_naive() # Captured before reading, so concurrent writes are re-read next time
+    dictionaries = {'category': [], 'payment_status': []}
+    columns = _encode(_fact_rows(), dictionaries)
+    os.makedirs(directory, exist_ok=True)
+    meta = {'built_at': built_at.isoformat(), 'watermark': (built_at - WATERMARK_MARGIN).isoformat(), 'dictionaries': dictionaries}
+    return _write_generation(directory, columns, meta)
+
+
+def _needs_refresh(cube):
+    watermark = cube.watermark
+    changed = db.session.query(func.max(Bill.updated_at)).scalar()
+    if changed is not None and changed > watermark:
+        return True
+    return db.session.query(DeletionLog.id).filter(
+        DeletionLog.resource == 'bills', DeletionLog.deleted_at > watermark
+    ).first() is not None
+
+
+def refresh_cube():
+    """Returns an up-to-date cube for the current clinic, refreshing it incrementally if bills changed."""
+    cube = Cube.load(cube_dir())
+    retention = timedelta(days=current_app.config['SYNC_TOMBSTONE_RETENTION_DAYS'])
+    if cube is None or cube.watermark < utcnow_naive() - retention:
+        return rebuild_cube() # Missing, or older than the tombstones needed to patch it
+    if not _needs_refresh(cube):
+        return cube
+
+    with _refresh_lock:
+        cube = Cube.load(cube.directory) # Another thread may have refreshed it meanwhile
+        if cube is None:
+            return _build(cube_dir())
+        watermark, new_watermark = cube.watermark, utcnow_naive() - WATERMARK_MARGIN
+        changed_ids = [bill_id for (bill_id,) in db.session.query(Bill.id).filter(Bill.updated_at > watermark)]
+        deleted_ids = [resource_id for (resource_id,) in db.session.query(DeletionLog.resource_id).filter(
+            DeletionLog.resource == 'bills', DeletionLog.deleted_at > watermark
+        )]
+        if not changed_ids and not deleted_ids:
+            return cube
+
+        keep = ~np.isin(cube.columns['bill_id'], np.array(changed_ids + deleted_ids, dtype=np.int64))
+        dictionaries = {dimension: list(labels) for dimension, labels in cube.meta['dictionaries'].items()}
+        added = _encode(_fact_rows(changed_ids), dictionaries)
+        columns = {name: np.concatenate([cube.columns[name][keep], added[name]]) for name in COLUMN_TYPES}
+        meta = {'built_at': cube.meta['built_at'], 'watermark': new_watermark.isoformat(), 'dictionaries': dictionaries}
+        return _write_generation(cube.directory, columns, meta)
@@ -1,6 +1,36 @@
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import inspect
+from sqlalchemy.sql.util import find_tables
+
+# Tables that live only in the main database and are shared by every clinic.
+# All other tables are partitioned: each clinic has its own copy (see app/clinics.py).
+SHARED_TABLES = frozenset({'users', 'report_jobs', 'scheduler_leases'})
+
+
+def _is_partitioned(mapper, clause):
+    if mapper is not None:
+        return inspect(mapper).local_table.name not in SHARED_TABLES
+    if clause is not None:
+        return any(table.name not in SHARED_TABLES for table in find_tables(clause, include_crud=True))
+    return False
+
+
+class ClinicRoutingSession(Session):
+    """Session that sends statements on partitioned tables to the current clinic's engine."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            registry = current_app.extensions.get('clinic_engines')
+            if registry is not None and _is_partitioned(mapper, clause):
+                engine = registry.engine_for_current_clinic()
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
 
 # Initialize SQLAlchemy extension
 # This instance will be further configured and registered with the Flask app
 # in the app factory (app/__init__.py).
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': ClinicRoutingSession})
@@ -0,0 +1,248 @@
+"""Duplicate-patient detection.
+
+Comparing every patient with every other is O(n²). Instead each patient carries
+blocking keys in indexed columns: ``phone_key`` (the phone's digits without country
+or trunk prefix) and ``name_key`` (Soundex codes of the name's words, sorted so word
+order doesn't matter), the latter blocked together with date_of_birth. Only patients
+sharing a block are compared, and the index delivers each block's rows together, so
+finding candidates is one ordered index scan per key. Candidate pairs are scored on
+name similarity, phone, birth date and e-mail in a process pool.
+
+Keys are set whenever a Patient is flushed; rows from before the columns existed are
+filled in by refresh_blocking_keys() at the start of a scan.
+
+A scan takes seconds on large clinics and writes the missing keys, so it never runs on
+a request: the duplicate_patients report job and ``flask find-duplicate-patients`` run
+it and store the result per clinic in the instance folder, where the admin API reads it.
+"""
+import json
+import multiprocessing
+import os
+import re
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from difflib import SequenceMatcher
+from itertools import combinations, groupby
+
+import click
+from flask import current_app, g
+from sqlalchemy import bindparam, event, select, update
+
+from .clinics import current_clinic
+from .database import db
+from .models import Patient
+from .sync import utcnow_naive
+from .utils import chunked
+
+PHONE_KEY_DIGITS = 10 # Trailing digits kept: drops +1 / 00 44 / trunk-0 prefixes
+MIN_PHONE_DIGITS = 7
+REFRESH_BATCH_SIZE = 5000
+SOUNDEX_CODES = {letter: str(code) for code, letters in enumerate(
+    ['aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r']) for letter in letters}
+
+# Score weights; a pair scoring at least DUPLICATE_MIN_SCORE is reported.
+NAME_WEIGHT = 0.45
+BIRTH_DATE_WEIGHT = 0.25
+PHONE_WEIGHT = 0.2 # Households share phones, so a phone match counts less than name and birth date
+EMAIL_WEIGHT = 0.1
+NAME_MATCH_RATIO = 0.85 # Similarity from which a name counts as matching in 'matched_on'
+
+
+def _name_words(full_name):
+    ascii_name = unicodedata.normalize('NFKD', full_name or '').encode('ascii', 'ignore').decode().lower()
+    return re.findall(r'[a-z]+', ascii_name)
+
+
+def _soundex(word):
+    digits = [SOUNDEX_CODES[letter] for letter in word]
+    code, previous = word[0].upper(), digits[0]
+    for letter, digit in zip(word[1:], digits[1:]):
+        if digit != '0' and digit != previous:
+            code += digit
+        if letter not in 'hw': # h and w don't separate letters with the same code
+            previous = digit
+    return (code + '000')[:4]
+
+
+def name_blocking_key(full_name):
+    words = _name_words(full_name)
+    return ' '.join(sorted(_soundex(word) for word in words))[:60] or None
+
+
+def phone_blocking_key(phone):
+    digits = re.sub(r'\D', '', phone or '')
+    return digits[-PHONE_KEY_DIGITS:] if len(digits) >= MIN_PHONE_DIGITS else None
+
+
+@event.listens_for(Patient, 'before_insert')
+@event.listens_for(Patient, 'before_update')
+def _set_blocking_keys(mapper, connection, patient):
+    patient.phone_key = phone_blocking_key(patient.phone)
+    patient.name_key = name_blocking_key(patient.full_name)
+
+
+def refresh_blocking_keys():
+    """Fills in blocking keys of patients that have none (rows from before the columns). Returns the count."""
+    stmt = (
+        update(Patient).where(Patient.id == bindparam('patient_id'))
+        .values(phone_key=bindparam('phone_key'), name_key=bindparam('name_key'),
+                updated_at=Patient.updated_at) # Derived data: not a change delta-syncing clients need
+        .execution_options(synchronize_session=False)
+    )
+    refreshed, last_id = 0, 0
+    while True:
+        rows = db.session.execute(
+            select(Patient.id, Patient.full_name, Patient.phone).where(Patient.name_key.is_(None), Patient.id > last_id)
+            .order_by(Patient.id).limit(REFRESH_BATCH_SIZE)
+        ).all()
+        if not rows:
+            return refreshed
+        last_id = rows[-1].id
+        # A name without letters keeps a NULL key and is never blocked by name.
+        keyed = [{'patient_id': patient_id, 'phone_key': phone_blocking_key(phone), 'name_key': name_blocking_key(name)}
+                 for patient_id, name, phone in rows]
+        db.session.connection(bind_arguments={'mapper': Patient}).execute(stmt, keyed) # The clinic's engine, not the default
+        db.session.commit()
+        refreshed += len(keyed)
+
+
+def _candidate_pairs(max_block_size):
+    """Pairs of patient ids sharing a block, and the number of oversized blocks skipped."""
+    pairs, skipped_blocks = set(), 0
+    for key_columns in ((Patient.phone_key,), (Patient.name_key, Patient.date_of_birth)):
+        rows = db.session.execute(
+            select(*key_columns, Patient.id).where(*(column.isnot(None) for column in key_columns))
+            .order_by(*key_columns, Patient.id).execution_options(yield_per=50000)
+        )
+        for _, block in groupby(rows, key=lambda row: tuple(row[:-1])):
+            ids = [row[-1] for row in block]
+            if len(ids) > max_block_size:
+                skipped_blocks += 1
+            elif len(ids) > 1:
+                pairs.update(combinations(ids, 2))
+    return pairs, skipped_blocks
+
+
+def _comparable(row):
+    patient_id, full_name, email, phone_key, date_of_birth = row
+    email_local = (email or '').lower().split('@')[0].replace('.', '') or None
+    return (patient_id, ' '.join(sorted(_name_words(full_name))), email_local, phone_key,
+            date_of_birth.isoformat() if date_of_birth else None)
+
+
+def score_pair(a, b):
+    """Scores two comparable records (see _comparable). Returns (score, matched fields)."""
+    matched = []
+    name_ratio = SequenceMatcher(None, a[1], b[1]).ratio() if a[1] and b[1] else 0.0
+    score = NAME_WEIGHT * name_ratio
+    if name_ratio >= NAME_MATCH_RATIO:
+        matched.append('name')
+    for index, field, weight in ((3, 'phone', PHONE_WEIGHT), (4, 'date_of_birth', BIRTH_DATE_WEIGHT),
+                                 (2, 'email', EMAIL_WEIGHT)):
+        if a[index] is not None and a[index] == b[index]:
+            score += weight
+            matched.append(field)
+    return round(score, 3), matched
+
+
+def _score_chunk(pairs, min_score):
+    """Process-pool worker: scores (record, record) pairs, keeping those at or above ``min_score``."""
+    results = []
+    for a, b in pairs:
+        score, matched = score_pair(a, b)
+        if score >= min_score:
+            results.append({'patient_ids': [a[0], b[0]], 'score': score, 'matched_on': matched})
+    return results
+
+
+def find_duplicate_patients(min_score=None, workers=None, progress=None):
+    """Likely duplicate pairs among the current clinic's patients, best first, with scan statistics."""
+    config = current_app.config
+    min_score = config['DUPLICATE_MIN_SCORE'] if min_score is None else min_score
+    workers = workers or config['DUPLICATE_SCAN_WORKERS'] or os.cpu_count() or 1
+    progress = progress or (lambda percent: None)
+    started = time.monotonic()
+
+    refresh_blocking_keys()
+    progress(20)
+    pairs, skipped_blocks = _candidate_pairs(config['DUPLICATE_MAX_BLOCK_SIZE'])
+    progress(40)
+    records = {}
+    for chunk in chunked(sorted({patient_id for pair in pairs for patient_id in pair}), 5000):
+        for row in db.session.execute(
+            select(Patient.id, Patient.full_name, Patient.email, Patient.phone_key, Patient.date_of_birth)
+            .where(Patient.id.in_(chunk))
+        ):
+            records[row[0]] = _comparable(row)
+    db.session.rollback() # End the read transaction before the long scoring step
+
+    chunk_size = config['DUPLICATE_SCORE_CHUNK_SIZE']
+    work = [[(records[a], records[b]) for a, b in chunk] for chunk in chunked(sorted(pairs), chunk_size)]
+    if workers > 1 and len(work) > 1:
+        # spawn, not fork: this process runs background threads holding locks.
+        with ProcessPoolExecutor(max_workers=min(workers, len(work)),
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            scored = pool.map(_score_chunk, work, [min_score] * len(work))
+            duplicates = [result for results in scored for result in results]
+    else:
+        duplicates = [result for chunk in work for result in _score_chunk(chunk, min_score)]
+    duplicates.sort(key=lambda result: (-result['score'], result['patient_ids']))
+    return {
+        'duplicates': duplicates,
+        'min_score': min_score,
+        'candidate_pairs': len(pairs),
+        'skipped_blocks': skipped_blocks,
+        'elapsed_seconds': round(time.monotonic() - started, 2),
+    }
+
+
+def results_path(clinic=None):
+    return os.path.join(current_app.instance_path, 'duplicates', f'{clinic or current_clinic()}.json')
+
+
+def scan_duplicate_patients(min_score=None, progress=None):
+    """Runs find_duplicate_patients() for the current clinic and stores the result for stored_duplicates()."""
+    result = dict(find_duplicate_patients(min_score, progress=progress), scanned_at=utcnow_naive().isoformat())
+    path = results_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as result_file:
+        json.dump(result, result_file)
+    os.replace(tmp_path, path) # Readers never see a half-written file
+    return result
+
+
+def stored_duplicates():
+    """The current clinic's last stored scan, or None if none has run."""
+    try:
+        with open(results_path()) as result_file:
+            return json.load(result_file)
+    except FileNotFoundError:
+        return None
+
+
+@click.command('find-duplicate-patients')
+@click.option('--min-score', type=float, default=None, help='Override DUPLICATE_MIN_SCORE.')
+@click.option('--limit', type=int, default=50, show_default=True, help='Pairs to print per clinic.')
+@click.option('--clinic', 'clinics', multiple=True, help='Clinic to scan (repeatable); default: all.')
+def find_duplicate_patients_command(min_score, limit, clinics):
+    """List likely duplicate patient records and store them for the admin API."""
+    for clinic in clinics or current_app.config['CLINICS']:
+        with current_app.app_context():
+            g.clinic = clinic
+            result = scan_duplicate_patients(min_score)
+            click.echo(f"{clinic}: {len(result['duplicates'])} likely duplicate pairs from {result['candidate_pairs']} "
+                       f"candidates in {result['elapsed_seconds']}s ({result['skipped_blocks']} oversized blocks skipped).")
+            shown = result['duplicates'][:limit]
+            names = dict(db.session.execute(
+                select(Patient.id, Patient.full_name).where(Patient.id.in_({i for d in shown for i in d['patient_ids']}))
+            ).all())
+            for duplicate in shown:
+                first, second = duplicate['patient_ids']
+                click.echo(f"  {duplicate['score']:.3f}  #{first} {names.get(first)!r} ~ #{second} {names.get(second)!r}"
+                           f"  ({', '.join(duplicate['matched_on'])})")
+
+
+def init_app(app):
+    app.cli.add_command(find_duplicate_patients_command)
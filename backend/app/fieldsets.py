@@ -0,0 +1,83 @@
+"""Sparse fieldsets: ``?fields=full_name,phone`` limits what a read route loads and returns.
+
+The selection maps to ``load_only`` on the query, so unrequested columns (e.g. large
+Text columns) are never fetched, and to marshmallow ``only=``, so they are never
+serialized. ``id`` is always included.
+"""
+from functools import lru_cache
+
+from flask import request
+from sqlalchemy import inspect
+from sqlalchemy.orm import load_only
+
+
+class FieldSelectionError(ValueError):
+    """The ?fields= parameter names fields the resource does not expose."""
+
+
+@lru_cache(maxsize=None)
+def dumpable_fields(schema_cls):
+    return frozenset(name for name, field in schema_cls().fields.items() if not field.load_only)
+
+
+@lru_cache(maxsize=256)
+def _sparse_schema(schema_cls, only, many):
+    return schema_cls(only=only, many=many)
+
+
+class FieldSelection:
+    def __init__(self, model, schema_cls, fields=None):
+        self.model = model
+        self.schema_cls = schema_cls
+        self.fields = fields # Sorted tuple of field names, or None for all fields
+
+    @classmethod
+    def from_request(cls, model, schema_cls):
+        """Parses ?fields=. Raises FieldSelectionError for unknown fields."""
+        raw_value = request.args.get('fields')
+        if not raw_value:
+            return cls(model, schema_cls)
+        requested = {name.strip() for name in raw_value.split(',') if name.strip()}
+        allowed = dumpable_fields(schema_cls)
+        unknown = requested - allowed
+        if unknown:
+            raise FieldSelectionError(
+                f"Unknown field(s) in 'fields': {', '.join(sorted(unknown))}. "
+                f"Allowed: {', '.join(sorted(allowed))}"
+            )
+        if 'id' in allowed:
+            requested.add('id')
+        return cls(model, schema_cls, tuple(sorted(requested)))
+
+    def _load_only_columns(self):
+        """Column attributes backing the selected fields, or None if they can't be determined."""
+        mapper = inspect(self.model)
+        columns = []
+        for name in self.fields:
+            if name in mapper.column_attrs:
+                columns.append(getattr(self.model, name))
+            elif name in mapper.relationships:
+                # Keep the foreign keys the relationship needs in order to load
+                for column in mapper.relationships[name].local_columns:
+                    columns.append(getattr(self.model, mapper.get_property_by_column(column).key))
+            else:
+                return None # A computed field may read any column
+        return columns
+
+    def apply(self, query):
+        """Adds load_only() for the selected fields to an ORM query."""
+        if self.fields is None:
+            return query
+        columns = self._load_only_columns()
+        if not columns:
+            return query
+        version_column = inspect(self.model).version_id_col
+        if version_column is not None: # Needed for the ETag even when not requested
+            columns.append(getattr(self.model, inspect(self.model).get_property_by_column(version_column).key))
+        return query.options(load_only(*columns))
+
+    def dump(self, obj, default_schema):
+        """Serializes with ``default_schema``, or with a cached sparse copy of it if fields were selected."""
+        if self.fields is None:
+            return default_schema.dump(obj)
+        return _sparse_schema(self.schema_cls, self.fields, default_schema.many).dump(obj)
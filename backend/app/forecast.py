@@ -0,0 +1,165 @@
+"""Inventory consumption velocity and reorder forecast.
+
+Daily consumption of every stocked item over a rolling window (REORDER_FORECAST_WINDOW_DAYS
+by default) comes from one grouped aggregate of bill items, hot and cold tier alike.
+Smoothing is done in NumPy for all items at once: a day's consumption is weighted by
+0.5 ** (age / REORDER_FORECAST_HALF_LIFE_DAYS), so every item's smoothed daily rate is one
+weighted bincount over the aggregate rows instead of a loop per item. Days until stockout
+is the stock on hand divided by that rate.
+
+Each worker caches forecasts per clinic and window together with the bill state they
+were computed from: the latest bill change, the latest bill deletion and the inventory
+catalog version (bumped by stock movements). A new, edited or deleted bill or a stock
+adjustment makes the next request recompute; otherwise a request costs three index lookups.
+"""
+import threading
+from datetime import timedelta
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import String, cast, func, select, union_all
+
+from .catalog_cache import catalog_version
+from .clinics import current_clinic
+from .database import db
+from .metrics import metrics
+from .models import Bill, BillItem, DeletionLog, InventoryItem
+from .sync import utcnow_naive
+from .tiering import ArchivedBill, ArchivedBillItem, reaches_cold_tier
+
+MAX_CACHED_FORECASTS = 32
+
+_entries = {} # (clinic, window_start, as_of, half_life) -> (bill state, data)
+_lock = threading.Lock()
+
+
+def _bill_state():
+    return (
+        db.session.execute(select(func.max(Bill.updated_at))).scalar(),
+        db.session.execute(select(func.max(DeletionLog.deleted_at)).where(DeletionLog.resource == 'bills')).scalar(),
+        catalog_version('inventory'),
+    )
+
+
+def _consumed(bill_model, item_model, window_start, as_of):
+    return (
+        select(item_model.inventory_item_id.label('item_id'), bill_model.bill_date.label('day'),
+               item_model.quantity.label('quantity'))
+        .join(bill_model, bill_model.id == item_model.bill_id)
+        .where(item_model.inventory_item_id.isnot(None), bill_model.bill_date.between(window_start, as_of))
+    )
+
+
+def _daily_consumption(window_start, as_of):
+    """(item id, 'YYYY-MM-DD', quantity) sums over the window in one grouped query across both tiers.
+
+    Days come back as text and are mapped through a dict of the window's days, which is
+    far cheaper than parsing a date for every row.
+    """
+    consumed = _consumed(Bill, BillItem, window_start, as_of)
+    if reaches_cold_tier('bills', window_start):
+        consumed = union_all(consumed, _consumed(ArchivedBill, ArchivedBillItem, window_start, as_of))
+    consumed = consumed.subquery()
+    # Core execution on the clinic's connection: ORM row handling would double the cost.
+    return db.session.connection(bind_arguments={'mapper': BillItem}).execute(
+        select(consumed.c.item_id, cast(consumed.c.day, String), func.sum(consumed.c.quantity))
+        .group_by(consumed.c.item_id, consumed.c.day)
+    ).all()
+
+
+def _days_from(today, days):
+    return (today + timedelta(days=int(days))).isoformat() if days < 36500 else None # Effectively never
+
+
+def compute_reorder_forecast(window_start, as_of, half_life_days):
+    """Items with usage in the window, soonest stockout first; dates are projected from today's stock."""
+    window_days = (as_of - window_start).days + 1
+    items = db.session.connection(bind_arguments={'mapper': InventoryItem}).execute(
+        select(InventoryItem.id, InventoryItem.name, InventoryItem.category,
+               InventoryItem.quantity_on_hand, InventoryItem.reorder_level).order_by(InventoryItem.id)
+    ).all()
+    item_ids = np.array([item.id for item in items], dtype=np.int64)
+    on_hand = np.array([item.quantity_on_hand for item in items], dtype=np.float64)
+    reorder_level = np.array([item.reorder_level or 0 for item in items], dtype=np.float64)
+
+    rows = _daily_consumption(window_start, as_of)
+    if rows and len(items):
+        consumed_ids, days, quantities = zip(*rows)
+        consumed_ids = np.array(consumed_ids, dtype=np.int64)
+        positions = np.searchsorted(item_ids, consumed_ids).clip(max=len(items) - 1)
+        age_of = {(as_of - timedelta(days=age)).isoformat(): age for age in range(window_days)}
+        ages = np.fromiter((age_of[day] for day in days), dtype=np.int64, count=len(days))
+        quantities = np.array(quantities, dtype=np.float64)
+        known = item_ids[positions] == consumed_ids # Skips items deleted since they were billed
+        positions, ages, quantities = positions[known], ages[known], quantities[known]
+    else:
+        positions = ages = np.zeros(0, dtype=np.int64)
+        quantities = np.zeros(0, dtype=np.float64)
+
+    # Exponentially decaying day weights, normalized so a constant usage of q per day smooths to q.
+    decay = 0.5 ** (np.arange(window_days) / half_life_days)
+    smoothed = np.bincount(positions, weights=quantities * decay[ages], minlength=len(items)) / decay.sum()
+    average = np.bincount(positions, weights=quantities, minlength=len(items)) / window_days
+
+    in_use = smoothed > 0
+    days_left = np.divide(np.maximum(on_hand, 0), smoothed, out=np.zeros_like(smoothed), where=in_use)
+    days_to_reorder = np.divide(np.maximum(on_hand - reorder_level, 0), smoothed,
+                                out=np.zeros_like(smoothed), where=in_use)
+    # Soonest stockout first, ties in item id order.
+    order = np.flatnonzero(in_use)[np.argsort(days_left[in_use], kind='stable')]
+
+    today = utcnow_naive().date()
+    forecast = []
+    for index, left, to_reorder, rate, mean in zip(order.tolist(), days_left[order].tolist(), days_to_reorder[order].tolist(),
+                                                   smoothed[order].tolist(), average[order].tolist()):
+        item = items[index]
+        forecast.append({
+            'id': item.id,
+            'name': item.name,
+            'category': item.category,
+            'quantity_on_hand': item.quantity_on_hand,
+            'reorder_level': item.reorder_level,
+            'average_daily_usage': round(mean, 3),
+            'smoothed_daily_usage': round(rate, 3),
+            'days_until_stockout': round(left, 1),
+            'stockout_date': _days_from(today, left),
+            'reorder_by': _days_from(today, to_reorder),
+        })
+    return {
+        'window_start': window_start.isoformat(),
+        'as_of': as_of.isoformat(),
+        'window_days': window_days,
+        'half_life_days': half_life_days,
+        'items': forecast,
+        'items_without_usage': len(items) - len(forecast),
+    }
+
+
+def reorder_forecast(start_date=None, end_date=None):
+    """The current clinic's reorder forecast, from the cache unless bills or stock changed since it was computed.
+
+    The window ends at ``end_date`` (default today) and starts at ``start_date`` (default
+    REORDER_FORECAST_WINDOW_DAYS earlier). Raises ReportParameterError for an empty window.
+    """
+    config = current_app.config
+    as_of = end_date or utcnow_naive().date()
+    window_start = start_date or as_of - timedelta(days=config['REORDER_FORECAST_WINDOW_DAYS'] - 1)
+    if window_start > as_of:
+        from .reports import ReportParameterError # reports imports this module
+        raise ReportParameterError('start_date must not be after end_date')
+    half_life_days = config['REORDER_FORECAST_HALF_LIFE_DAYS']
+
+    key = (current_clinic(), window_start, as_of, half_life_days)
+    state = _bill_state() # Read before computing, so a concurrent write is never cached as current
+    entry = _entries.get(key)
+    if entry is not None and entry[0] == state:
+        metrics.increment('reorder_forecast.hits')
+        return entry[1]
+    metrics.increment('reorder_forecast.misses')
+    data = compute_reorder_forecast(window_start, as_of, half_life_days)
+    with _lock:
+        _entries.pop(key, None)
+        while len(_entries) >= MAX_CACHED_FORECASTS:
+            _entries.pop(next(iter(_entries)))
+        _entries[key] = (state, data)
+    return data
@@ -0,0 +1,169 @@
+"""Idempotency-Key support for create endpoints.
+
+A client that may retry a POST sends a unique Idempotency-Key header. The first request
+with a key claims it by inserting an 'in_progress' row (unique per user, endpoint and key),
+runs, and stores its response on the row. A retry finds the row with one indexed lookup
+and gets the stored response back without the view running again; a duplicate that
+arrives while the original is still running waits for it to finish. Keys are scoped to
+the clinic database like the rows they protect, and expire after IDEMPOTENCY_TTL_HOURS.
+"""
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import wraps
+from http import HTTPStatus
+
+from flask import current_app, g, jsonify, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy.exc import IntegrityError
+
+from .clinics import current_clinic
+from .database import db
+from .metrics import metrics
+from .models import IdempotencyKey
+from .sync import utcnow_naive
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+POLL_SECONDS = 0.05
+
+
+def _fingerprint():
+    digest = hashlib.sha256(f'{request.method} {request.path}\n'.encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def _error(message, status):
+    response = jsonify({'message': message})
+    response.status_code = status
+    return response
+
+
+def _replay(record):
+    metrics.increment('idempotency.replayed')
+    response = current_app.response_class(record.response_body, status=record.response_status,
+                                          mimetype=record.response_mimetype)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _claim(user_id, endpoint, key, fingerprint):
+    """Returns (record id, None) if this request now owns the key, else (None, response to send)."""
+    deadline = time.monotonic() + current_app.config['IDEMPOTENCY_WAIT_SECONDS']
+    while True:
+        now = utcnow_naive()
+        record = IdempotencyKey.query.filter_by(user_id=user_id, endpoint=endpoint, key=key).first()
+        if record is not None and record.expires_at <= now:
+            db.session.delete(record) # Not purged yet; treat as unused
+            db.session.commit()
+            record = None
+        if record is None:
+            record = IdempotencyKey(user_id=user_id, endpoint=endpoint, key=key, fingerprint=fingerprint,
+                                    expires_at=now + timedelta(hours=current_app.config['IDEMPOTENCY_TTL_HOURS']))
+            db.session.add(record)
+            try:
+                db.session.commit()
+                return record.id, None
+            except IntegrityError:
+                db.session.rollback() # A concurrent duplicate claimed it first; look again
+                continue
+
+        if record.fingerprint != fingerprint:
+            return None, _error(f'{HEADER} was already used for a different request.', HTTPStatus.UNPROCESSABLE_ENTITY)
+        if record.status == 'completed':
+            return None, _replay(record)
+        if time.monotonic() >= deadline:
+            return None, _error(f'A request with this {HEADER} is still being processed. Retry later.',
+                                HTTPStatus.CONFLICT)
+        db.session.rollback() # End the read so the next poll sees the original request's commit
+        time.sleep(POLL_SECONDS)
+
+
+def _complete(record_id, response):
+    db.session.execute(
+        db.update(IdempotencyKey).where(IdempotencyKey.id == record_id).values(
+            status='completed', response_status=response.status_code,
+            response_mimetype=response.mimetype, response_body=response.get_data()
+        )
+    )
+    db.session.commit()
+
+
+def _release(record_id):
+    """Drops the claim of a request that failed server-side, so a retry runs it again."""
+    db.session.rollback()
+    db.session.execute(db.delete(IdempotencyKey).where(IdempotencyKey.id == record_id))
+    db.session.commit()
+
+
+def idempotent(view):
+    """Makes a POST view replay its stored response for a repeated Idempotency-Key.
+
+    Requests without the header run as usual. Responses below 500 are stored; a 5xx or an
+    exception releases the key. Apply under @jwt_required().
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return _error(f'{HEADER} must be at most {MAX_KEY_LENGTH} characters.', HTTPStatus.BAD_REQUEST)
+
+        _schedule_purge()
+        record_id, response = _claim(str(get_jwt_identity()), request.endpoint, key, _fingerprint())
+        if response is not None:
+            return response
+
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except Exception:
+            _release(record_id)
+            raise
+        if response.status_code >= 500:
+            _release(record_id)
+        else:
+            _complete(record_id, response)
+        return response
+    return wrapper
+
+
+def purge_expired_keys():
+    """Deletes expired keys in the current clinic. Returns the number of rows removed."""
+    result = db.session.execute(db.delete(IdempotencyKey).where(IdempotencyKey.expires_at <= utcnow_naive()))
+    db.session.commit()
+    return result.rowcount
+
+
+def _purge_in_background(app, clinic):
+    with app.app_context():
+        g.clinic = clinic
+        try:
+            removed = purge_expired_keys()
+            metrics.increment('idempotency.purged', removed)
+        except Exception as e:
+            db.session.rollback()
+            app.logger.warning(f"Purging expired idempotency keys for clinic {clinic} failed: {e}")
+
+
+def _schedule_purge():
+    """Queues a purge of the current clinic's expired keys, at most once per purge interval."""
+    state = current_app.extensions['idempotency']
+    clinic = current_clinic()
+    now = time.monotonic()
+    with state['lock']:
+        if now - state['last_purge'].get(clinic, float('-inf')) < current_app.config['IDEMPOTENCY_PURGE_INTERVAL_SECONDS']:
+            return
+        state['last_purge'][clinic] = now
+    state['executor'].submit(_purge_in_background, current_app._get_current_object(), clinic)
+
+
+def init_app(app):
+    app.extensions['idempotency'] = {
+        'executor': ThreadPoolExecutor(max_workers=1, thread_name_prefix='idempotency-purge'),
+        'last_purge': {},
+        'lock': threading.Lock(),
+    }
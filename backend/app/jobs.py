@@ -0,0 +1,142 @@
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from flask import current_app, g
+
+from .clinics import current_clinic
+from .database import db
+from .models import ReportJob
+from .reports import build_report, parse_date
+from .sync import utcnow_naive
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+def init_app(app):
+    """Creates the bounded worker pool that runs report jobs for this app.
+
+    The pool size caps how many heavy reports run at once, leaving the rest of
+    the process (and the database) free for interactive requests.
+    """
+    app.extensions['report_jobs'] = ThreadPoolExecutor(
+        max_workers=app.config['REPORT_JOB_MAX_WORKERS'],
+        thread_name_prefix='report-job'
+    )
+
+
+def results_dir(app):
+    return os.path.join(app.instance_path, 'report_jobs')
+
+
+def _abandoned_before():
+    return utcnow_naive() - timedelta(minutes=current_app.config['REPORT_JOB_TIMEOUT_MINUTES'])
+
+
+def count_active_jobs():
+    """Queued and running jobs, not counting ones abandoned by a restart or crash."""
+    return ReportJob.query.filter(
+        ReportJob.status.in_(ACTIVE_STATUSES), ReportJob.created_at >= _abandoned_before()
+    ).count()
+
+
+def submit_report_job(report_type, params, user_id):
+    """Persists a queued job and hands it to the worker pool. Returns the ReportJob."""
+    app = current_app._get_current_object()
+    purge_expired_jobs()
+    job = ReportJob(id=uuid.uuid4().hex, report_type=report_type, params=json.dumps(params), created_by=user_id,
+                    clinic=current_clinic())
+    db.session.add(job)
+    db.session.commit()
+    app.extensions['report_jobs'].submit(_run_job, app, job.id)
+    return job
+
+
+def fail_abandoned_jobs():
+    """Marks jobs still queued or running REPORT_JOB_TIMEOUT_MINUTES after submission as failed.
+
+    Their worker died with the process that ran them, so nothing else would ever finish
+    them; failing them gives them an expiry so purge_expired_jobs() removes them in time.
+    """
+    now = utcnow_naive()
+    retention = timedelta(hours=current_app.config['REPORT_JOB_RETENTION_HOURS'])
+    db.session.execute(
+        db.update(ReportJob)
+        .where(ReportJob.status.in_(ACTIVE_STATUSES), ReportJob.created_at < _abandoned_before())
+        .values(status='failed', error='The job did not finish; its worker was stopped.',
+                finished_at=now, expires_at=now + retention)
+    )
+    db.session.commit()
+
+
+def purge_expired_jobs():
+    """Deletes finished jobs past their retention window, along with their result files."""
+    fail_abandoned_jobs()
+    expired_jobs = ReportJob.query.filter(ReportJob.expires_at < utcnow_naive()).all()
+    for job in expired_jobs:
+        if job.result_path and os.path.exists(job.result_path):
+            try:
+                os.remove(job.result_path)
+            except OSError as e:
+                current_app.logger.warning(f"Could not remove expired report result {job.result_path}: {e}")
+                continue # Keep the row so the file is retried next time
+        db.session.delete(job)
+    if expired_jobs:
+        db.session.commit()
+
+
+def _set_progress(job_id, percent):
+    db.session.execute(
+        db.update(ReportJob).where(ReportJob.id == job_id).values(progress=max(0, min(int(percent), 99)))
+    )
+    db.session.commit()
+
+
+def _finish(job, **values):
+    now = utcnow_naive()
+    retention = timedelta(hours=current_app.config['REPORT_JOB_RETENTION_HOURS'])
+    for key, value in values.items():
+        setattr(job, key, value)
+    job.finished_at = now
+    job.expires_at = now + retention
+    db.session.commit()
+
+
+def _run_job(app, job_id):
+    """Worker-thread entry point: runs the report and stores its result file."""
+    with app.app_context():
+        job = db.session.get(ReportJob, job_id)
+        if job is None:
+            return
+        g.clinic = job.clinic # Route the report's queries to the clinic that requested it
+        job.status = 'running'
+        job.started_at = utcnow_naive()
+        job.progress = 1
+        db.session.commit()
+
+        try:
+            params = json.loads(job.params or '{}')
+            data = build_report(
+                job.report_type,
+                parse_date(params.get('start_date')),
+                parse_date(params.get('end_date')),
+                progress=lambda percent: _set_progress(job_id, percent)
+            )
+            report = {'report_type': job.report_type, 'filters': params, 'data': data}
+
+            os.makedirs(results_dir(app), exist_ok=True)
+            result_path = os.path.join(results_dir(app), f'{job_id}.json')
+            tmp_path = f'{result_path}.tmp'
+            with open(tmp_path, 'w') as result_file:
+                json.dump(report, result_file, default=str)
+            os.replace(tmp_path, result_path) # Readers never see a half-written file
+
+            _finish(job, status='succeeded', progress=100, result_path=result_path)
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Report job {job_id} failed: {str(e)}", exc_info=True)
+            job = db.session.get(ReportJob, job_id)
+            if job is not None:
+                _finish(job, status='failed', error=str(e))
@@ -0,0 +1,44 @@
+import threading
+
+
+class Metrics:
+    """In-process counters and summaries (count/sum/min/max) keyed by dotted name.
+
+    Values are per worker process; GET /api/admin/metrics returns a snapshot.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._summaries = {}
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        with self._lock:
+            summary = self._summaries.get(name)
+            if summary is None:
+                self._summaries[name] = {'count': 1, 'sum': value, 'min': value, 'max': value}
+            else:
+                summary['count'] += 1
+                summary['sum'] += value
+                summary['min'] = min(summary['min'], value)
+                summary['max'] = max(summary['max'], value)
+
+    def snapshot(self):
+        with self._lock:
+            summaries = {
+                name: dict(summary, avg=summary['sum'] / summary['count'])
+                for name, summary in self._summaries.items()
+            }
+            return {'counters': dict(self._counters), 'summaries': summaries}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._summaries.clear()
+
+
+metrics = Metrics()
@@ -9,6 +9,7 @@ class User(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
     role = db.Column(db.String(50), nullable=False, default='receptionist') # e.g., 'admin', 'doctor', 'receptionist'
+    clinic = db.Column(db.String(50), nullable=True) # Home clinic, issued in the JWT; None means the default clinic
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
@@ -26,15 +27,31 @@ class Patient(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     full_name = db.Column(db.String(150), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=True) # Email might be optional
-    phone = db.Column(db.String(20), nullable=False)
+    phone = db.Column(db.String(20), nullable=False, index=True) # Duplicate checks in create/update_patient
     date_of_birth = db.Column(db.Date, nullable=True)
     address = db.Column(db.Text, nullable=True)
     medical_history_summary = db.Column(db.Text, nullable=True)
+    is_archived = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    archived_at = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), index=True) # Indexed for ?updated_since delta sync
+    version_id = db.Column(db.Integer, nullable=False, server_default='1') # Optimistic concurrency; served as the ETag
+    # Blocking keys for duplicate detection, maintained by app/duplicates.py
+    phone_key = db.Column(db.String(20), nullable=True, index=True) # Phone digits, without country/trunk prefix
+    name_key = db.Column(db.String(60), nullable=True) # Sorted Soundex codes of the name's words
+
+    __table_args__ = (
+        # Partial index: the default patient list reads active rows in name order without touching archived ones.
+        db.Index('ix_patients_active_full_name', 'full_name',
+                 sqlite_where=db.text('is_archived = 0'), postgresql_where=db.text('is_archived = false')),
+        db.Index('ix_patients_name_key_date_of_birth', 'name_key', 'date_of_birth'), # Duplicate-detection block
+    )
 
     appointments = db.relationship('Appointment', backref='patient', lazy=True, cascade="all, delete-orphan")
     bills = db.relationship('Bill', backref='patient', lazy=True, cascade="all, delete-orphan")
+    appointment_series = db.relationship('AppointmentSeries', backref='patient', lazy=True, cascade="all, delete-orphan")
+
+    __mapper_args__ = {'version_id_col': version_id}
 
     def __repr__(self):
         return f'<Patient {self.full_name}>'
@@ -48,9 +65,10 @@ class Doctor(db.Model):
     phone = db.Column(db.String(20), nullable=True)
     availability_notes = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), index=True) # Indexed for ?updated_since delta sync
 
     appointments = db.relationship('Appointment', backref='doctor', lazy=True)
+    appointment_series = db.relationship('AppointmentSeries', backref='doctor', lazy=True)
 
     def __repr__(self):
         return f'<Doctor {self.full_name}>'
@@ -60,30 +78,75 @@ class Appointment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), nullable=False)
-    appointment_datetime = db.Column(db.DateTime, nullable=False)
+    appointment_datetime = db.Column(db.DateTime, nullable=False, index=True) # Range scans for calendar views
     status = db.Column(db.String(50), nullable=False, default='Scheduled') # e.g., 'Scheduled', 'Confirmed', 'Cancelled', 'Completed'
     notes = db.Column(db.Text, nullable=True)
+    series_id = db.Column(db.Integer, db.ForeignKey('appointment_series.id', name='fk_appointments_series_id'), nullable=True, index=True) # Set for recurring bookings
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), index=True) # Indexed for ?updated_since delta sync
+    version_id = db.Column(db.Integer, nullable=False, server_default='1') # Optimistic concurrency; served as the ETag
+
+    __table_args__ = (
+        db.Index('ix_appointments_patient_datetime', 'patient_id', 'appointment_datetime'), # Per-patient history
+        db.Index('ix_appointments_doctor_datetime', 'doctor_id', 'appointment_datetime'), # Doctor calendars, conflict checks
+        {'sqlite_autoincrement': True}, # Ids of rows moved to the cold tier are never reused (see app/tiering.py)
+    )
+
+    __mapper_args__ = {'version_id_col': version_id}
 
     def __repr__(self):
         return f'<Appointment {self.id} - Patient {self.patient_id} with Dr. {self.doctor_id} on {self.appointment_datetime}>'
 
+class AppointmentSeries(db.Model):
+    """A recurring booking rule; its occurrences are ordinary Appointment rows with series_id set."""
+    __tablename__ = 'appointment_series'
+    id = db.Column(db.Integer, primary_key=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False, index=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), nullable=False, index=True)
+    start_datetime = db.Column(db.DateTime, nullable=False)
+    freq = db.Column(db.String(10), nullable=False) # 'DAILY', 'WEEKLY', 'MONTHLY'
+    interval = db.Column(db.Integer, nullable=False, default=1)
+    count = db.Column(db.Integer, nullable=True)
+    until = db.Column(db.DateTime, nullable=True)
+    byweekday = db.Column(db.String(20), nullable=True) # Comma-separated weekday numbers, 0=Monday
+    status = db.Column(db.String(20), nullable=False, default='Active') # 'Active', 'Cancelled'
+    notes = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    appointments = db.relationship('Appointment', backref='series', lazy=True)
+
+    @property
+    def rule(self):
+        return {
+            'freq': self.freq,
+            'interval': self.interval,
+            'count': self.count,
+            'until': self.until,
+            'byweekday': [int(day) for day in self.byweekday.split(',')] if self.byweekday else None,
+        }
+
+    def __repr__(self):
+        return f'<AppointmentSeries {self.id} {self.freq} for Patient {self.patient_id}>'
+
 class InventoryItem(db.Model):
     __tablename__ = 'inventory_items'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(150), nullable=False, unique=True)
-    category = db.Column(db.String(100), nullable=True)
+    category = db.Column(db.String(100), nullable=True, index=True)
     description = db.Column(db.Text, nullable=True)
     quantity_on_hand = db.Column(db.Integer, nullable=False, default=0)
     reorder_level = db.Column(db.Integer, nullable=True, default=0)
     unit_price = db.Column(db.Numeric(10, 2), nullable=False) # Using Numeric for currency
     supplier_info = db.Column(db.String(255), nullable=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), index=True) # Indexed for ?updated_since delta sync
+    version_id = db.Column(db.Integer, nullable=False, server_default='1') # Optimistic concurrency; served as the ETag
 
     bill_items = db.relationship('BillItem', backref='inventory_item', lazy=True)
 
+    __mapper_args__ = {'version_id_col': version_id}
+
     def __repr__(self):
         return f'<InventoryItem {self.name}>'
 
@@ -91,27 +154,167 @@ class Bill(db.Model):
     __tablename__ = 'bills'
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False)
-    bill_date = db.Column(db.Date, nullable=False, default=lambda: datetime.now(timezone.utc).date())
+    bill_date = db.Column(db.Date, nullable=False, default=lambda: datetime.now(timezone.utc).date(), index=True) # Date-range listings
     total_amount = db.Column(db.Numeric(10, 2), nullable=False, default=0.00)
     payment_status = db.Column(db.String(50), nullable=False, default='Unpaid') # e.g., 'Unpaid', 'Paid', 'Partially Paid'
     notes = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), index=True) # Indexed for ?updated_since delta sync
+    version_id = db.Column(db.Integer, nullable=False, server_default='1') # Optimistic concurrency; served as the ETag
 
     bill_items = db.relationship('BillItem', backref='bill', lazy=True, cascade="all, delete-orphan")
 
+    __table_args__ = (
+        db.Index('ix_bills_patient_bill_date', 'patient_id', 'bill_date'), # Per-patient history
+        db.Index('ix_bills_status_bill_date', 'payment_status', 'bill_date'), # Revenue report
+        {'sqlite_autoincrement': True}, # Ids of rows moved to the cold tier are never reused (see app/tiering.py)
+    )
+
+    __mapper_args__ = {'version_id_col': version_id}
+
     def __repr__(self):
         return f'<Bill {self.id} for Patient {self.patient_id}>'
 
 class BillItem(db.Model):
     __tablename__ = 'bill_items'
     id = db.Column(db.Integer, primary_key=True)
-    bill_id = db.Column(db.Integer, db.ForeignKey('bills.id'), nullable=False)
-    inventory_item_id = db.Column(db.Integer, db.ForeignKey('inventory_items.id'), nullable=True) # Nullable for services
+    bill_id = db.Column(db.Integer, db.ForeignKey('bills.id'), nullable=False, index=True)
+    inventory_item_id = db.Column(db.Integer, db.ForeignKey('inventory_items.id'), nullable=True, index=True) # Nullable for services
     service_description = db.Column(db.String(255), nullable=True) # For services not in inventory
     quantity = db.Column(db.Integer, nullable=False, default=1)
     unit_price = db.Column(db.Numeric(10, 2), nullable=False)
     sub_total = db.Column(db.Numeric(10, 2), nullable=False) # quantity * unit_price
 
+    __table_args__ = (
+        db.Index('ix_bill_items_bill_item_quantity', 'bill_id', 'inventory_item_id', 'quantity'), # Covers the reorder forecast's join
+        {'sqlite_autoincrement': True}, # Ids of rows moved to the cold tier are never reused (see app/tiering.py)
+    )
+
     def __repr__(self):
         return f'<BillItem {self.id} for Bill {self.bill_id}>'
+
+class DeletionLog(db.Model):
+    """Tombstones for hard-deleted rows, read by ?updated_since delta syncs."""
+    __tablename__ = 'deletion_log'
+    id = db.Column(db.Integer, primary_key=True)
+    resource = db.Column(db.String(20), nullable=False) # e.g., 'patients', 'bills'
+    resource_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        db.Index('ix_deletion_log_resource_deleted_at', 'resource', 'deleted_at'),
+    )
+
+    def __repr__(self):
+        return f'<DeletionLog {self.resource} {self.resource_id}>'
+
+class CatalogVersion(db.Model):
+    """Single row (id=1) of counters bumped on every write to a cached catalog; see app/catalog_cache.py."""
+    __tablename__ = 'catalog_versions'
+    id = db.Column(db.Integer, primary_key=True)
+    doctors = db.Column(db.Integer, nullable=False, default=0)
+    inventory = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<CatalogVersion doctors={self.doctors} inventory={self.inventory}>'
+
+class IdempotencyKey(db.Model):
+    """A client's Idempotency-Key for a POST and the response first returned for it; see app/idempotency.py."""
+    __tablename__ = 'idempotency_keys'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(64), nullable=False)
+    endpoint = db.Column(db.String(100), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False) # sha256 of method, path and body
+    status = db.Column(db.String(20), nullable=False, default='in_progress') # 'in_progress', 'completed'
+    response_status = db.Column(db.Integer, nullable=True)
+    response_mimetype = db.Column(db.String(100), nullable=True)
+    response_body = db.Column(db.LargeBinary, nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'endpoint', 'key', name='uq_idempotency_keys_scope'), # The replay lookup
+    )
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.endpoint} {self.key} {self.status}>'
+
+class AuditEvent(db.Model):
+    """Who viewed or changed a patient, appointment or bill record. Append-only; written by app/audit.py."""
+    __tablename__ = 'audit_events'
+    id = db.Column(db.Integer, primary_key=True)
+    occurred_at = db.Column(db.DateTime, nullable=False)
+    user_id = db.Column(db.String(64), nullable=True) # JWT identity; None for CLI and background jobs
+    action = db.Column(db.String(10), nullable=False) # 'view', 'create', 'update', 'delete'
+    resource = db.Column(db.String(20), nullable=False) # 'patients', 'appointments', 'bills'
+    resource_id = db.Column(db.Integer, nullable=True) # None for listings
+    patient_id = db.Column(db.Integer, nullable=True) # The patient the record belongs to, if known
+    endpoint = db.Column(db.String(100), nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_audit_events_patient_occurred_at', 'patient_id', 'occurred_at'),
+        db.Index('ix_audit_events_resource_occurred_at', 'resource', 'resource_id', 'occurred_at'),
+        db.Index('ix_audit_events_occurred_at', 'occurred_at'),
+    )
+
+    def __repr__(self):
+        return f'<AuditEvent {self.action} {self.resource} {self.resource_id} by {self.user_id}>'
+
+class ReminderOutbox(db.Model):
+    """An appointment reminder waiting for (or done with) delivery; see app/reminders.py."""
+    __tablename__ = 'reminder_outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    appointment_id = db.Column(db.Integer, nullable=False)
+    appointment_datetime = db.Column(db.DateTime, nullable=False) # The slot reminded about; a reschedule gets a new reminder
+    status = db.Column(db.String(20), nullable=False, default='pending') # 'pending', 'sent', 'skipped', 'dead'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('appointment_id', 'appointment_datetime', name='uq_reminder_outbox_appointment_slot'), # Dedup
+        db.Index('ix_reminder_outbox_status_next_attempt', 'status', 'next_attempt_at'), # Delivery polling
+    )
+
+    def __repr__(self):
+        return f'<ReminderOutbox {self.id} appointment={self.appointment_id} {self.status}>'
+
+class ReminderScanState(db.Model):
+    """Single-row watermark of the reminder scan: appointments up to it already have reminders."""
+    __tablename__ = 'reminder_scan_state'
+    id = db.Column(db.Integer, primary_key=True) # Always 1
+    scanned_until = db.Column(db.DateTime, nullable=False) # appointment_datetime watermark
+    last_scan_at = db.Column(db.DateTime, nullable=False) # Start of the last scan, for catching late bookings
+
+class SchedulerLease(db.Model):
+    """A named lease held by one process at a time; the holder runs that scheduler."""
+    __tablename__ = 'scheduler_leases'
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(100), nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<SchedulerLease {self.name} held by {self.holder} until {self.expires_at}>'
+
+class ReportJob(db.Model):
+    """A report run in the background; the result is written to a file in the instance folder."""
+    __tablename__ = 'report_jobs'
+    id = db.Column(db.String(32), primary_key=True) # uuid4 hex
+    report_type = db.Column(db.String(50), nullable=False)
+    params = db.Column(db.Text, nullable=True) # JSON-encoded filters
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True) # 'queued', 'running', 'succeeded', 'failed'
+    progress = db.Column(db.Integer, nullable=False, default=0) # 0-100
+    result_path = db.Column(db.String(255), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    clinic = db.Column(db.String(50), nullable=True) # Clinic whose data the report covers
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=True, index=True) # Retention: purged after this time
+
+    def __repr__(self):
+        return f'<ReportJob {self.id} {self.report_type} {self.status}>'
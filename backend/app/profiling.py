@@ -0,0 +1,204 @@
+"""On-demand profiling of live requests.
+
+With PROFILING_ENABLED, a request is profiled when an admin sends the X-Profile-Request
+header ('sampling' or 'cprofile'; any other value uses PROFILING_MODE), or at random with
+the rate configured for its endpoint in PROFILING_SAMPLE_RATES. The 'sampling' collector
+reads the request thread's stack from a side thread every PROFILING_SAMPLE_INTERVAL_MS
+and writes collapsed stacks (flamegraph.pl / speedscope input); 'cprofile' writes a pstats
+file. Profiles go to instance/profiles and are listed under /api/admin/profiles; the
+file name is returned in the X-Profile-Id response header.
+
+When profiling is disabled no hooks are registered, so requests pay nothing.
+"""
+import cProfile
+import os
+import random
+import re
+import sys
+import threading
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+from flask import current_app, g, request
+from flask_jwt_extended import verify_jwt_in_request
+
+from .metrics import metrics
+from .utils import is_admin
+
+TRIGGER_HEADER = 'X-Profile-Request'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+MODES = {'sampling': 'collapsed', 'cprofile': 'pstats'} # Collector -> file extension
+PROFILE_NAME_RE = re.compile(r'^(?P<started>\d{8}T\d{6})_(?P<endpoint>[\w.]+)_(?P<id>[0-9a-f]{8})\.(?P<format>collapsed|pstats)$')
+
+# cProfile can only run on one thread at a time on newer Pythons (sys.monitoring is global).
+_cprofile_lock = threading.Lock()
+
+
+def profiles_dir(app=None):
+    return os.path.join((app or current_app).instance_path, 'profiles')
+
+
+def _frame_label(code):
+    # Function plus the last two path components keeps labels short but unambiguous.
+    path = code.co_filename.replace('\\', '/').split('/')
+    return f"{code.co_name} ({'/'.join(path[-2:])})"
+
+
+class StackSampler:
+    """Samples one thread's stack at a fixed interval from a daemon thread."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def has_data(self):
+        return bool(self.counts) # Requests shorter than one interval yield no samples
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, 'w') as profile_file:
+            for stack, count in self.counts.most_common():
+                profile_file.write(f'{stack} {count}\n')
+
+
+class CProfileCollector:
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        _cprofile_lock.release()
+
+    def has_data(self):
+        return True
+
+    def write(self, path):
+        self.profile.dump_stats(path)
+
+
+def _requested_mode():
+    """The collector asked for by this request, or None if it should not be profiled."""
+    config = current_app.config
+    header = request.headers.get(TRIGGER_HEADER)
+    if header is not None:
+        try:
+            verify_jwt_in_request(optional=True)
+            admin = is_admin()
+        except Exception:
+            admin = False
+        if admin:
+            return header if header in MODES else config['PROFILING_MODE']
+    rate = config['PROFILING_SAMPLE_RATES'].get(request.endpoint)
+    if rate and random.random() < rate:
+        return config['PROFILING_MODE']
+    return None
+
+
+def start_profile():
+    """before_request hook: starts a collector if this request is selected."""
+    mode = _requested_mode()
+    if mode is None:
+        return
+    if mode == 'cprofile':
+        if not _cprofile_lock.acquire(blocking=False):
+            metrics.increment('profiling.skipped_busy')
+            return
+        collector = CProfileCollector()
+    else:
+        collector = StackSampler(threading.get_ident(), current_app.config['PROFILING_SAMPLE_INTERVAL_MS'] / 1000)
+    started = datetime.now(timezone.utc)
+    g.profile = {
+        'collector': collector,
+        'name': f"{started:%Y%m%dT%H%M%S}_{request.endpoint}_{uuid.uuid4().hex[:8]}.{MODES[mode]}",
+    }
+    collector.start()
+
+
+def finish_profile(response):
+    """after_request hook: stops the collector and writes the profile file."""
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    profile['collector'].stop()
+    if not profile['collector'].has_data():
+        metrics.increment('profiling.empty')
+        return response
+    directory = profiles_dir()
+    try:
+        os.makedirs(directory, exist_ok=True)
+        profile['collector'].write(os.path.join(directory, profile['name']))
+        _enforce_retention(directory)
+    except OSError as e:
+        current_app.logger.warning(f"Could not write profile {profile['name']}: {e}")
+        return response
+    metrics.increment('profiling.profiles_written')
+    response.headers[PROFILE_ID_HEADER] = profile['name']
+    return response
+
+
+def abandon_profile(exc=None):
+    """teardown_request hook: stops a collector that after_request never reached."""
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile['collector'].stop()
+
+
+def _enforce_retention(directory):
+    names = sorted(name for name in os.listdir(directory) if PROFILE_NAME_RE.match(name))
+    for name in names[:-current_app.config['PROFILING_MAX_FILES']]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+
+def list_profiles():
+    """Stored profiles, newest first."""
+    directory = profiles_dir()
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in os.listdir(directory):
+        match = PROFILE_NAME_RE.match(name)
+        if match is None:
+            continue
+        profiles.append({
+            'name': name,
+            'endpoint': match['endpoint'],
+            'format': match['format'],
+            'started_at': datetime.strptime(match['started'], '%Y%m%dT%H%M%S').isoformat(),
+            'size_bytes': os.path.getsize(os.path.join(directory, name)),
+        })
+    profiles.sort(key=lambda profile: profile['name'], reverse=True)
+    return profiles
+
+
+def init_app(app):
+    if not app.config['PROFILING_ENABLED']:
+        return
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+    app.teardown_request(abandon_profile)
@@ -0,0 +1,134 @@
+"""Query-plan regression check for hot API routes.
+
+``flask check-query-plans`` boots a throwaway app on an in-memory SQLite database,
+seeds a little data, calls each probe route below while capturing every SQL statement
+it issues, and runs ``EXPLAIN QUERY PLAN`` on each one. It exits non-zero if any
+statement falls back to a full table scan that the probe does not explicitly allow,
+so a dropped or unused index shows up in CI instead of in production.
+"""
+import re
+import sys
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import click
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+from .database import db
+
+# A plan row like "SCAN patients" (no index). "SCAN patients USING INDEX ..." is fine.
+FULL_SCAN_PATTERN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+EXPLAINABLE_PREFIXES = ('SELECT', 'UPDATE', 'DELETE', 'INSERT INTO deletion_log')
+
+# (method, path, json body, tables on which a full scan is acceptable for this route).
+# {recent} is replaced with a timestamp inside the delta-sync retention window.
+HOT_ROUTE_PROBES = [
+    ('GET', '/api/patients/1', None, set()),
+    ('GET', '/api/patients/1/overview', None, set()),
+    ('POST', '/api/patients', {'full_name': 'Probe Patient', 'phone': '555-0100', 'email': 'probe@example.com'}, set()),
+    ('PUT', '/api/patients/1', {'phone': '555-0199', 'email': 'changed@example.com'}, set()),
+    ('GET', '/api/patients?updated_since={recent}', None, set()),
+    ('GET', '/api/appointments?updated_since={recent}', None, set()),
+    ('GET', '/api/appointments/calendar?from=2026-01-01&to=2026-02-01', None, set()),
+    ('GET', '/api/appointments/calendar?from=2026-01-01&to=2026-02-01&doctor_id=1', None, set()),
+    ('GET', '/api/bills?patient_id=1', None, set()),
+    ('GET', '/api/bills?start_date=2026-01-01&end_date=2026-01-31', None, set()),
+    ('GET', '/api/inventory?category_exact=Medication', None, set()),
+    ('GET', '/api/inventory?category=Medic', None, {'inventory_items'}), # Substring match: no index applies
+    ('GET', '/api/reports/generate?report_type=revenue&start_date=2026-01-01&end_date=2026-01-31', None, set()),
+    ('GET', '/api/reports/generate?report_type=appointments_summary&start_date=2026-01-01&end_date=2026-01-31', None, set()),
+    ('GET', '/api/reports/generate?report_type=reorder_forecast&start_date=2026-01-01&end_date=2026-01-31', None, {'inventory_items'}),
+    ('GET', '/api/reports/generate?report_type=doctor_utilization&start_date=2026-01-01&end_date=2026-01-31', None, set()),
+    ('PATCH', '/api/appointments/bulk', {'filter': {'doctor_id': 1, 'from': '2026-01-01', 'to': '2026-01-02'}, 'changes': {'status': 'Completed'}}, set()),
+    ('PATCH', '/api/bills/bulk', {'filter': {'patient_id': 1}, 'changes': {'notes': 'Reviewed'}}, set()),
+    ('DELETE', '/api/bills/2', None, set()),
+    ('GET', '/api/admin/audit?patient_id=1&since=2026-01-01T00:00:00', None, set()),
+    ('GET', '/api/admin/audit?resource=bills&resource_id=2', None, set()),
+]
+
+
+def _seed():
+    """Inserts a few rows per table; the planner's choices don't depend on volume without ANALYZE."""
+    from .models import User, Patient, Doctor, Appointment, InventoryItem, Bill, BillItem
+
+    admin = User(username='plan-probe', email='plan-probe@example.com', role='admin')
+    admin.set_password('plan-probe')
+    db.session.add(admin)
+    for index in range(3):
+        db.session.add(Patient(full_name=f'Patient {index}', phone=f'555-000{index}', email=f'p{index}@example.com'))
+        db.session.add(Doctor(full_name=f'Doctor {index}', email=f'd{index}@example.com'))
+        db.session.add(InventoryItem(name=f'Item {index}', category='Medication', quantity_on_hand=50,
+                                     reorder_level=5, unit_price=Decimal('4.00')))
+    db.session.flush()
+    for index in range(6):
+        db.session.add(Appointment(patient_id=1 + index % 3, doctor_id=1 + index % 3,
+                                   appointment_datetime=datetime(2026, 1, 1, 9) + timedelta(days=index)))
+        db.session.add(Bill(patient_id=1 + index % 3, bill_date=date(2026, 1, 1) + timedelta(days=index),
+                            total_amount=Decimal('8.00'), bill_items=[
+                                BillItem(inventory_item_id=1, quantity=2, unit_price=Decimal('4.00'), sub_total=Decimal('8.00'))
+                            ]))
+    db.session.commit()
+    return admin.id
+
+
+def full_scans(connection, statement, parameters):
+    """Returns the tables EXPLAIN QUERY PLAN reports as scanned without an index.
+
+    Scans of derived tables (subqueries in FROM, e.g. "SCAN anon_1") read rows the
+    statement already produced and are not reported.
+    """
+    plan = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+    return [match.group(1) for match in (FULL_SCAN_PATTERN.match(row[-1]) for row in plan)
+            if match and match.group(1) in db.metadata.tables]
+
+
+def run_probes(app):
+    """Runs HOT_ROUTE_PROBES against ``app`` and returns a list of violation strings."""
+    violations = []
+    with app.app_context():
+        db.create_all()
+        user_id = _seed()
+        headers = {'Authorization': f'Bearer {create_access_token(identity=user_id)}'}
+        client = app.test_client()
+        recent = (datetime.utcnow() - timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        for method, path, body, allowed_scans in HOT_ROUTE_PROBES:
+            captured = []
+
+            def capture(conn, cursor, statement, parameters, context, executemany):
+                if not executemany and statement.lstrip().upper().startswith(EXPLAINABLE_PREFIXES):
+                    captured.append((statement, parameters))
+
+            event.listen(db.engine, 'before_cursor_execute', capture)
+            try:
+                response = client.open(path.format(recent=recent), method=method, json=body, headers=headers)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', capture)
+            if response.status_code >= 400:
+                violations.append(f'{method} {path}: probe request failed with HTTP {response.status_code}')
+                continue
+
+            with db.engine.connect() as connection:
+                for statement, parameters in captured:
+                    for table in full_scans(connection, statement, parameters):
+                        if table not in allowed_scans:
+                            violations.append(f'{method} {path}: full scan of {table} in: {" ".join(statement.split())}')
+    return violations
+
+
+@click.command('check-query-plans')
+def check_query_plans_command():
+    """Fail if a hot route's SQL falls back to a full table scan."""
+    from . import create_app # Local import: this module is loaded by create_app itself
+
+    # No rate limiting: the report probes alone exceed the 'expensive' budget's burst.
+    probe_app = create_app('testing', config_overrides={'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+                                                        'RATELIMIT_ENABLED': False})
+    violations = run_probes(probe_app)
+    if violations:
+        for violation in violations:
+            click.echo(violation, err=True)
+        click.echo(f'{len(violations)} query plan regression(s) found.', err=True)
+        sys.exit(1)
+    click.echo(f'All {len(HOT_ROUTE_PROBES)} hot route probes use indexed access paths.')
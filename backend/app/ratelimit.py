@@ -0,0 +1,197 @@
+"""Admission control for /api/*: token-bucket rate limits plus per-client concurrency caps.
+
+Each request is charged to a bucket keyed by client (JWT identity, or IP address for
+anonymous calls) and endpoint. Endpoints listed in RATELIMIT_ENDPOINT_BUDGETS draw on
+a named budget with its own rate, burst and concurrency; everything else uses the
+'default' budget. Rejected requests get 429 with Retry-After.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from http import HTTPStatus
+
+from flask import current_app, g, jsonify, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+
+from .metrics import metrics
+
+EXEMPT_ENDPOINTS = {'health_check', 'static', 'serve_react_app'}
+
+
+class MemoryBackend:
+    """Per-process token buckets. Each worker enforces the budget on its own."""
+
+    # Once the table grows past MAX_KEYS, buckets idle for IDLE_SECONDS are dropped
+    # (at most once per IDLE_SECONDS). A dropped bucket simply starts full again.
+    MAX_KEYS = 50000
+    IDLE_SECONDS = 300
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._last_prune = time.monotonic()
+
+    def take(self, key, rate, burst):
+        """Takes one token; returns 0 if admitted, else seconds until a token is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                if len(self._buckets) > self.MAX_KEYS and now - self._last_prune > self.IDLE_SECONDS:
+                    self._prune(now)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+
+    def _prune(self, now):
+        self._buckets = {
+            key: (tokens, updated) for key, (tokens, updated) in self._buckets.items()
+            if now - updated < self.IDLE_SECONDS
+        }
+        self._last_prune = now
+
+
+class SQLiteBackend:
+    """Token buckets in a SQLite file shared by all workers on the host.
+
+    Each decision is one short IMMEDIATE transaction. The file only holds transient
+    state, so it runs with synchronous=OFF. If the file is locked or unavailable the
+    request is admitted rather than failed.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local()
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)'
+        )
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=0.05, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            self._local.connection = connection
+        return connection
+
+    def take(self, key, rate, burst):
+        now = time.time() # Wall clock: monotonic clocks aren't comparable across processes
+        connection = self._connection()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = connection.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + max(0.0, now - row[1]) * rate)
+                admitted = tokens >= 1
+                connection.execute(
+                    'INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) '
+                    'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                    (key, tokens - 1 if admitted else tokens, now)
+                )
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            current_app.logger.warning(f"Rate limiter store unavailable, admitting request: {e}")
+            return 0.0
+        return 0.0 if admitted else (1 - tokens) / rate
+
+
+class ConcurrencyLimiter:
+    """Counts in-flight requests per key within this process."""
+
+    def __init__(self):
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key, limit):
+        with self._lock:
+            count = self._in_flight.get(key, 0)
+            if count >= limit:
+                return False
+            self._in_flight[key] = count + 1
+            return True
+
+    def release(self, key):
+        with self._lock:
+            count = self._in_flight.get(key, 0) - 1
+            if count > 0:
+                self._in_flight[key] = count
+            else:
+                self._in_flight.pop(key, None)
+
+
+class RateLimiter:
+    def __init__(self, backend):
+        self.backend = backend
+        self.concurrency = ConcurrencyLimiter()
+
+
+def _client_id():
+    """JWT identity if the request carries a valid token, else the remote address."""
+    try:
+        identity = get_jwt_identity() # Already verified, e.g. a batch sub-request
+    except RuntimeError:
+        identity = None
+    if identity is None:
+        try:
+            verify_jwt_in_request(optional=True, verify_type=False)
+            identity = get_jwt_identity()
+        except Exception: # Invalid or expired: the view's own check reports it
+            identity = None
+    return f'user:{identity}' if identity is not None else f'ip:{request.remote_addr}'
+
+
+def _too_many_requests(retry_after, budget_name):
+    metrics.increment(f'ratelimit.rejected.{budget_name}')
+    response = jsonify({'message': 'Too many requests. Please slow down and retry later.'})
+    response.status_code = HTTPStatus.TOO_MANY_REQUESTS
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def admit_request():
+    """before_request hook: charges the request to its bucket and concurrency slot."""
+    config = current_app.config
+    if (not config['RATELIMIT_ENABLED'] or request.method == 'OPTIONS'
+            or request.endpoint is None or request.endpoint in EXEMPT_ENDPOINTS):
+        return None
+
+    budget_name = config['RATELIMIT_ENDPOINT_BUDGETS'].get(request.endpoint, 'default')
+    budget = config['RATELIMIT_BUDGETS'][budget_name]
+    key = f'{_client_id()}|{request.endpoint}'
+    limiter = current_app.extensions['ratelimit']
+
+    started = time.perf_counter()
+    retry_after = limiter.backend.take(key, budget['rate'], budget['burst'])
+    admitted = not retry_after and limiter.concurrency.acquire(key, budget['concurrency'])
+    metrics.observe('ratelimit.decision_seconds', time.perf_counter() - started)
+
+    if retry_after:
+        return _too_many_requests(retry_after, budget_name)
+    if not admitted:
+        return _too_many_requests(1, budget_name)
+    g.ratelimit_slot = key
+    return None
+
+
+def release_request(exc=None):
+    key = g.pop('ratelimit_slot', None)
+    if key is not None:
+        current_app.extensions['ratelimit'].concurrency.release(key)
+
+
+def init_app(app):
+    if app.config['RATELIMIT_BACKEND'] == 'sqlite':
+        backend = SQLiteBackend(os.path.join(app.instance_path, 'ratelimit.sqlite'))
+    else:
+        backend = MemoryBackend()
+    app.extensions['ratelimit'] = RateLimiter(backend)
+    app.before_request(admit_request)
+    app.teardown_request(release_request)
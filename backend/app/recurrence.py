@@ -0,0 +1,76 @@
+import calendar
+from bisect import bisect_left
+from datetime import timedelta
+
+FREQUENCIES = ('DAILY', 'WEEKLY', 'MONTHLY')
+
+
+def _add_months(dt, months):
+    """Returns dt shifted by whole months, or None if that month lacks dt's day (RFC 5545 behaviour)."""
+    month_index = dt.month - 1 + months
+    year, month = dt.year + month_index // 12, month_index % 12 + 1
+    if dt.day > calendar.monthrange(year, month)[1]:
+        return None
+    return dt.replace(year=year, month=month)
+
+
+def expand_rule(start, freq, interval=1, count=None, until=None, byweekday=None, limit=None):
+    """Expands an RRULE-like rule into a sorted list of occurrence datetimes.
+
+    freq is 'DAILY', 'WEEKLY' or 'MONTHLY'; byweekday (0=Monday) applies to WEEKLY
+    rules and defaults to start's weekday. Expansion stops at count, at until
+    (inclusive), or at limit occurrences, whichever comes first. No occurrence
+    precedes start.
+    """
+    if count is None and until is None and limit is None:
+        raise ValueError('A recurrence rule needs count, until or a limit')
+    max_occurrences = min((value for value in (count, limit) if value is not None), default=float('inf'))
+    occurrences = []
+
+    def emit(dt):
+        if until is not None and dt > until:
+            return False
+        occurrences.append(dt)
+        return len(occurrences) < max_occurrences
+
+    if freq == 'DAILY':
+        step = 0
+        while emit(start + timedelta(days=step * interval)):
+            step += 1
+    elif freq == 'WEEKLY':
+        weekdays = sorted(set(byweekday)) if byweekday else [start.weekday()]
+        week_start = start - timedelta(days=start.weekday())
+        while True:
+            for weekday in weekdays:
+                candidate = week_start + timedelta(days=weekday)
+                if candidate < start:
+                    continue
+                if not emit(candidate):
+                    return occurrences
+            week_start += timedelta(weeks=interval)
+    elif freq == 'MONTHLY':
+        step = 0
+        while True:
+            candidate = _add_months(start, step * interval)
+            step += 1
+            if candidate is not None and not emit(candidate):
+                break
+            if candidate is None and until is not None and _add_months(start.replace(day=1), step * interval) > until:
+                break
+    else:
+        raise ValueError(f'Unsupported frequency: {freq}')
+    return occurrences
+
+
+def find_conflicts(occurrences, booked, slot):
+    """Returns the occurrences that fall within ``slot`` of an already booked datetime.
+
+    ``booked`` must be sorted; each lookup is a binary search, so checking a whole
+    series costs one range query plus O(n log m) in memory.
+    """
+    conflicts = []
+    for occurrence in occurrences:
+        index = bisect_left(booked, occurrence - slot)
+        if index < len(booked) and booked[index] < occurrence + slot:
+            conflicts.append(occurrence)
+    return conflicts
@@ -0,0 +1,309 @@
+"""Appointment reminders.
+
+A scheduler thread in every serving process ticks each REMINDER_POLL_SECONDS; only the
+process holding the 'reminders' row in scheduler_leases (main database) does any work, so
+several workers never scan or send twice. The thread is started by run.py (or by a WSGI
+entry point calling start_reminder_scheduler()), never by create_app, so CLI commands
+such as ``flask db upgrade`` don't run one; ``flask run-reminders`` runs the loop in the
+foreground for deployments that keep it out of the web workers. A lease expires REMINDER_LEASE_SECONDS after
+its last renewal, letting another worker take over when the holder dies.
+
+Per clinic, a tick first queues reminders into reminder_outbox: appointments starting
+within REMINDER_LEAD_HOURS are found by a range scan on the indexed appointment_datetime
+from the watermark in reminder_scan_state, which then moves forward, so each
+appointment is scanned once. Appointments booked or rescheduled behind the watermark
+are picked up through the updated_at index. An outbox row is unique per appointment
+and slot, which deduplicates rescans and gives a rescheduled appointment a fresh
+reminder. The tick then hands due outbox rows to the configured sender; failures are
+retried with exponential backoff and parked as 'dead' after REMINDER_MAX_ATTEMPTS.
+Delivery is at-least-once: messages carry reminder_id for deduplication downstream.
+"""
+import atexit
+import json
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, g
+from sqlalchemy import or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+
+from .database import db
+from .metrics import metrics
+from .models import Appointment, ReminderOutbox, ReminderScanState, SchedulerLease
+from .sync import utcnow_naive
+
+LEASE_NAME = 'reminders'
+REMINDABLE_STATUSES = ('Scheduled', 'Confirmed')
+
+
+class FileSender:
+    """Appends reminders as JSON lines to instance/reminders/<YYYYMMDD>.jsonl; a stand-in for SMS or e-mail.
+
+    A sender is any object with ``send(message)`` that raises on failure; register new
+    ones in SENDERS.
+    """
+
+    def __init__(self, app):
+        self.directory = os.path.join(app.instance_path, 'reminders')
+
+    def send(self, message):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, f'{utcnow_naive():%Y%m%d}.jsonl'), 'a') as outbox_file:
+            outbox_file.write(json.dumps(message, default=str) + '\n')
+
+
+# REMINDER_SENDER -> factory(app) returning a sender
+SENDERS = {
+    'file': FileSender,
+}
+
+
+def acquire_lease(name, holder, ttl_seconds):
+    """Takes the lease if it is free or expired, or renews it. Returns True if ``holder`` now holds it."""
+    now = utcnow_naive()
+    if db.session.get(SchedulerLease, name) is None:
+        db.session.add(SchedulerLease(name=name, holder=None, expires_at=now))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback() # Another process created it first
+    result = db.session.execute(
+        update(SchedulerLease)
+        .where(SchedulerLease.name == name, or_(SchedulerLease.holder == holder, SchedulerLease.expires_at <= now))
+        .values(holder=holder, expires_at=now + timedelta(seconds=ttl_seconds))
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def release_lease(name, holder):
+    db.session.execute(
+        update(SchedulerLease).where(SchedulerLease.name == name, SchedulerLease.holder == holder)
+        .values(holder=None, expires_at=utcnow_naive())
+    )
+    db.session.commit()
+
+
+def _remindable(*criteria):
+    return select(Appointment.id, Appointment.appointment_datetime).where(
+        Appointment.status.in_(REMINDABLE_STATUSES), *criteria
+    )
+
+
+def _add_reminders(rows, now):
+    """Inserts outbox rows for (appointment id, datetime) pairs that don't have one yet. Returns the count."""
+    if not rows:
+        return 0
+    existing = set(db.session.execute(
+        select(ReminderOutbox.appointment_id, ReminderOutbox.appointment_datetime)
+        .where(ReminderOutbox.appointment_id.in_({appointment_id for appointment_id, _ in rows}))
+    ).all())
+    new_rows = [
+        {'appointment_id': appointment_id, 'appointment_datetime': starts_at, 'status': 'pending', 'attempts': 0,
+         'next_attempt_at': now, 'created_at': now}
+        for appointment_id, starts_at in dict.fromkeys(map(tuple, rows)) if (appointment_id, starts_at) not in existing
+    ]
+    if new_rows:
+        db.session.execute(db.insert(ReminderOutbox), new_rows)
+    return len(new_rows)
+
+
+def queue_due_reminders():
+    """Queues reminders for the current clinic's appointments starting within the lead time. Returns the count."""
+    config = current_app.config
+    batch_size = config['REMINDER_BATCH_SIZE']
+    scan_started = utcnow_naive()
+    # Appointment datetimes are wall-clock values, like the calendar's.
+    wall_now = datetime.now()
+    horizon = wall_now + timedelta(hours=config['REMINDER_LEAD_HOURS'])
+
+    state = db.session.get(ReminderScanState, 1)
+    if state is None:
+        state = ReminderScanState(id=1, scanned_until=wall_now, last_scan_at=scan_started)
+        db.session.add(state)
+    queued = 0
+
+    # Late bookings and reschedules into the already-scanned window.
+    late = db.session.execute(_remindable(
+        Appointment.updated_at >= state.last_scan_at,
+        Appointment.appointment_datetime > wall_now,
+        Appointment.appointment_datetime <= state.scanned_until,
+    )).all()
+    queued += _add_reminders(late, scan_started)
+    state.last_scan_at = scan_started
+    db.session.commit()
+
+    # Advance the watermark one batch per transaction.
+    while state.scanned_until < horizon:
+        rows = db.session.execute(_remindable(
+            Appointment.appointment_datetime > state.scanned_until,
+            Appointment.appointment_datetime <= horizon,
+        ).order_by(Appointment.appointment_datetime).limit(batch_size)).all()
+        if len(rows) < batch_size:
+            watermark = horizon
+        else:
+            # Stop at the last datetime of a full batch, taking all of its ties.
+            watermark = rows[-1].appointment_datetime
+            rows = [row for row in rows if row.appointment_datetime < watermark]
+            rows += db.session.execute(_remindable(Appointment.appointment_datetime == watermark)).all()
+        queued += _add_reminders(rows, scan_started)
+        state.scanned_until = watermark
+        db.session.commit()
+    metrics.increment('reminders.queued', queued)
+    return queued
+
+
+def _message(reminder, appointment, clinic):
+    patient = appointment.patient
+    return {
+        'reminder_id': reminder.id,
+        'clinic': clinic,
+        'appointment_id': appointment.id,
+        'appointment_datetime': appointment.appointment_datetime.isoformat(),
+        'doctor': appointment.doctor.full_name if appointment.doctor else None,
+        'patient': {'id': patient.id, 'full_name': patient.full_name, 'phone': patient.phone, 'email': patient.email},
+    }
+
+
+def deliver_due_reminders(sender, clinic):
+    """Sends the current clinic's due reminders. Returns {'sent', 'failed', 'skipped'} counts."""
+    config = current_app.config
+    counts = {'sent': 0, 'failed': 0, 'skipped': 0}
+    while True:
+        now = utcnow_naive()
+        due = ReminderOutbox.query.filter(
+            ReminderOutbox.status == 'pending', ReminderOutbox.next_attempt_at <= now
+        ).order_by(ReminderOutbox.next_attempt_at).limit(config['REMINDER_BATCH_SIZE']).all()
+        if not due:
+            break
+        appointments = {
+            appointment.id: appointment for appointment in Appointment.query
+            .options(joinedload(Appointment.patient), joinedload(Appointment.doctor))
+            .filter(Appointment.id.in_({reminder.appointment_id for reminder in due}))
+        }
+        for reminder in due:
+            appointment = appointments.get(reminder.appointment_id)
+            if (appointment is None or appointment.status not in REMINDABLE_STATUSES
+                    or appointment.appointment_datetime != reminder.appointment_datetime
+                    or appointment.appointment_datetime < datetime.now()):
+                reminder.status = 'skipped' # Cancelled, rescheduled (that slot has its own reminder) or past
+                counts['skipped'] += 1
+            else:
+                reminder.attempts += 1
+                try:
+                    sender.send(_message(reminder, appointment, clinic))
+                except Exception as e:
+                    reminder.last_error = str(e)
+                    if reminder.attempts >= config['REMINDER_MAX_ATTEMPTS']:
+                        reminder.status = 'dead'
+                    else:
+                        backoff = config['REMINDER_RETRY_BASE_SECONDS'] * 2 ** (reminder.attempts - 1)
+                        reminder.next_attempt_at = now + timedelta(seconds=backoff)
+                    counts['failed'] += 1
+                else:
+                    reminder.status, reminder.sent_at = 'sent', utcnow_naive()
+                    counts['sent'] += 1
+            db.session.commit() # Per reminder, so a crash re-sends at most one message
+    for outcome, count in counts.items():
+        metrics.increment(f'reminders.{outcome}', count)
+    return counts
+
+
+class ReminderScheduler:
+    def __init__(self, app):
+        self.app = app
+        self.holder = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.sender = SENDERS[app.config['REMINDER_SENDER']](app)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def run_tick(self):
+        """One pass over every clinic if this process holds the lease. Returns {clinic: counts}, or None."""
+        app = self.app
+        with app.app_context():
+            if not acquire_lease(LEASE_NAME, self.holder, app.config['REMINDER_LEASE_SECONDS']):
+                return None
+        results = {}
+        for clinic in app.config['CLINICS']:
+            with app.app_context():
+                g.clinic = clinic
+                try:
+                    queued = queue_due_reminders()
+                    results[clinic] = dict(deliver_due_reminders(self.sender, clinic), queued=queued)
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f'Reminder tick for clinic {clinic} failed: {e}')
+        return results
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run_forever, name='reminder-scheduler', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def run_forever(self):
+        """Ticks every REMINDER_POLL_SECONDS until stop() is called."""
+        while not self._stopped.wait(self.app.config['REMINDER_POLL_SECONDS']):
+            try:
+                self.run_tick()
+            except Exception as e:
+                self.app.logger.error(f'Reminder scheduler tick failed: {e}')
+
+    def stop(self):
+        """Stops the thread and hands the lease over immediately instead of letting it expire."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            with self.app.app_context():
+                release_lease(LEASE_NAME, self.holder)
+        except Exception:
+            pass # Shutting down; the lease simply expires
+
+
+@click.command('send-reminders')
+def send_reminders_command():
+    """Run one reminder pass now (queue and send), unless another process holds the lease."""
+    scheduler = ReminderScheduler(current_app._get_current_object())
+    results = scheduler.run_tick()
+    release_lease(LEASE_NAME, scheduler.holder)
+    if results is None:
+        click.echo('Another process holds the reminder lease; nothing done.')
+        return
+    for clinic, counts in results.items():
+        click.echo(f"{clinic}: queued {counts['queued']}, sent {counts['sent']}, "
+                   f"failed {counts['failed']}, skipped {counts['skipped']}.")
+
+
+@click.command('run-reminders')
+def run_reminders_command():
+    """Run the reminder scheduler in the foreground until interrupted."""
+    scheduler = ReminderScheduler(current_app._get_current_object())
+    click.echo(f"Reminder scheduler {scheduler.holder} polling every {current_app.config['REMINDER_POLL_SECONDS']}s.")
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        release_lease(LEASE_NAME, scheduler.holder)
+
+
+def start_reminder_scheduler(app):
+    """Starts the scheduler thread for a serving process, if REMINDERS_ENABLED. Returns it, or None."""
+    if not app.config['REMINDERS_ENABLED']:
+        return None
+    scheduler = app.extensions.get('reminders')
+    if scheduler is None:
+        scheduler = ReminderScheduler(app)
+        app.extensions['reminders'] = scheduler
+        scheduler.start()
+    return scheduler
+
+
+def init_app(app):
+    app.cli.add_command(send_reminders_command)
+    app.cli.add_command(run_reminders_command)
@@ -0,0 +1,320 @@
+import datetime
+from decimal import Decimal
+
+from flask import current_app
+from sqlalchemy import and_, case, cast, func, select, union_all
+
+from .clinics import run_in_clinics
+from .database import db
+from .duplicates import scan_duplicate_patients
+from .forecast import reorder_forecast
+from .models import Bill, Appointment, Doctor, InventoryItem, Patient
+from .tiering import ArchivedAppointment, ArchivedBill, reaches_cold_tier
+from .schemas import AppointmentSchema, InventoryItemSchema # For detailed lists in reports
+
+appointment_schema_many = AppointmentSchema(many=True)
+inventory_item_schema_many = InventoryItemSchema(many=True)
+
+
+class ReportParameterError(ValueError):
+    """Raised for report parameters a builder rejects; the message is safe to return to the client."""
+
+
+def parse_date(date_str):
+    if not date_str: return None
+    try:
+        return datetime.datetime.fromisoformat(date_str).date()
+    except ValueError:
+        return None
+
+
+def _noop_progress(percent):
+    pass
+
+
+def _revenue_total(model, start_date, end_date):
+    query = db.session.query(func.sum(model.total_amount)).filter(model.payment_status == 'Paid')
+    if start_date:
+        query = query.filter(model.bill_date >= start_date)
+    if end_date:
+        query = query.filter(model.bill_date <= end_date)
+    return query.scalar() or Decimal('0.00')
+
+
+def revenue_report(start_date, end_date, progress):
+    total_revenue = _revenue_total(Bill, start_date, end_date)
+    if reaches_cold_tier('bills', start_date):
+        total_revenue += _revenue_total(ArchivedBill, start_date, end_date)
+    return {'total_revenue': str(total_revenue)}
+
+
+def _appointment_status_counts(model, start_date, end_date):
+    query = db.session.query(
+        model.status,
+        func.count(model.id).label('count')
+    ).group_by(model.status)
+
+    date_query_part = model.appointment_datetime
+    if start_date:
+        start_datetime = datetime.datetime.combine(start_date, datetime.time.min)
+        query = query.filter(date_query_part >= start_datetime)
+    if end_date:
+        end_datetime = datetime.datetime.combine(end_date, datetime.time.max)
+        query = query.filter(date_query_part <= end_datetime)
+    return query.all()
+
+
+def appointments_summary_report(start_date, end_date, progress):
+    summary = _appointment_status_counts(Appointment, start_date, end_date)
+    if reaches_cold_tier('appointments', start_date):
+        summary += _appointment_status_counts(ArchivedAppointment, start_date, end_date)
+    data = {}
+    for status, count in summary:
+        data[status] = data.get(status, 0) + count
+    progress(50)
+
+    # Example: Get top 5 upcoming appointments if no date filter or future end_date
+    if not start_date or (end_date and end_date >= datetime.date.today()):
+        upcoming_appts_query = Appointment.query.filter(Appointment.appointment_datetime >= datetime.datetime.now())\
+                                   .order_by(Appointment.appointment_datetime.asc()).limit(5)
+        data['upcoming_appointments_sample'] = appointment_schema_many.dump(upcoming_appts_query.all())
+    return data
+
+
+def low_stock_inventory_report(start_date, end_date, progress):
+    low_stock_items = InventoryItem.query.filter(
+        InventoryItem.quantity_on_hand <= InventoryItem.reorder_level
+    ).order_by(InventoryItem.name).all()
+    return {'low_stock_items': inventory_item_schema_many.dump(low_stock_items)}
+
+
+def reorder_forecast_report(start_date, end_date, progress):
+    return reorder_forecast(start_date, end_date)
+
+
+# Result columns of doctor_utilization, one value per doctor and day with appointments.
+# The doctor_* columns repeat the doctor's figures over the whole range on each of its days.
+UTILIZATION_COLUMNS = (
+    'doctor_id', 'day', 'appointments', 'booked_hours', 'utilization', 'cancelled', 'cancellation_rate',
+    'no_shows', 'no_show_rate', 'completed', 'doctor_utilization', 'doctor_cancellation_rate', 'doctor_no_show_rate',
+)
+FRACTION_COLUMNS = ('utilization', 'cancellation_rate', 'no_show_rate',
+                    'doctor_utilization', 'doctor_cancellation_rate', 'doctor_no_show_rate')
+OPEN_STATUSES = ('Scheduled', 'Confirmed')
+
+
+def _utilization_facts(model, range_start, range_end):
+    return select(
+        model.doctor_id, func.date(model.appointment_datetime, type_=db.Date).label('day'),
+        model.status, model.appointment_datetime,
+    ).where(model.appointment_datetime >= range_start, model.appointment_datetime < range_end)
+
+
+def _rate(count, total):
+    return cast(count, db.Float) / total
+
+
+def doctor_utilization_report(start_date, end_date, progress):
+    """Per doctor and day: booked hours, utilization, cancellation and no-show rates, as columns.
+
+    One grouped query computes the daily figures with aggregates and each doctor's
+    figures over the range with window functions on top of them. Booked hours count
+    every appointment that wasn't cancelled as one APPOINTMENT_SLOT_MINUTES slot;
+    utilization divides them by DOCTOR_BOOKABLE_HOURS_PER_DAY, and doctor_utilization by
+    that many hours for every day of the range, days without appointments included, so
+    an idle doctor is not reported as busy. A no-show is a past
+    appointment still Scheduled or Confirmed. Rows are read from the cursor in batches
+    straight into the column lists.
+    """
+    config = current_app.config
+    end_date = end_date or datetime.date.today()
+    start_date = start_date or end_date - datetime.timedelta(days=config['DOCTOR_UTILIZATION_DEFAULT_DAYS'] - 1)
+    max_days = config['DOCTOR_UTILIZATION_MAX_RANGE_DAYS']
+    if start_date > end_date:
+        raise ReportParameterError('start_date must not be after end_date')
+    if (end_date - start_date).days >= max_days:
+        raise ReportParameterError(f'doctor_utilization covers at most {max_days} days')
+    range_days = (end_date - start_date).days + 1
+    range_start = datetime.datetime.combine(start_date, datetime.time.min)
+    range_end = datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time.min)
+
+    facts = _utilization_facts(Appointment, range_start, range_end)
+    if reaches_cold_tier('appointments', range_start):
+        facts = union_all(facts, _utilization_facts(ArchivedAppointment, range_start, range_end))
+    facts = facts.subquery()
+
+    now = datetime.datetime.now() # Appointment datetimes are wall-clock values
+    daily = (
+        select(
+            facts.c.doctor_id, facts.c.day,
+            func.count().label('appointments'),
+            func.sum(case((facts.c.status == 'Cancelled', 1), else_=0)).label('cancelled'),
+            func.sum(case((and_(facts.c.status.in_(OPEN_STATUSES), facts.c.appointment_datetime < now), 1),
+                          else_=0)).label('no_shows'),
+            func.sum(case((facts.c.status == 'Completed', 1), else_=0)).label('completed'),
+        )
+        .group_by(facts.c.doctor_id, facts.c.day)
+        .subquery()
+    )
+
+    slot_hours = config['APPOINTMENT_SLOT_MINUTES'] / 60
+    day_hours = config['DOCTOR_BOOKABLE_HOURS_PER_DAY']
+    booked = daily.c.appointments - daily.c.cancelled
+    per_doctor = {'partition_by': daily.c.doctor_id}
+    stmt = (
+        select(
+            daily.c.doctor_id, daily.c.day, daily.c.appointments,
+            booked * slot_hours,
+            booked * slot_hours / day_hours,
+            daily.c.cancelled,
+            _rate(daily.c.cancelled, daily.c.appointments),
+            daily.c.no_shows,
+            _rate(daily.c.no_shows, daily.c.appointments),
+            daily.c.completed,
+            func.sum(booked).over(**per_doctor) * slot_hours / (range_days * day_hours),
+            _rate(func.sum(daily.c.cancelled).over(**per_doctor), func.sum(daily.c.appointments).over(**per_doctor)),
+            _rate(func.sum(daily.c.no_shows).over(**per_doctor), func.sum(daily.c.appointments).over(**per_doctor)),
+            Doctor.full_name,
+        )
+        .outerjoin(Doctor, Doctor.id == daily.c.doctor_id)
+        .order_by(daily.c.doctor_id, daily.c.day)
+    )
+
+    columns = {name: [] for name in UTILIZATION_COLUMNS}
+    doctors = {}
+    result = db.session.execute(stmt.execution_options(yield_per=5000))
+    for rows in result.partitions():
+        values = list(zip(*rows))
+        for name, column in zip(UTILIZATION_COLUMNS, values):
+            columns[name].extend(column)
+        doctors.update(zip(values[0], values[-1]))
+    columns['day'] = [day.isoformat() for day in columns['day']]
+    for name in FRACTION_COLUMNS:
+        columns[name] = [round(value, 4) for value in columns[name]]
+    progress(90)
+    return {
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'range_days': range_days,
+        'slot_minutes': config['APPOINTMENT_SLOT_MINUTES'],
+        'bookable_hours_per_day': day_hours,
+        'columns': columns,
+        'doctors': doctors,
+    }
+
+
+def duplicate_patients_report(start_date, end_date, progress):
+    # The pairs themselves are stored per clinic and served by GET /api/admin/duplicate-patients.
+    result = scan_duplicate_patients(progress=progress)
+    summary = {key: value for key, value in result.items() if key != 'duplicates'}
+    summary['duplicate_pairs'] = len(result['duplicates'])
+    return summary
+
+
+def patient_demographics_report(start_date, end_date, progress):
+    # This is a placeholder for more complex demographic reporting
+    # Example: Count of new patients in a period
+    query = db.session.query(func.count(Patient.id))
+    if start_date:
+        query = query.filter(Patient.created_at >= datetime.datetime.combine(start_date, datetime.time.min))
+    if end_date:
+        query = query.filter(Patient.created_at <= datetime.datetime.combine(end_date, datetime.time.max))
+    new_patients_count = query.scalar() or 0
+    return {'new_patients_count': new_patients_count}
+
+
+# report_type -> builder(start_date, end_date, progress). Builders return the report's 'data' dict.
+REPORT_BUILDERS = {
+    'revenue': revenue_report,
+    'appointments_summary': appointments_summary_report,
+    'low_stock_inventory': low_stock_inventory_report,
+    'reorder_forecast': reorder_forecast_report,
+    'doctor_utilization': doctor_utilization_report,
+    'duplicate_patients': duplicate_patients_report,
+    'patient_demographics': patient_demographics_report,
+}
+
+# Reports that scan whole tables and write derived data: background jobs only, for admins only.
+BACKGROUND_ADMIN_REPORTS = frozenset({'duplicate_patients'})
+
+
+def _merge_revenue(results):
+    total = sum((Decimal(data['total_revenue']) for data in results.values()), Decimal('0.00'))
+    return {'total_revenue': str(total)}
+
+
+def _merge_appointments_summary(results):
+    merged, samples = {}, []
+    for clinic, data in results.items():
+        for key, value in data.items():
+            if key == 'upcoming_appointments_sample':
+                samples.extend(dict(appointment, clinic=clinic) for appointment in value)
+            else:
+                merged[key] = merged.get(key, 0) + value
+    if samples:
+        merged['upcoming_appointments_sample'] = sorted(samples, key=lambda a: a['appointment_datetime'])[:5]
+    return merged
+
+
+def _merge_low_stock_inventory(results):
+    items = [dict(item, clinic=clinic) for clinic, data in results.items() for item in data['low_stock_items']]
+    return {'low_stock_items': sorted(items, key=lambda item: (item['name'], item['clinic']))}
+
+
+def _merge_reorder_forecast(results):
+    items = [dict(item, clinic=clinic) for clinic, data in results.items() for item in data['items']]
+    first = next(iter(results.values()), {})
+    return {
+        'window_start': first.get('window_start'),
+        'as_of': first.get('as_of'),
+        'items': sorted(items, key=lambda item: (item['days_until_stockout'], item['clinic'], item['id'])),
+        'items_without_usage': sum(data['items_without_usage'] for data in results.values()),
+    }
+
+
+def _merge_doctor_utilization(results):
+    # Doctor ids are per clinic, so the merged columns gain a clinic column.
+    merged = {name: [] for name in ('clinic',) + UTILIZATION_COLUMNS}
+    for clinic, data in results.items():
+        merged['clinic'].extend([clinic] * len(data['columns']['doctor_id']))
+        for name in UTILIZATION_COLUMNS:
+            merged[name].extend(data['columns'][name])
+    return {'columns': merged, 'doctors': {clinic: data['doctors'] for clinic, data in results.items()}}
+
+
+def _merge_patient_demographics(results):
+    return {'new_patients_count': sum(data['new_patients_count'] for data in results.values())}
+
+
+# report_type -> merge({clinic: data}) for cross-clinic reports. Reports without one are
+# returned per clinic only.
+REPORT_MERGERS = {
+    'revenue': _merge_revenue,
+    'appointments_summary': _merge_appointments_summary,
+    'low_stock_inventory': _merge_low_stock_inventory,
+    'reorder_forecast': _merge_reorder_forecast,
+    'doctor_utilization': _merge_doctor_utilization,
+    'patient_demographics': _merge_patient_demographics,
+}
+
+
+def build_report(report_type, start_date, end_date, progress=None):
+    """Computes a report's data section.
+
+    ``progress`` is an optional callable taking a 0-100 percentage, used by
+    background jobs to publish progress. Raises ReportParameterError for an unknown report_type.
+    """
+    builder = REPORT_BUILDERS.get(report_type)
+    if builder is None:
+        raise ReportParameterError('Invalid report_type specified')
+    return builder(start_date, end_date, progress or _noop_progress)
+
+
+def build_cross_clinic_report(report_type, start_date, end_date, clinics):
+    """Builds a report in every clinic in parallel and merges the results.
+
+    Returns {'clinics': {clinic: data}, 'combined': merged data or None}.
+    """
+    results = run_in_clinics(lambda: build_report(report_type, start_date, end_date), clinics)
+    merger = REPORT_MERGERS.get(report_type)
+    return {'clinics': results, 'combined': merger(results) if merger else None}
@@ -0,0 +1,142 @@
+from flask import Blueprint, current_app, jsonify, request, send_from_directory
+from flask_jwt_extended import jwt_required
+from http import HTTPStatus
+
+from app.audit import MODELS_BY_RESOURCE, query_events
+from app.database import db
+from app.duplicates import stored_duplicates
+from app.metrics import metrics
+from app.models import Patient
+from app.compression import CODECS
+from app.profiling import PROFILE_NAME_RE, list_profiles, profiles_dir
+from app.schemas import AuditEventSchema
+from app.sync import parse_iso_timestamp
+from app.utils import is_admin
+
+admin_bp = Blueprint('admin_bp', __name__, url_prefix='/admin')
+
+audit_events_schema = AuditEventSchema(many=True)
+AUDIT_MAX_LIMIT = 1000
+AUDIT_FLUSH_TIMEOUT_SECONDS = 2
+DUPLICATES_MAX_LIMIT = 1000
+
+@admin_bp.route('/metrics', methods=['GET'])
+@jwt_required()
+def get_metrics():
+    """Snapshot of this worker's in-process metrics."""
+    if not is_admin():
+        return jsonify({'message': 'Admin access required'}), HTTPStatus.FORBIDDEN
+    snapshot = metrics.snapshot()
+    snapshot['compression_codecs'] = list(CODECS)
+    return jsonify(snapshot), HTTPStatus.OK
+
+@admin_bp.route('/profiles', methods=['GET'])
+@jwt_required()
+def get_profiles():
+    """Request profiles stored in the instance folder, newest first."""
+    if not is_admin():
+        return jsonify({'message': 'Admin access required'}), HTTPStatus.FORBIDDEN
+    return jsonify(list_profiles()), HTTPStatus.OK
+
+@admin_bp.route('/profiles/<name>', methods=['GET'])
+@jwt_required()
+def download_profile(name):
+    if not is_admin():
+        return jsonify({'message': 'Admin access required'}), HTTPStatus.FORBIDDEN
+    if not PROFILE_NAME_RE.match(name):
+        return jsonify({'message': 'Profile not found'}), HTTPStatus.NOT_FOUND
+    return send_from_directory(profiles_dir(), name, as_attachment=True, mimetype='application/octet-stream')
+
+@admin_bp.route('/slow-queries', methods=['GET'])
+@jwt_required()
+def get_slow_queries():
+    """This worker's slow-query log: the most recent entries and per-fingerprint aggregates."""
+    if not is_admin():
+        return jsonify({'message': 'Admin access required'}), HTTPStatus.FORBIDDEN
+    log = current_app.extensions.get('slow_queries')
+    if log is None:
+        return jsonify({'message': 'The slow-query log is disabled'}), HTTPStatus.NOT_FOUND
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify(log.snapshot(max(0, limit))), HTTPStatus.OK
+
+@admin_bp.route('/slow-queries', methods=['DELETE'])
+@jwt_required()
+def clear_slow_queries():
+    if not is_admin():
+        return jsonify({'message': 'Admin access required'}), HTTPStatus.FORBIDDEN
+    log = current_app.extensions.get('slow_queries')
+    if log is not None:
+        log.clear()
+    return '', HTTPStatus.NO_CONTENT
+
+@admin_bp.route('/audit', methods=['GET'])
+@jwt_required()
+def get_audit_events():
+    """Audit events of the current clinic, newest first.
+
+    Filters: patient_id, resource (patients, appointments, bills) with optional resource_id,
+    user_id, since (inclusive) and until (exclusive) as ISO timestamps; limit (default 100).
+    """
+    if not is_admin():
+        return jsonify({'message': 'Admin access required'}), HTTPStatus.FORBIDDEN
+    writer = current_app.extensions.get('audit')
+    if writer is None:
+        return jsonify({'message': 'The audit log is disabled'}), HTTPStatus.NOT_FOUND
+    resource = request.args.get('resource')
+    if resource is not None and resource not in MODELS_BY_RESOURCE:
+        return jsonify({'message': f"resource must be one of: {', '.join(MODELS_BY_RESOURCE)}"}), HTTPStatus.BAD_REQUEST
+    try:
+        since = parse_iso_timestamp(request.args['since']) if request.args.get('since') else None
+        until = parse_iso_timestamp(request.args['until']) if request.args.get('until') else None
+    except ValueError:
+        return jsonify({'message': 'Invalid since/until format. Use an ISO 8601 timestamp.'}), HTTPStatus.BAD_REQUEST
+    limit = min(max(request.args.get('limit', 100, type=int), 1), AUDIT_MAX_LIMIT)
+
+    writer.flush(AUDIT_FLUSH_TIMEOUT_SECONDS) # Include events still queued, e.g. from the request just before
+    events = query_events(
+        patient_id=request.args.get('patient_id', type=int),
+        resource=resource,
+        resource_id=request.args.get('resource_id', type=int),
+        user_id=request.args.get('user_id'),
+        since=since,
+        until=until,
+        limit=limit,
+    )
+    return jsonify(audit_events_schema.dump(events)), HTTPStatus.OK
+
+@admin_bp.route('/duplicate-patients', methods=['GET'])
+@jwt_required()
+def get_duplicate_patients():
+    """Likely duplicate patients of the current clinic from the last scan, best first.
+
+    Query params: min_score (default: the scan's threshold) and limit (default 100). Scans
+    run as the duplicate_patients report job or via ``flask find-duplicate-patients``;
+    patient details are read at request time.
+    """
+    if not is_admin():
+        return jsonify({'message': 'Admin access required'}), HTTPStatus.FORBIDDEN
+    result = stored_duplicates()
+    if result is None:
+        return jsonify({'message': 'No duplicate scan has run yet. Queue a duplicate_patients report job.'}), HTTPStatus.NOT_FOUND
+    min_score = request.args.get('min_score', result['min_score'], type=float)
+    if not result['min_score'] <= min_score <= 1:
+        return jsonify({'message': f"min_score must be between the scan's threshold ({result['min_score']}) and 1"}), HTTPStatus.BAD_REQUEST
+    limit = min(max(request.args.get('limit', 100, type=int), 1), DUPLICATES_MAX_LIMIT)
+
+    matching = [duplicate for duplicate in result['duplicates'] if duplicate['score'] >= min_score]
+    shown = matching[:limit]
+    patient_ids = {patient_id for duplicate in shown for patient_id in duplicate['patient_ids']}
+    patients = {
+        patient.id: {'id': patient.id, 'full_name': patient.full_name, 'email': patient.email,
+                     'phone': patient.phone, 'date_of_birth': patient.date_of_birth.isoformat() if patient.date_of_birth else None}
+        for patient in db.session.scalars(db.select(Patient).where(Patient.id.in_(patient_ids)))
+    } if patient_ids else {}
+    return jsonify({
+        'duplicates': [dict(duplicate, patients=[patients.get(patient_id) for patient_id in duplicate['patient_ids']])
+                       for duplicate in shown],
+        'total': len(matching),
+        'candidate_pairs': result['candidate_pairs'],
+        'skipped_blocks': result['skipped_blocks'],
+        'elapsed_seconds': result['elapsed_seconds'],
+        'scanned_at': result['scanned_at'],
+    }), HTTPStatus.OK
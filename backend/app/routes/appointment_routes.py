@@ -1,18 +1,31 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, abort
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app.models import Appointment, Patient, Doctor
-from app.schemas import AppointmentSchema
+from sqlalchemy import select, insert, update, union_all
+from app.models import Appointment, AppointmentSeries, Patient, Doctor
+from app.schemas import AppointmentSchema, AppointmentSeriesSchema, AppointmentSeriesUpdateSchema
+from app.recurrence import expand_rule, find_conflicts
+from app.bulk import BulkRequestError, parse_id_list, resolve_target_ids, update_rows
 from app.database import db
+from app.sync import DeltaSync, record_tombstones
+from app.fieldsets import FieldSelection, FieldSelectionError
+from app.concurrency import if_match_failed, versioned_response
+from app.idempotency import idempotent
+from app.audit import audit_rows
+from app.tiering import ArchivedAppointment, merge_tiers, reaches_cold_tier
 from marshmallow import ValidationError
-from datetime import datetime
+from sqlalchemy.orm.exc import StaleDataError
+from datetime import datetime, timedelta
 
 appointment_bp = Blueprint('appointment_bp', __name__, url_prefix='/appointments')
 
 appointment_schema = AppointmentSchema()
 appointments_schema = AppointmentSchema(many=True)
+appointment_series_schema = AppointmentSeriesSchema()
+appointment_series_update_schema = AppointmentSeriesUpdateSchema()
 
 @appointment_bp.route('', methods=['POST'])
 @jwt_required()
+@idempotent
 def create_appointment():
     data = request.get_json()
     try:
@@ -40,20 +53,348 @@ def create_appointment():
 @appointment_bp.route('', methods=['GET'])
 @jwt_required()
 def get_appointments():
-    # Add filtering capabilities as needed, e.g., by date, patient_id, doctor_id
-    appointments = Appointment.query.all()
-    return jsonify(appointments_schema.dump(appointments)), 200
+    # Optional from (inclusive) / to (exclusive) narrow the listing by appointment_datetime.
+    try:
+        sync = DeltaSync.from_request('appointments', Appointment)
+    except ValueError:
+        return jsonify({"msg": "Invalid updated_since format. Use an ISO 8601 timestamp."}), 400
+    try:
+        fields = FieldSelection.from_request(Appointment, AppointmentSchema)
+    except FieldSelectionError as e:
+        return jsonify({"msg": str(e)}), 400
+    try:
+        range_start = _naive(datetime.fromisoformat(request.args['from'])) if request.args.get('from') else None
+        range_end = _naive(datetime.fromisoformat(request.args['to'])) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({"msg": "'from' and 'to' must be ISO dates or datetimes"}), 400
+
+    def criteria(model):
+        conditions = []
+        if range_start:
+            conditions.append(model.appointment_datetime >= range_start)
+        if range_end:
+            conditions.append(model.appointment_datetime < range_end)
+        return conditions
+
+    query = fields.apply(Appointment.query).filter(*criteria(Appointment))
+    if sync:
+        appointments = sync.filter(query).all()
+        return jsonify(sync.envelope(fields.dump(appointments, appointments_schema))), 200
+    if not reaches_cold_tier('appointments', range_start):
+        appointments = query.all()
+        return jsonify(fields.dump(appointments, appointments_schema)), 200
+    # The range reaches archived history: list both tiers oldest first.
+    appointments = merge_tiers(
+        db.session.scalars(
+            select(ArchivedAppointment).where(*criteria(ArchivedAppointment))
+            .order_by(ArchivedAppointment.appointment_datetime)
+        ).all(),
+        query.order_by(Appointment.appointment_datetime).all(),
+        key=lambda appointment: appointment.appointment_datetime,
+    )
+    return jsonify(fields.dump(appointments, appointments_schema)), 200
+
+@appointment_bp.route('/calendar', methods=['GET'])
+@jwt_required()
+def get_calendar_range():
+    """Compact, columnar appointment listing for calendar views.
+
+    Query params: from (inclusive) and to (exclusive) as ISO dates/datetimes, optional doctor_id.
+    Returns parallel column arrays plus id -> name dictionaries for doctors and patients,
+    so each name is sent once per response rather than once per appointment.
+    """
+    try:
+        range_start = _naive(datetime.fromisoformat(request.args.get('from', '')))
+        range_end = _naive(datetime.fromisoformat(request.args.get('to', '')))
+    except ValueError:
+        return jsonify({"msg": "'from' and 'to' are required ISO dates or datetimes"}), 400
+    if range_end <= range_start:
+        return jsonify({"msg": "'to' must be after 'from'"}), 400
+    max_days = current_app.config['CALENDAR_MAX_RANGE_DAYS']
+    if range_end - range_start > timedelta(days=max_days):
+        return jsonify({"msg": f"Calendar range cannot exceed {max_days} days"}), 400
+    doctor_id = request.args.get('doctor_id', type=int)
+
+    def calendar_select(model):
+        # One joined Core query per tier, selecting only the columns the calendar renders.
+        stmt = (
+            select(
+                model.id,
+                model.appointment_datetime,
+                model.status,
+                model.doctor_id,
+                Doctor.full_name.label('doctor_name'),
+                model.patient_id,
+                Patient.full_name.label('patient_name'),
+            )
+            .join(Doctor, Doctor.id == model.doctor_id)
+            .join(Patient, Patient.id == model.patient_id)
+            .where(model.appointment_datetime >= range_start, model.appointment_datetime < range_end)
+        )
+        if doctor_id:
+            stmt = stmt.where(model.doctor_id == doctor_id)
+        return stmt
+
+    stmt = calendar_select(Appointment)
+    if reaches_cold_tier('appointments', range_start):
+        stmt = union_all(stmt, calendar_select(ArchivedAppointment))
+        stmt = stmt.order_by(stmt.selected_columns.appointment_datetime)
+    else:
+        stmt = stmt.order_by(Appointment.appointment_datetime)
+
+    columns = {'id': [], 'start': [], 'status': [], 'doctor_id': [], 'patient_id': []}
+    doctors, patients = {}, {}
+    for appt_id, start, status, appt_doctor_id, doctor_name, patient_id, patient_name in db.session.execute(stmt):
+        columns['id'].append(appt_id)
+        columns['start'].append(start.isoformat())
+        columns['status'].append(status)
+        columns['doctor_id'].append(appt_doctor_id)
+        columns['patient_id'].append(patient_id)
+        doctors[appt_doctor_id] = doctor_name
+        patients[patient_id] = patient_name
+
+    return jsonify({
+        'from': range_start.isoformat(),
+        'to': range_end.isoformat(),
+        'columns': columns,
+        'doctors': doctors,
+        'patients': patients,
+    }), 200
+
+def _naive(dt):
+    # Appointment datetimes are stored as wall-clock values; drop any offset so comparisons work.
+    return dt.replace(tzinfo=None) if dt is not None else None
+
+@appointment_bp.route('/series', methods=['POST'])
+@jwt_required()
+def create_appointment_series():
+    """Books a recurring series in one transaction.
+
+    The rule is expanded server-side, conflicts with the doctor's existing bookings are
+    found with a single range query, and all occurrences are inserted as one batch.
+    """
+    data = request.get_json()
+    try:
+        loaded = appointment_series_schema.load(data or {})
+    except ValidationError as err:
+        return jsonify(err.messages), 400
+
+    if not Patient.query.get(loaded['patient_id']):
+        return jsonify({"msg": "Patient not found"}), 404
+    if not Doctor.query.get(loaded['doctor_id']):
+        return jsonify({"msg": "Doctor not found"}), 404
+
+    rule = loaded['rule']
+    max_occurrences = current_app.config['SERIES_MAX_OCCURRENCES']
+    occurrences = expand_rule(
+        _naive(loaded['start_datetime']), rule['freq'], rule['interval'],
+        count=rule.get('count'), until=_naive(rule.get('until')), byweekday=rule.get('byweekday'),
+        limit=max_occurrences + 1
+    )
+    if not occurrences:
+        return jsonify({"msg": "The recurrence rule produces no occurrences"}), 400
+    if len(occurrences) > max_occurrences:
+        return jsonify({"msg": f"A series cannot have more than {max_occurrences} occurrences"}), 400
+
+    slot = timedelta(minutes=current_app.config['APPOINTMENT_SLOT_MINUTES'])
+    booked = [booked_at for (booked_at,) in db.session.query(Appointment.appointment_datetime).filter(
+        Appointment.doctor_id == loaded['doctor_id'],
+        Appointment.status != 'Cancelled',
+        Appointment.appointment_datetime > occurrences[0] - slot,
+        Appointment.appointment_datetime < occurrences[-1] + slot
+    ).order_by(Appointment.appointment_datetime)]
+    conflicts = find_conflicts(occurrences, booked, slot)
+    if conflicts and not loaded['skip_conflicts']:
+        return jsonify({
+            "msg": "Some occurrences conflict with the doctor's existing appointments",
+            "conflicts": [conflict.isoformat() for conflict in conflicts]
+        }), 409
+    conflict_set = set(conflicts)
+    to_book = [occurrence for occurrence in occurrences if occurrence not in conflict_set]
+    if not to_book:
+        return jsonify({"msg": "Every occurrence conflicts with existing appointments"}), 409
+
+    try:
+        series = AppointmentSeries(
+            patient_id=loaded['patient_id'],
+            doctor_id=loaded['doctor_id'],
+            start_datetime=occurrences[0],
+            freq=rule['freq'],
+            interval=rule['interval'],
+            count=rule.get('count'),
+            until=_naive(rule.get('until')),
+            byweekday=','.join(str(day) for day in sorted(set(rule['byweekday']))) if rule.get('byweekday') else None,
+            notes=loaded.get('notes')
+        )
+        db.session.add(series)
+        db.session.flush() # Assigns series.id for the occurrences
+        db.session.execute(insert(Appointment), [
+            {
+                'patient_id': series.patient_id,
+                'doctor_id': series.doctor_id,
+                'appointment_datetime': occurrence,
+                'status': 'Scheduled',
+                'notes': series.notes,
+                'series_id': series.id,
+            }
+            for occurrence in to_book
+        ])
+        audit_rows(Appointment, 'create', Appointment.series_id == series.id)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"msg": "Error creating appointment series", "error": str(e)}), 500
+
+    return jsonify({
+        'series': appointment_series_schema.dump(series),
+        'booked_count': len(to_book),
+        'skipped_conflicts': [conflict.isoformat() for conflict in conflicts],
+    }), 201
+
+@appointment_bp.route('/series/<int:series_id>', methods=['GET'])
+@jwt_required()
+def get_appointment_series(series_id):
+    series = AppointmentSeries.query.get_or_404(series_id)
+    occurrences = Appointment.query.filter_by(series_id=series_id).order_by(Appointment.appointment_datetime).all()
+    return jsonify({
+        'series': appointment_series_schema.dump(series),
+        'occurrences': appointments_schema.dump(occurrences),
+    }), 200
+
+def _update_future_occurrences(series_id, values, effective_from):
+    """Applies ``values`` to the series' not-yet-completed occurrences in one UPDATE. Returns the row count."""
+    criteria = (
+        Appointment.series_id == series_id,
+        Appointment.appointment_datetime >= effective_from,
+        Appointment.status != 'Completed'
+    )
+    audit_rows(Appointment, 'update', *criteria)
+    result = db.session.execute(
+        update(Appointment)
+        .where(*criteria)
+        .values(**values, version_id=Appointment.version_id + 1)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+@appointment_bp.route('/series/<int:series_id>', methods=['PUT'])
+@jwt_required()
+def update_appointment_series(series_id):
+    series = AppointmentSeries.query.get_or_404(series_id)
+    try:
+        changes = appointment_series_update_schema.load(request.get_json() or {})
+    except ValidationError as err:
+        return jsonify(err.messages), 400
+    effective_from = _naive(changes.pop('effective_from', None)) or datetime.now()
+    if not changes:
+        return jsonify({"msg": "No updatable fields provided (status, notes)"}), 400
+
+    try:
+        updated_count = _update_future_occurrences(series_id, changes, effective_from)
+        if 'notes' in changes:
+            series.notes = changes['notes']
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"msg": "Error updating appointment series", "error": str(e)}), 500
+    return jsonify({'series': appointment_series_schema.dump(series), 'updated_count': updated_count}), 200
+
+@appointment_bp.route('/series/<int:series_id>', methods=['DELETE'])
+@jwt_required()
+def cancel_appointment_series(series_id):
+    """Cancels the series and all of its upcoming occurrences; past visits are kept."""
+    series = AppointmentSeries.query.get_or_404(series_id)
+    try:
+        cancelled_count = _update_future_occurrences(series_id, {'status': 'Cancelled'}, datetime.now())
+        series.status = 'Cancelled'
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"msg": "Error cancelling appointment series", "error": str(e)}), 500
+    return jsonify({"msg": "Appointment series cancelled", "cancelled_count": cancelled_count}), 200
+
+BULK_APPOINTMENT_FIELDS = {'status', 'notes'}
+
+def _appointment_bulk_criteria(filters):
+    """Translates a bulk 'filter' object into SQL criteria. Raises BulkRequestError."""
+    if not isinstance(filters, dict):
+        raise BulkRequestError("'filter' must be an object")
+    unknown = set(filters) - {'status', 'doctor_id', 'patient_id', 'from', 'to'}
+    if unknown:
+        raise BulkRequestError(f"Unsupported filter fields: {', '.join(sorted(unknown))}")
+    criteria = []
+    if 'status' in filters:
+        criteria.append(Appointment.status == filters['status'])
+    if 'doctor_id' in filters:
+        criteria.append(Appointment.doctor_id == filters['doctor_id'])
+    if 'patient_id' in filters:
+        criteria.append(Appointment.patient_id == filters['patient_id'])
+    try:
+        if 'from' in filters:
+            criteria.append(Appointment.appointment_datetime >= datetime.fromisoformat(filters['from']))
+        if 'to' in filters:
+            criteria.append(Appointment.appointment_datetime < datetime.fromisoformat(filters['to']))
+    except (TypeError, ValueError):
+        raise BulkRequestError("'from' and 'to' must be ISO dates or datetimes")
+    return criteria
+
+@appointment_bp.route('/bulk', methods=['PATCH'])
+@jwt_required()
+def bulk_update_appointments():
+    """Applies the same change to many appointments, e.g. marking a day's visits Completed.
+
+    Payload: {"ids": [...]} and/or {"filter": {status, doctor_id, patient_id, from, to}},
+    plus {"changes": {"status": ..., "notes": ...}}. Runs as one transaction.
+    """
+    data = request.get_json() or {}
+    changes = data.get('changes')
+    if not isinstance(changes, dict) or not changes:
+        return jsonify({"msg": "'changes' must be a non-empty object"}), 400
+    if set(changes) - BULK_APPOINTMENT_FIELDS:
+        return jsonify({"msg": "Only status and notes can be changed in bulk"}), 400
+    try:
+        changes = appointment_schema.load(changes, partial=True) # Validated once for all rows
+    except ValidationError as err:
+        return jsonify(err.messages), 400
+
+    try:
+        ids = parse_id_list(data['ids']) if 'ids' in data else None
+        criteria = _appointment_bulk_criteria(data['filter']) if 'filter' in data else []
+        target_ids = resolve_target_ids(Appointment, ids, criteria)
+        update_rows(Appointment, target_ids, changes)
+        db.session.commit()
+    except BulkRequestError as e:
+        db.session.rollback()
+        return jsonify({"msg": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"msg": "Error updating appointments", "error": str(e)}), 500
+    return jsonify({"updated_ids": target_ids, "updated_count": len(target_ids)}), 200
 
 @appointment_bp.route('/<int:appointment_id>', methods=['GET'])
 @jwt_required()
 def get_appointment(appointment_id):
-    appointment = Appointment.query.get_or_404(appointment_id)
-    return jsonify(appointment_schema.dump(appointment)), 200
+    try:
+        fields = FieldSelection.from_request(Appointment, AppointmentSchema)
+    except FieldSelectionError as e:
+        return jsonify({"msg": str(e)}), 400
+    appointment = fields.apply(Appointment.query).get(appointment_id)
+    if appointment is None:
+        # Appointments moved to the cold tier stay readable; they carry no ETag because they can't be edited.
+        archived = db.session.get(ArchivedAppointment, appointment_id) if reaches_cold_tier('appointments', None) else None
+        if archived is None:
+            abort(404)
+        return jsonify(fields.dump(archived, appointment_schema)), 200
+    return versioned_response(appointment, fields.dump(appointment, appointment_schema), 200)
+
+APPOINTMENT_CHANGED_MSG = "Appointment was modified by another user. Reload it and try again."
 
 @appointment_bp.route('/<int:appointment_id>', methods=['PUT'])
 @jwt_required()
 def update_appointment(appointment_id):
     appointment = Appointment.query.get_or_404(appointment_id)
+    if if_match_failed(appointment):
+        return jsonify({"msg": APPOINTMENT_CHANGED_MSG}), 412
     data = request.get_json()
     try:
         # Validate patient and doctor existence if they are being updated
@@ -68,10 +409,13 @@ def update_appointment(appointment_id):
         for key, value in updated_appointment_data.items():
             setattr(appointment, key, value)
         
-        db.session.commit()
-        return jsonify(appointment_schema.dump(appointment)), 200
+        db.session.commit() # UPDATE ... WHERE version_id = <version read above>
+        return versioned_response(appointment, appointment_schema.dump(appointment), 200)
     except ValidationError as err:
         return jsonify(err.messages), 400
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({"msg": APPOINTMENT_CHANGED_MSG}), 412
     except Exception as e:
         db.session.rollback()
         return jsonify({"msg": "Error updating appointment", "error": str(e)}), 500
@@ -86,6 +430,7 @@ def delete_appointment(appointment_id):
         # db.session.commit()
         # return jsonify({"msg": "Appointment cancelled"}), 200
         
+        record_tombstones('appointments', [appointment.id])
         db.session.delete(appointment)
         db.session.commit()
         return jsonify({"msg": "Appointment deleted"}), 200
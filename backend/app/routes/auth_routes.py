@@ -3,6 +3,8 @@ from flask_jwt_extended import create_access_token, create_refresh_token, jwt_re
 from app.models import User
 from app.schemas import UserSchema
 from app.database import db
+from app.clinics import default_clinic, is_known_clinic
+from app.utils import is_admin
 from marshmallow import ValidationError
 from http import HTTPStatus
 
@@ -14,6 +16,10 @@ user_schema = UserSchema()
 # In-memory token blocklist. For production, consider a persistent store like Redis.
 BLOCKLIST = set()
 
+def _clinic_claims(clinic):
+    """Extra JWT claims routing the token's requests to a clinic's database."""
+    return {'clinic': clinic or default_clinic()}
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     data = request.get_json()
@@ -29,6 +35,9 @@ def register():
         # Ensure error messages are in a consistent format, e.g., {"errors": err.messages}
         return jsonify({"msg": "Validation failed", "errors": err.messages}), HTTPStatus.BAD_REQUEST
 
+    if loaded_data.get('clinic') and not is_known_clinic(loaded_data['clinic']):
+        return jsonify({"msg": "Validation failed", "errors": {"clinic": ["Unknown clinic."]}}), HTTPStatus.BAD_REQUEST
+
     # Check for existing user using validated data
     if User.query.filter_by(email=loaded_data['email']).first():
         return jsonify({"msg": "User with this email already exists"}), HTTPStatus.CONFLICT
@@ -39,7 +48,8 @@ def register():
         new_user = User(
             username=loaded_data['username'],
             email=loaded_data['email'],
-            role=loaded_data.get('role', 'receptionist')  # Ensure role is explicitly fetched with default
+            role=loaded_data.get('role', 'receptionist'),  # Ensure role is explicitly fetched with default
+            clinic=loaded_data.get('clinic')
         )
         new_user.set_password(loaded_data['password']) # Password from schema (load_only field)
         
@@ -47,8 +57,8 @@ def register():
         db.session.commit()
 
         # Tokens will use global expiration settings from app.config
-        access_token = create_access_token(identity=new_user.id)
-        refresh_token = create_refresh_token(identity=new_user.id)
+        access_token = create_access_token(identity=new_user.id, additional_claims=_clinic_claims(new_user.clinic))
+        refresh_token = create_refresh_token(identity=new_user.id, additional_claims=_clinic_claims(new_user.clinic))
         
         # User schema dump excludes password by default
         user_details = user_schema.dump(new_user)
@@ -73,8 +83,8 @@ def login():
 
     if user and user.check_password(data['password']):
         # Tokens will use global expiration settings from app.config
-        access_token = create_access_token(identity=user.id)
-        refresh_token = create_refresh_token(identity=user.id)
+        access_token = create_access_token(identity=user.id, additional_claims=_clinic_claims(user.clinic))
+        refresh_token = create_refresh_token(identity=user.id, additional_claims=_clinic_claims(user.clinic))
         user_details = user_schema.dump(user)
         return jsonify(access_token=access_token, refresh_token=refresh_token, user=user_details), HTTPStatus.OK
     else:
@@ -92,9 +102,25 @@ def logout():
 def refresh():
     current_user_id = get_jwt_identity()
     # New access token will use global expiration settings from app.config
-    new_access_token = create_access_token(identity=current_user_id)
+    new_access_token = create_access_token(identity=current_user_id, additional_claims=_clinic_claims(get_jwt().get('clinic')))
     return jsonify(access_token=new_access_token), HTTPStatus.OK
 
+@auth_bp.route('/switch-clinic', methods=['POST'])
+@jwt_required()
+def switch_clinic():
+    """Issues admins a token pair for another clinic; other users stay in their home clinic."""
+    if not is_admin():
+        return jsonify({"msg": "Admin access required"}), HTTPStatus.FORBIDDEN
+    data = request.get_json(silent=True) or {}
+    clinic = data.get('clinic')
+    if not clinic or not is_known_clinic(clinic):
+        return jsonify({"msg": "A known clinic is required"}), HTTPStatus.BAD_REQUEST
+
+    current_user_id = get_jwt_identity()
+    access_token = create_access_token(identity=current_user_id, additional_claims=_clinic_claims(clinic))
+    refresh_token = create_refresh_token(identity=current_user_id, additional_claims=_clinic_claims(clinic))
+    return jsonify(access_token=access_token, refresh_token=refresh_token, clinic=clinic), HTTPStatus.OK
+
 @auth_bp.route('/me', methods=['GET'])
 @jwt_required() # Requires a valid access token
 def get_current_user():
@@ -0,0 +1,145 @@
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+import threading
+
+from flask import Blueprint, request, jsonify, current_app, g
+from flask_jwt_extended import jwt_required
+from werkzeug.test import EnvironBuilder
+
+batch_bp = Blueprint('batch_bp', __name__, url_prefix='/batch')
+
+# Sub-requests may not target these prefixes: auth endpoints need their own
+# token handling (e.g. refresh tokens), and batches must not nest.
+FORBIDDEN_PATH_PREFIXES = ('/api/auth', '/api/batch')
+ALLOWED_METHODS = {'GET', 'POST', 'PUT', 'PATCH', 'DELETE'}
+
+# g attributes populated by flask_jwt_extended when a token is verified.
+JWT_STATE_ATTRS = ('_jwt_extended_jwt', '_jwt_extended_jwt_header',
+                   '_jwt_extended_jwt_user', '_jwt_extended_jwt_location')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Lazily creates the shared thread pool used for concurrent reads."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=current_app.config['BATCH_MAX_WORKERS'],
+                    thread_name_prefix='batch'
+                )
+    return _executor
+
+
+def _validate_item(item, index):
+    """Returns an error message for a malformed sub-request, or None."""
+    if not isinstance(item, dict):
+        return f'Request {index + 1} must be an object'
+    method = str(item.get('method', 'GET')).upper()
+    path = item.get('path')
+    if method not in ALLOWED_METHODS:
+        return f'Request {index + 1} has unsupported method {method}'
+    if not isinstance(path, str) or not path.startswith('/api/'):
+        return f"Request {index + 1} must have a 'path' starting with /api/"
+    if path.startswith(FORBIDDEN_PATH_PREFIXES):
+        return f'Request {index + 1} targets an endpoint that cannot be batched'
+    if 'headers' in item and not isinstance(item['headers'], dict):
+        return f"Request {index + 1} 'headers' must be an object"
+    return None
+
+
+def _dispatch(app, item, jwt_state, base_url):
+    """Runs one sub-request through the app's normal routing and hooks.
+
+    The batch request already verified the JWT, so protected views are invoked
+    through their undecorated function with the verified claims placed on ``g``
+    instead of decoding the token again.
+    """
+    # Sub-responses are embedded as JSON; only the batch response as a whole is compressed.
+    headers = {name: value for name, value in (item.get('headers') or {}).items()
+               if name.lower() != 'accept-encoding'}
+    builder = EnvironBuilder(
+        path=item['path'],
+        base_url=base_url,
+        method=str(item.get('method', 'GET')).upper(),
+        json=item.get('body'),
+        headers=headers,
+    )
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+
+    # A fresh app context gives each sub-request its own ``g`` and DB session.
+    with app.app_context(), app.request_context(environ):
+        for attr, value in jwt_state.items():
+            setattr(g, attr, value)
+        try:
+            rv = app.preprocess_request()
+            if rv is None:
+                if request.routing_exception is not None:
+                    raise request.routing_exception
+                view = app.view_functions[request.url_rule.endpoint]
+                view = getattr(view, '__wrapped__', view) # Strip @jwt_required(); claims already set
+                rv = app.ensure_sync(view)(**request.view_args)
+        except Exception as e:
+            try:
+                rv = app.handle_user_exception(e)
+            except Exception as unhandled:
+                app.logger.error(f"Unhandled error in batch sub-request {item['path']}: {str(unhandled)}", exc_info=True)
+                return {'id': item.get('id'), 'status': HTTPStatus.INTERNAL_SERVER_ERROR,
+                        'body': {'message': 'Error processing batched request', 'error': str(unhandled)}}
+        response = app.process_response(app.make_response(rv))
+        return {'id': item.get('id'), 'status': response.status_code, 'body': response.get_json(silent=True)}
+
+
+@batch_bp.route('', methods=['POST'])
+@jwt_required()
+def run_batch():
+    """Executes several API calls in one round trip.
+
+    Payload: {"requests": [{"id": "...", "method": "GET", "path": "/api/patients",
+    "body": {...}, "headers": {...}}, ...]}. Consecutive GETs run concurrently;
+    any other method runs on its own, in order, so later reads see its writes.
+    """
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('requests'), list) or not data['requests']:
+        return jsonify({'message': 'requests must be a non-empty list'}), HTTPStatus.BAD_REQUEST
+
+    items = data['requests']
+    max_requests = current_app.config['BATCH_MAX_REQUESTS']
+    if len(items) > max_requests:
+        return jsonify({'message': f'A batch may contain at most {max_requests} requests'}), HTTPStatus.BAD_REQUEST
+    for index, item in enumerate(items):
+        error = _validate_item(item, index)
+        if error:
+            return jsonify({'message': error}), HTTPStatus.BAD_REQUEST
+
+    app = current_app._get_current_object()
+    jwt_state = {attr: getattr(g, attr) for attr in JWT_STATE_ATTRS if hasattr(g, attr)}
+    base_url = request.host_url
+
+    results = []
+    pending_reads = []
+
+    def flush_reads():
+        if len(pending_reads) == 1:
+            results.append(_dispatch(app, pending_reads[0], jwt_state, base_url))
+        elif pending_reads:
+            executor = _get_executor()
+            futures = [executor.submit(_dispatch, app, read, jwt_state, base_url) for read in pending_reads]
+            results.extend(future.result() for future in futures)
+        pending_reads.clear()
+
+    for item in items:
+        if str(item.get('method', 'GET')).upper() == 'GET':
+            pending_reads.append(item)
+            continue
+        flush_reads()
+        results.append(_dispatch(app, item, jwt_state, base_url))
+    flush_reads()
+
+    return jsonify({'responses': results}), HTTPStatus.OK
@@ -1,4 +1,4 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, abort
 from flask_jwt_extended import jwt_required
 from http import HTTPStatus
 from decimal import Decimal, InvalidOperation
@@ -7,7 +7,16 @@ import datetime
 from app.database import db # Corrected: Use db from app.database
 from app.models import Bill, BillItem, Patient, InventoryItem
 from app.schemas import BillSchema, BillItemSchema
+from app.sync import DeltaSync
+from app.archival import delete_bills
+from app.catalog_cache import bump_catalog_version
+from app.fieldsets import FieldSelection, FieldSelectionError
+from app.concurrency import if_match_failed, versioned_response
+from app.idempotency import idempotent
+from app.tiering import ArchivedBill, merge_tiers, reaches_cold_tier
+from app.bulk import BulkRequestError, parse_id_list, resolve_target_ids, update_rows
 from marshmallow import ValidationError
+from sqlalchemy.orm.exc import StaleDataError
 
 billing_bp = Blueprint('billing_bp', __name__, url_prefix='/bills')
 
@@ -17,6 +26,7 @@ bill_item_schema = BillItemSchema() # Used for validating individual items
 
 @billing_bp.route('', methods=['POST'])
 @jwt_required()
+@idempotent # Client retries must not create a second bill or decrement stock twice
 def create_bill():
     data = request.get_json()
     if not data:
@@ -33,7 +43,7 @@ def create_bill():
     bill_payload_for_schema = {k: v for k, v in data.items() if k != 'bill_items'}
     try:
         # Marshmallow validates and deserializes. load() returns dict for model creation.
-        loaded_bill_data = bill_schema.load(bill_payload_for_schema) 
+        loaded_bill_data = bill_schema.load(bill_payload_for_schema, partial=('bill_items',))
     except ValidationError as err:
         return jsonify(err.messages), HTTPStatus.BAD_REQUEST
 
@@ -92,12 +102,17 @@ def create_bill():
         db.session.add(new_bill_model)
         # All inventory items that were modified are already part of the session 
         # and their quantity_on_hand changes will be committed.
+        if any(item.inventory_item_id for item in processed_bill_item_models):
+            bump_catalog_version('inventory') # Stock levels changed
         db.session.commit()
         return jsonify(bill_schema.dump(new_bill_model)), HTTPStatus.CREATED
 
     except ValueError as ve: # Catch custom ValueErrors for stock, item not found etc.
         db.session.rollback() 
         return jsonify({'message': str(ve)}), HTTPStatus.BAD_REQUEST
+    except StaleDataError: # Another bill drew on the same stock concurrently
+        db.session.rollback()
+        return jsonify({'message': 'Stock levels changed while the bill was being created. Please retry.'}), HTTPStatus.CONFLICT
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': 'Error processing bill creation', 'error': str(e)}), HTTPStatus.INTERNAL_SERVER_ERROR
@@ -110,39 +125,135 @@ def get_bills():
     payment_status_filter = request.args.get('payment_status')
     start_date_filter = request.args.get('start_date')
     end_date_filter = request.args.get('end_date')
+    try:
+        sync = DeltaSync.from_request('bills', Bill)
+    except ValueError:
+        return jsonify({'message': 'Invalid updated_since format. Use an ISO 8601 timestamp.'}), HTTPStatus.BAD_REQUEST
+    try:
+        fields = FieldSelection.from_request(Bill, BillSchema)
+    except FieldSelectionError as e:
+        return jsonify({'message': str(e)}), HTTPStatus.BAD_REQUEST
 
-    query = Bill.query
-
-    if patient_id_filter:
-        query = query.filter(Bill.patient_id == patient_id_filter)
-    if payment_status_filter:
-        query = query.filter(Bill.payment_status.ilike(f'%{payment_status_filter}%'))
-    if start_date_filter:
-        try:
+    start_dt = end_dt = None
+    try:
+        if start_date_filter:
             start_dt = datetime.datetime.fromisoformat(start_date_filter).date()
-            query = query.filter(Bill.bill_date >= start_dt)
-        except ValueError:
-            return jsonify({'message': 'Invalid start_date format. Use YYYY-MM-DD.'}), HTTPStatus.BAD_REQUEST
-    if end_date_filter:
-        try:
+    except ValueError:
+        return jsonify({'message': 'Invalid start_date format. Use YYYY-MM-DD.'}), HTTPStatus.BAD_REQUEST
+    try:
+        if end_date_filter:
             end_dt = datetime.datetime.fromisoformat(end_date_filter).date()
-            query = query.filter(Bill.bill_date <= end_dt)
-        except ValueError:
-            return jsonify({'message': 'Invalid end_date format. Use YYYY-MM-DD.'}), HTTPStatus.BAD_REQUEST
+    except ValueError:
+        return jsonify({'message': 'Invalid end_date format. Use YYYY-MM-DD.'}), HTTPStatus.BAD_REQUEST
+
+    def criteria(model):
+        conditions = []
+        if patient_id_filter:
+            conditions.append(model.patient_id == patient_id_filter)
+        if payment_status_filter:
+            conditions.append(model.payment_status.ilike(f'%{payment_status_filter}%'))
+        if start_dt:
+            conditions.append(model.bill_date >= start_dt)
+        if end_dt:
+            conditions.append(model.bill_date <= end_dt)
+        return conditions
+
+    query = fields.apply(Bill.query).filter(*criteria(Bill))
+
+    if sync:
+        all_bills = sync.filter(query).order_by(Bill.bill_date.desc()).all()
+        return jsonify(sync.envelope(fields.dump(all_bills, bills_schema))), HTTPStatus.OK
 
     all_bills = query.order_by(Bill.bill_date.desc()).all()
-    return jsonify(bills_schema.dump(all_bills)), HTTPStatus.OK
+    if reaches_cold_tier('bills', start_dt):
+        cold_bills = db.session.scalars(
+            db.select(ArchivedBill).where(*criteria(ArchivedBill)).order_by(ArchivedBill.bill_date.desc())
+        ).all()
+        all_bills = merge_tiers(all_bills, cold_bills, key=lambda bill: bill.bill_date, reverse=True)
+    return jsonify(fields.dump(all_bills, bills_schema)), HTTPStatus.OK
+
+BULK_BILL_FIELDS = {'payment_status', 'notes'}
+
+def _bill_bulk_criteria(filters):
+    """Translates a bulk 'filter' object into SQL criteria. Raises BulkRequestError."""
+    if not isinstance(filters, dict):
+        raise BulkRequestError("'filter' must be an object")
+    unknown = set(filters) - {'payment_status', 'patient_id', 'start_date', 'end_date'}
+    if unknown:
+        raise BulkRequestError(f"Unsupported filter fields: {', '.join(sorted(unknown))}")
+    criteria = []
+    if 'payment_status' in filters:
+        criteria.append(Bill.payment_status == filters['payment_status'])
+    if 'patient_id' in filters:
+        criteria.append(Bill.patient_id == filters['patient_id'])
+    try:
+        if 'start_date' in filters:
+            criteria.append(Bill.bill_date >= datetime.date.fromisoformat(filters['start_date']))
+        if 'end_date' in filters:
+            criteria.append(Bill.bill_date <= datetime.date.fromisoformat(filters['end_date']))
+    except (TypeError, ValueError):
+        raise BulkRequestError('Invalid start_date/end_date format. Use YYYY-MM-DD.')
+    return criteria
+
+@billing_bp.route('/bulk', methods=['PATCH'])
+@jwt_required()
+def bulk_update_bills():
+    """Applies the same change to many bills, e.g. marking end-of-day payments Paid.
+
+    Payload: {"ids": [...]} and/or {"filter": {payment_status, patient_id, start_date, end_date}},
+    plus {"changes": {"payment_status": ..., "notes": ...}}. Runs as one transaction.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({'message': 'No input data provided'}), HTTPStatus.BAD_REQUEST
+    changes = data.get('changes')
+    if not isinstance(changes, dict) or not changes:
+        return jsonify({'message': "'changes' must be a non-empty object"}), HTTPStatus.BAD_REQUEST
+    if set(changes) - BULK_BILL_FIELDS:
+        return jsonify({'message': 'Only payment_status and notes can be changed in bulk'}), HTTPStatus.BAD_REQUEST
+    try:
+        changes = bill_schema.load(changes, partial=True) # Validated once for all rows
+    except ValidationError as err:
+        return jsonify(err.messages), HTTPStatus.BAD_REQUEST
+
+    try:
+        ids = parse_id_list(data['ids']) if 'ids' in data else None
+        criteria = _bill_bulk_criteria(data['filter']) if 'filter' in data else []
+        target_ids = resolve_target_ids(Bill, ids, criteria)
+        update_rows(Bill, target_ids, changes)
+        db.session.commit()
+    except BulkRequestError as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), HTTPStatus.BAD_REQUEST
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': 'Error updating bills', 'error': str(e)}), HTTPStatus.INTERNAL_SERVER_ERROR
+    return jsonify({'updated_ids': target_ids, 'updated_count': len(target_ids)}), HTTPStatus.OK
 
 @billing_bp.route('/<int:bill_id>', methods=['GET'])
 @jwt_required()
 def get_bill(bill_id):
-    bill = Bill.query.get_or_404(bill_id)
-    return jsonify(bill_schema.dump(bill)), HTTPStatus.OK
+    try:
+        fields = FieldSelection.from_request(Bill, BillSchema)
+    except FieldSelectionError as e:
+        return jsonify({'message': str(e)}), HTTPStatus.BAD_REQUEST
+    bill = fields.apply(Bill.query).get(bill_id)
+    if bill is None:
+        # Bills moved to the cold tier stay readable; they carry no ETag because they can't be edited.
+        archived_bill = db.session.get(ArchivedBill, bill_id) if reaches_cold_tier('bills', None) else None
+        if archived_bill is None:
+            abort(HTTPStatus.NOT_FOUND)
+        return jsonify(fields.dump(archived_bill, bill_schema)), HTTPStatus.OK
+    return versioned_response(bill, fields.dump(bill, bill_schema), HTTPStatus.OK)
+
+BILL_CHANGED_MSG = 'Bill was modified by another user. Reload it and try again.'
 
 @billing_bp.route('/<int:bill_id>', methods=['PUT'])
 @jwt_required()
 def update_bill(bill_id):
     bill_model = Bill.query.get_or_404(bill_id)
+    if if_match_failed(bill_model):
+        return jsonify({'message': BILL_CHANGED_MSG}), HTTPStatus.PRECONDITION_FAILED
     data = request.get_json()
     if not data:
         return jsonify({'message': 'No input data provided'}), HTTPStatus.BAD_REQUEST
@@ -166,10 +277,13 @@ def update_bill(bill_id):
             setattr(bill_model, key, value)
         
         db.session.add(bill_model) # Add to session for safety
-        db.session.commit()
-        return jsonify(bill_schema.dump(bill_model)), HTTPStatus.OK
+        db.session.commit() # UPDATE ... WHERE version_id = <version read above>
+        return versioned_response(bill_model, bill_schema.dump(bill_model), HTTPStatus.OK)
     except ValidationError as err:
         return jsonify(err.messages), HTTPStatus.BAD_REQUEST
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({'message': BILL_CHANGED_MSG}), HTTPStatus.PRECONDITION_FAILED
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': 'Error updating bill', 'error': str(e)}), HTTPStatus.INTERNAL_SERVER_ERROR
@@ -177,16 +291,10 @@ def update_bill(bill_id):
 @billing_bp.route('/<int:bill_id>', methods=['DELETE'])
 @jwt_required()
 def delete_bill(bill_id):
-    bill = Bill.query.get_or_404(bill_id)
+    Bill.query.get_or_404(bill_id)
     try:
-        # Atomically update inventory and delete bill
-        for item_model in bill.bill_items:
-            if item_model.inventory_item_id and item_model.inventory_item:
-                # Ensure inventory_item is loaded if it's a lazy relationship and session might be tricky
-                # db.session.add(item_model.inventory_item) # Not strictly needed if already in session
-                item_model.inventory_item.quantity_on_hand += item_model.quantity
-        
-        db.session.delete(bill)
+        # Atomically return stock (one aggregated UPDATE) and delete the bill and its items
+        delete_bills([bill_id], restore_inventory=True)
         db.session.commit()
         return '', HTTPStatus.NO_CONTENT
     except Exception as e:
@@ -6,6 +6,9 @@ from http import HTTPStatus
 from app.models import Doctor
 from app.schemas import DoctorSchema
 from app.database import db
+from app.sync import DeltaSync, record_tombstones
+from app.catalog_cache import bump_catalog_version, cached_catalog_response
+from app.fieldsets import FieldSelection, FieldSelectionError
 from marshmallow import ValidationError
 from app.utils import is_admin
 
@@ -34,6 +37,7 @@ def create_doctor():
 
         new_doctor = Doctor(**new_doctor_data)
         db.session.add(new_doctor)
+        bump_catalog_version('doctors')
         db.session.commit()
         return jsonify(doctor_schema.dump(new_doctor)), HTTPStatus.CREATED
     except ValidationError as err:
@@ -57,14 +61,30 @@ def get_doctors():
     #    "current_page": doctors_page.page
     # }
     # return jsonify(results), HTTPStatus.OK
-    doctors = Doctor.query.all()
-    return jsonify(doctors_schema.dump(doctors)), HTTPStatus.OK
+    try:
+        sync = DeltaSync.from_request('doctors', Doctor)
+    except ValueError:
+        return jsonify({"msg": "Invalid updated_since format. Use an ISO 8601 timestamp."}), HTTPStatus.BAD_REQUEST
+    try:
+        fields = FieldSelection.from_request(Doctor, DoctorSchema)
+    except FieldSelectionError as e:
+        return jsonify({"msg": str(e)}), HTTPStatus.BAD_REQUEST
+    if sync:
+        doctors = sync.filter(fields.apply(Doctor.query)).all()
+        return jsonify(sync.envelope(fields.dump(doctors, doctors_schema))), HTTPStatus.OK
+    if fields.fields is not None: # Sparse responses are cheap to build and not worth caching per field set
+        return jsonify(fields.dump(fields.apply(Doctor.query).all(), doctors_schema)), HTTPStatus.OK
+    return cached_catalog_response('doctors', lambda: doctors_schema.dump(Doctor.query.all())), HTTPStatus.OK
 
 @doctor_bp.route('/<int:doctor_id>', methods=['GET'])
 @jwt_required() # All authenticated users can view a specific doctor
 def get_doctor(doctor_id):
-    doctor = Doctor.query.get_or_404(doctor_id)
-    return jsonify(doctor_schema.dump(doctor)), HTTPStatus.OK
+    try:
+        fields = FieldSelection.from_request(Doctor, DoctorSchema)
+    except FieldSelectionError as e:
+        return jsonify({"msg": str(e)}), HTTPStatus.BAD_REQUEST
+    doctor = fields.apply(Doctor.query).get_or_404(doctor_id)
+    return jsonify(fields.dump(doctor, doctor_schema)), HTTPStatus.OK
 
 @doctor_bp.route('/<int:doctor_id>', methods=['PUT'])
 @jwt_required()
@@ -88,6 +108,7 @@ def update_doctor(doctor_id):
             
         for key, value in updated_doctor_data.items():
             setattr(doctor, key, value)
+        bump_catalog_version('doctors')
         db.session.commit()
         return jsonify(doctor_schema.dump(doctor)), HTTPStatus.OK
     except ValidationError as err:
@@ -105,7 +126,9 @@ def delete_doctor(doctor_id):
 
     doctor = Doctor.query.get_or_404(doctor_id)
     try:
+        record_tombstones('doctors', [doctor.id])
         db.session.delete(doctor)
+        bump_catalog_version('doctors')
         db.session.commit()
         return jsonify({"msg": "Doctor deleted"}), HTTPStatus.OK
     except IntegrityError as e:
@@ -6,6 +6,11 @@ from app.database import db # Corrected: Use db from app.database
 from app.models import InventoryItem
 from app.schemas import InventoryItemSchema
 from app.utils import is_admin # Import is_admin from utils
+from app.sync import DeltaSync, record_tombstones
+from app.catalog_cache import bump_catalog_version, cached_catalog_response
+from app.fieldsets import FieldSelection, FieldSelectionError
+from app.concurrency import if_match_failed, versioned_response
+from sqlalchemy.orm.exc import StaleDataError
 
 inventory_bp = Blueprint('inventory_bp', __name__, url_prefix='/inventory')
 
@@ -34,6 +39,7 @@ def create_inventory_item():
         new_item_model = InventoryItem(**loaded_data)
         
         db.session.add(new_item_model)
+        bump_catalog_version('inventory')
         db.session.commit()
         return jsonify(inventory_item_schema.dump(new_item_model)), HTTPStatus.CREATED
     except Exception as e:
@@ -44,24 +50,52 @@ def create_inventory_item():
 @jwt_required()
 def get_inventory_items():
     category_filter = request.args.get('category')
+    exact_category = request.args.get('category_exact')
     low_stock_filter = request.args.get('low_stock', type=lambda v: v.lower() == 'true')
+    try:
+        sync = DeltaSync.from_request('inventory', InventoryItem)
+    except ValueError:
+        return jsonify({'message': 'Invalid updated_since format. Use an ISO 8601 timestamp.'}), HTTPStatus.BAD_REQUEST
+    try:
+        fields = FieldSelection.from_request(InventoryItem, InventoryItemSchema)
+    except FieldSelectionError as e:
+        return jsonify({'message': str(e)}), HTTPStatus.BAD_REQUEST
+
+    if not (category_filter or exact_category or low_stock_filter or sync or fields.fields):
+        # The full catalog, as pulled by the billing screens, is served from the catalog cache.
+        return cached_catalog_response(
+            'inventory', lambda: inventory_items_schema.dump(InventoryItem.query.order_by(InventoryItem.name).all())
+        ), HTTPStatus.OK
 
-    query = InventoryItem.query
+    query = fields.apply(InventoryItem.query)
 
     if category_filter:
         query = query.filter(InventoryItem.category.ilike(f'%{category_filter}%'))
+    if exact_category:
+        # Exact match, which can use the category index (the substring match above can't).
+        query = query.filter(InventoryItem.category == exact_category)
     
     if low_stock_filter is True:
         query = query.filter(InventoryItem.quantity_on_hand <= InventoryItem.reorder_level)
     
+    if sync:
+        all_items = sync.filter(query).order_by(InventoryItem.name).all()
+        return jsonify(sync.envelope(fields.dump(all_items, inventory_items_schema))), HTTPStatus.OK
+
     all_items = query.order_by(InventoryItem.name).all()
-    return jsonify(inventory_items_schema.dump(all_items)), HTTPStatus.OK
+    return jsonify(fields.dump(all_items, inventory_items_schema)), HTTPStatus.OK
 
 @inventory_bp.route('/<int:item_id>', methods=['GET'])
 @jwt_required()
 def get_inventory_item(item_id):
-    item = InventoryItem.query.get_or_404(item_id)
-    return jsonify(inventory_item_schema.dump(item)), HTTPStatus.OK
+    try:
+        fields = FieldSelection.from_request(InventoryItem, InventoryItemSchema)
+    except FieldSelectionError as e:
+        return jsonify({'message': str(e)}), HTTPStatus.BAD_REQUEST
+    item = fields.apply(InventoryItem.query).get_or_404(item_id)
+    return versioned_response(item, fields.dump(item, inventory_item_schema), HTTPStatus.OK)
+
+ITEM_CHANGED_MSG = 'Inventory item was modified by another user. Reload it and try again.'
 
 @inventory_bp.route('/<int:item_id>', methods=['PUT'])
 @jwt_required()
@@ -70,6 +104,8 @@ def update_inventory_item(item_id):
         return jsonify({'message': 'Admin access required'}), HTTPStatus.FORBIDDEN
 
     item_model = InventoryItem.query.get_or_404(item_id)
+    if if_match_failed(item_model):
+        return jsonify({'message': ITEM_CHANGED_MSG}), HTTPStatus.PRECONDITION_FAILED
     data = request.get_json()
     if not data:
         return jsonify({'message': 'No input data provided'}), HTTPStatus.BAD_REQUEST
@@ -90,8 +126,12 @@ def update_inventory_item(item_id):
             setattr(item_model, key, value)
         
         db.session.add(item_model) # Add to session in case it was detached or for safety
-        db.session.commit()
-        return jsonify(inventory_item_schema.dump(item_model)), HTTPStatus.OK
+        bump_catalog_version('inventory')
+        db.session.commit() # UPDATE ... WHERE version_id = <version read above>
+        return versioned_response(item_model, inventory_item_schema.dump(item_model), HTTPStatus.OK)
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({'message': ITEM_CHANGED_MSG}), HTTPStatus.PRECONDITION_FAILED
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': 'Error updating inventory item', 'error': str(e)}), HTTPStatus.INTERNAL_SERVER_ERROR
@@ -104,7 +144,9 @@ def delete_inventory_item(item_id):
 
     item = InventoryItem.query.get_or_404(item_id)
     try:
+        record_tombstones('inventory', [item.id])
         db.session.delete(item)
+        bump_catalog_version('inventory')
         db.session.commit()
         return '', HTTPStatus.NO_CONTENT
     except Exception as e: # Catch potential integrity errors if item is in use
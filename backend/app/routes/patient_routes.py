@@ -1,14 +1,27 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required
-from app.models import Patient
-from app.schemas import PatientSchema
+from sqlalchemy import func, case, select
+from sqlalchemy.orm import joinedload, selectinload
+from datetime import datetime, timezone
+from decimal import Decimal
+from app.models import Patient, Appointment, Bill, BillItem
+from app.schemas import PatientSchema, AppointmentSchema, BillSchema
 from app.database import db
+from app.sync import DeltaSync, utcnow_naive, parse_iso_timestamp
+from app.archival import purge_patients
+from app.fieldsets import FieldSelection, FieldSelectionError
+from app.concurrency import if_match_failed, versioned_response
+from app.utils import is_admin
+from app.tiering import ArchivedAppointment, ArchivedBill, ArchivedBillItem, merge_tiers, reaches_cold_tier
 from marshmallow import ValidationError
+from sqlalchemy.orm.exc import StaleDataError
 
 patient_bp = Blueprint('patient_bp', __name__, url_prefix='/patients')
 
 patient_schema = PatientSchema()
 patients_schema = PatientSchema(many=True)
+overview_appointments_schema = AppointmentSchema(many=True, exclude=("patient",))
+overview_bills_schema = BillSchema(many=True, exclude=("patient",))
 
 @patient_bp.route('', methods=['POST'])
 @jwt_required()
@@ -35,26 +48,122 @@ def create_patient():
 def get_patients():
     # Add search/filtering capabilities, e.g., by name, email
     search_term = request.args.get('search', None)
+    include_archived = request.args.get('include_archived', 'false').lower() == 'true'
+    try:
+        sync = DeltaSync.from_request('patients', Patient)
+    except ValueError:
+        return jsonify({"msg": "Invalid updated_since format. Use an ISO 8601 timestamp."}), 400
+    try:
+        fields = FieldSelection.from_request(Patient, PatientSchema)
+    except FieldSelectionError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    query = fields.apply(Patient.query)
     if search_term:
-        patients = Patient.query.filter(
+        query = query.filter(
             Patient.full_name.ilike(f'%{search_term}%') |
             Patient.email.ilike(f'%{search_term}%') |
             Patient.phone.ilike(f'%{search_term}%')
-        ).all()
-    else:
-        patients = Patient.query.all()
-    return jsonify(patients_schema.dump(patients)), 200
+        )
+    if sync:
+        # Archived rows are included so synced clients learn about the archival.
+        patients = sync.filter(query).all()
+        return jsonify(sync.envelope(fields.dump(patients, patients_schema))), 200
+    if not include_archived:
+        # Served by the partial ix_patients_active_full_name index.
+        query = query.filter(Patient.is_archived == False).order_by(Patient.full_name)
+    patients = query.all()
+    return jsonify(fields.dump(patients, patients_schema)), 200
 
 @patient_bp.route('/<int:patient_id>', methods=['GET'])
 @jwt_required()
 def get_patient(patient_id):
+    try:
+        fields = FieldSelection.from_request(Patient, PatientSchema)
+    except FieldSelectionError as e:
+        return jsonify({"msg": str(e)}), 400
+    patient = fields.apply(Patient.query).get_or_404(patient_id)
+    return versioned_response(patient, fields.dump(patient, patient_schema), 200)
+
+@patient_bp.route('/<int:patient_id>/overview', methods=['GET'])
+@jwt_required()
+def get_patient_overview(patient_id):
+    """Patient 360 view: demographics, recent/upcoming appointments, balance and recent bills.
+
+    Runs a fixed number of queries regardless of how much history the patient has:
+    each section is limited (?limit=, capped by config) and relationships are eager-loaded.
+    Once history has been moved to the cold tier, the balance and the recent sections
+    cover both tiers.
+    """
     patient = Patient.query.get_or_404(patient_id)
-    return jsonify(patient_schema.dump(patient)), 200
+    max_limit = current_app.config['PATIENT_OVERVIEW_MAX_LIMIT']
+    limit = min(max(request.args.get('limit', current_app.config['PATIENT_OVERVIEW_DEFAULT_LIMIT'], type=int), 1), max_limit)
+    now = datetime.now(timezone.utc).replace(tzinfo=None) # Stored datetimes are naive UTC
+
+    # Both appointment sections walk the (patient_id, appointment_datetime) index from 'now'.
+    recent_appointments = Appointment.query.options(joinedload(Appointment.doctor)).filter(
+        Appointment.patient_id == patient_id,
+        Appointment.appointment_datetime < now
+    ).order_by(Appointment.appointment_datetime.desc()).limit(limit).all()
+    upcoming_appointments = Appointment.query.options(joinedload(Appointment.doctor)).filter(
+        Appointment.patient_id == patient_id,
+        Appointment.appointment_datetime >= now
+    ).order_by(Appointment.appointment_datetime.asc()).limit(limit).all()
+    if reaches_cold_tier('appointments', None):
+        # Archived appointments are all in the past; the newest of both tiers make up the history.
+        cold_appointments = db.session.scalars(
+            select(ArchivedAppointment).options(joinedload(ArchivedAppointment.doctor))
+            .where(ArchivedAppointment.patient_id == patient_id)
+            .order_by(ArchivedAppointment.appointment_datetime.desc()).limit(limit)
+        ).all()
+        recent_appointments = merge_tiers(recent_appointments, cold_appointments,
+                                          key=lambda appointment: appointment.appointment_datetime, reverse=True)[:limit]
+
+    def bill_totals(model):
+        is_outstanding = model.payment_status != 'Paid'
+        return db.session.query(
+            func.sum(case((is_outstanding, model.total_amount), else_=0)),
+            func.count(case((is_outstanding, model.id))),
+            func.sum(model.total_amount)
+        ).filter(model.patient_id == patient_id).one()
+
+    # Items (and their inventory names) come from one extra SELECT ... IN query for all bills.
+    recent_bills = Bill.query.options(
+        selectinload(Bill.bill_items).joinedload(BillItem.inventory_item)
+    ).filter(Bill.patient_id == patient_id).order_by(Bill.bill_date.desc(), Bill.id.desc()).limit(limit).all()
+    totals = [bill_totals(Bill)]
+    if reaches_cold_tier('bills', None):
+        totals.append(bill_totals(ArchivedBill))
+        cold_bills = db.session.scalars(
+            select(ArchivedBill).options(selectinload(ArchivedBill.bill_items).joinedload(ArchivedBillItem.inventory_item))
+            .where(ArchivedBill.patient_id == patient_id)
+            .order_by(ArchivedBill.bill_date.desc(), ArchivedBill.id.desc()).limit(limit)
+        ).all()
+        recent_bills = merge_tiers(recent_bills, cold_bills, key=lambda bill: (bill.bill_date, bill.id), reverse=True)[:limit]
+    outstanding_total = sum(Decimal(total or 0) for total, _, _ in totals)
+    outstanding_count = sum(count or 0 for _, count, _ in totals)
+    lifetime_billed = sum(Decimal(billed or 0) for _, _, billed in totals)
+
+    return jsonify({
+        'patient': patient_schema.dump(patient),
+        'recent_appointments': overview_appointments_schema.dump(recent_appointments),
+        'upcoming_appointments': overview_appointments_schema.dump(upcoming_appointments),
+        'balance': {
+            'outstanding_amount': str(outstanding_total.quantize(Decimal('0.01'))),
+            'outstanding_bills_count': outstanding_count,
+            'lifetime_billed': str(lifetime_billed.quantize(Decimal('0.01'))),
+        },
+        'recent_bills': overview_bills_schema.dump(recent_bills),
+    }), 200
+
+PATIENT_CHANGED_MSG = "Patient was modified by another user. Reload it and try again."
 
 @patient_bp.route('/<int:patient_id>', methods=['PUT'])
 @jwt_required()
 def update_patient(patient_id):
     patient = Patient.query.get_or_404(patient_id)
+    if if_match_failed(patient):
+        return jsonify({"msg": PATIENT_CHANGED_MSG}), 412
     data = request.get_json()
     try:
         # Check for uniqueness if email/phone are being changed
@@ -66,27 +175,81 @@ def update_patient(patient_id):
         updated_patient_data = patient_schema.load(data, partial=True)
         for key, value in updated_patient_data.items():
             setattr(patient, key, value)
-        db.session.commit()
-        return jsonify(patient_schema.dump(patient)), 200
+        db.session.commit() # UPDATE ... WHERE version_id = <version read above>
+        return versioned_response(patient, patient_schema.dump(patient), 200)
     except ValidationError as err:
         return jsonify(err.messages), 400
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({"msg": PATIENT_CHANGED_MSG}), 412
     except Exception as e:
         db.session.rollback()
         return jsonify({"msg": "Error updating patient", "error": str(e)}), 500
 
+@patient_bp.route('/<int:patient_id>/archive', methods=['POST'])
+@jwt_required()
+def archive_patient(patient_id):
+    """Hides a patient from day-to-day lists while keeping all of their records."""
+    patient = Patient.query.get_or_404(patient_id)
+    try:
+        patient.is_archived = True
+        patient.archived_at = utcnow_naive()
+        db.session.commit()
+        return jsonify(patient_schema.dump(patient)), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"msg": "Error archiving patient", "error": str(e)}), 500
+
+@patient_bp.route('/<int:patient_id>/restore', methods=['POST'])
+@jwt_required()
+def restore_patient(patient_id):
+    patient = Patient.query.get_or_404(patient_id)
+    try:
+        patient.is_archived = False
+        patient.archived_at = None
+        db.session.commit()
+        return jsonify(patient_schema.dump(patient)), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"msg": "Error restoring patient", "error": str(e)}), 500
+
 @patient_bp.route('/<int:patient_id>', methods=['DELETE'])
 @jwt_required()
 def delete_patient(patient_id):
-    patient = Patient.query.get_or_404(patient_id)
+    Patient.query.get_or_404(patient_id)
     try:
-        # Consider implications of deleting a patient (e.g., linked appointments, bills)
-        # Cascading deletes in models.py should handle related records if configured.
-        db.session.delete(patient)
+        # Set-based purge of the patient and their appointments, series, bills and bill items.
+        # Tombstones are recorded for every deleted row so synced clients drop them.
+        purge_patients([patient_id])
         db.session.commit()
         return jsonify({"msg": "Patient deleted"}), 200
     except Exception as e:
         db.session.rollback()
-        # If deletion fails due to foreign key constraints not handled by cascade:
-        if "FOREIGN KEY constraint failed" in str(e).lower():
-             return jsonify({"msg": "Cannot delete patient. They have associated records (e.g., appointments, bills). Consider archiving instead."}), 409
         return jsonify({"msg": "Error deleting patient", "error": str(e)}), 500
+
+@patient_bp.route('/purge-archived', methods=['POST'])
+@jwt_required()
+def purge_archived_patients():
+    """Hard-deletes archived patients (optionally only those archived before 'archived_before').
+
+    Each chunk of patients is committed separately so the write lock is released between chunks.
+    """
+    if not is_admin():
+        return jsonify({"msg": "Admin access required"}), 403
+    data = request.get_json(silent=True) or {}
+    query = db.session.query(Patient.id).filter(Patient.is_archived == True)
+    if data.get('archived_before'):
+        try:
+            archived_before = parse_iso_timestamp(data['archived_before'])
+        except (AttributeError, ValueError):
+            return jsonify({"msg": "Invalid archived_before format. Use an ISO 8601 timestamp."}), 400
+        query = query.filter(Patient.archived_at < archived_before)
+    patient_ids = [patient_id for (patient_id,) in query.all()]
+    try:
+        purged_count = purge_patients(patient_ids, commit_each_chunk=True)
+        db.session.commit()
+        return jsonify({"msg": "Archived patients purged", "purged_count": purged_count}), 200
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error purging archived patients: {str(e)}")
+        return jsonify({"msg": "Error purging archived patients", "error": str(e)}), 500
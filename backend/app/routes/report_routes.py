@@ -1,25 +1,17 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required
+from flask import Blueprint, request, jsonify, current_app, send_file
+from flask_jwt_extended import jwt_required, get_jwt_identity
 from http import HTTPStatus
-from sqlalchemy import func, case
-import datetime
-from decimal import Decimal
 
-from app import db
-from app.models import Bill, Appointment, InventoryItem, Patient, User # User for admin check
-from app.schemas import AppointmentSchema, InventoryItemSchema # For potential detailed lists in reports
+from app.models import ReportJob
+from app.schemas import ReportJobSchema
+from app.reports import BACKGROUND_ADMIN_REPORTS, REPORT_BUILDERS, ReportParameterError, build_report, build_cross_clinic_report, parse_date
+from app.jobs import count_active_jobs, submit_report_job
+from app.cube import DIMENSIONS, parse_month, rebuild_cube, refresh_cube
+from app.utils import is_admin
 
 report_bp = Blueprint('report_bp', __name__, url_prefix='/reports')
 
-appointment_schema_many = AppointmentSchema(many=True)
-inventory_item_schema_many = InventoryItemSchema(many=True)
-
-def parse_date(date_str):
-    if not date_str: return None
-    try:
-        return datetime.datetime.fromisoformat(date_str).date()
-    except ValueError:
-        return None
+report_job_schema = ReportJobSchema()
 
 @report_bp.route('/generate', methods=['GET'])
 @jwt_required()
@@ -33,63 +25,128 @@ def generate_report():
 
     if not report_type:
         return jsonify({'message': 'report_type parameter is required'}), HTTPStatus.BAD_REQUEST
+    if report_type not in REPORT_BUILDERS:
+        return jsonify({'message': 'Invalid report_type specified'}), HTTPStatus.BAD_REQUEST
+    if report_type in BACKGROUND_ADMIN_REPORTS:
+        return jsonify({'message': f'{report_type} only runs as a background job (POST /api/reports/jobs)'}), HTTPStatus.BAD_REQUEST
+
+    # ?clinic=all (admins only) runs the report in every clinic in parallel and merges the results.
+    all_clinics = request.args.get('clinic') == 'all'
+    if all_clinics and not is_admin():
+        return jsonify({'message': 'Admin access required for cross-clinic reports'}), HTTPStatus.FORBIDDEN
 
     report_data = {'report_type': report_type, 'filters': {'start_date': start_date_str, 'end_date': end_date_str}, 'data': {}}
 
     try:
-        if report_type == 'revenue':
-            query = db.session.query(func.sum(Bill.total_amount)).filter(Bill.payment_status == 'Paid')
-            if start_date:
-                query = query.filter(Bill.bill_date >= start_date)
-            if end_date:
-                query = query.filter(Bill.bill_date <= end_date)
-            total_revenue = query.scalar() or Decimal('0.00')
-            report_data['data'] = {'total_revenue': str(total_revenue)}
-
-        elif report_type == 'appointments_summary':
-            query = db.session.query(
-                Appointment.status,
-                func.count(Appointment.id).label('count')
-            ).group_by(Appointment.status)
-            
-            date_query_part = Appointment.appointment_datetime
-            if start_date:
-                start_datetime = datetime.datetime.combine(start_date, datetime.time.min)
-                query = query.filter(date_query_part >= start_datetime)
-            if end_date:
-                end_datetime = datetime.datetime.combine(end_date, datetime.time.max)
-                query = query.filter(date_query_part <= end_datetime)
-            
-            summary = query.all()
-            report_data['data'] = {status: count for status, count in summary}
-            
-            # Example: Get top 5 upcoming appointments if no date filter or future end_date
-            if not start_date or (end_date and end_date >= datetime.date.today()):
-                upcoming_appts_query = Appointment.query.filter(Appointment.appointment_datetime >= datetime.datetime.now())\
-                                           .order_by(Appointment.appointment_datetime.asc()).limit(5)
-                report_data['data']['upcoming_appointments_sample'] = appointment_schema_many.dump(upcoming_appts_query.all())
-
-        elif report_type == 'low_stock_inventory':
-            low_stock_items = InventoryItem.query.filter(
-                InventoryItem.quantity_on_hand <= InventoryItem.reorder_level
-            ).order_by(InventoryItem.name).all()
-            report_data['data'] = {'low_stock_items': inventory_item_schema_many.dump(low_stock_items)}
-        
-        elif report_type == 'patient_demographics':
-            # This is a placeholder for more complex demographic reporting
-            # Example: Count of new patients in a period
-            query = db.session.query(func.count(Patient.id))
-            if start_date:
-                query = query.filter(Patient.created_at >= datetime.datetime.combine(start_date, datetime.time.min))
-            if end_date:
-                query = query.filter(Patient.created_at <= datetime.datetime.combine(end_date, datetime.time.max))
-            new_patients_count = query.scalar() or 0
-            report_data['data'] = {'new_patients_count': new_patients_count}
-
+        if all_clinics:
+            report_data['data'] = build_cross_clinic_report(report_type, start_date, end_date, current_app.config['CLINICS'])
         else:
-            return jsonify({'message': 'Invalid report_type specified'}), HTTPStatus.BAD_REQUEST
-
+            report_data['data'] = build_report(report_type, start_date, end_date)
         return jsonify(report_data), HTTPStatus.OK
 
+    except ReportParameterError as e: # e.g. start_date after end_date
+        return jsonify({'message': str(e)}), HTTPStatus.BAD_REQUEST
     except Exception as e:
         return jsonify({'message': 'Error generating report', 'error': str(e)}), HTTPStatus.INTERNAL_SERVER_ERROR
+
+def _split_arg(name):
+    raw_value = request.args.get(name)
+    return [part.strip() for part in raw_value.split(',') if part.strip()] if raw_value else []
+
+@report_bp.route('/cube', methods=['GET'])
+@jwt_required()
+def query_billing_cube():
+    """Ad-hoc pivot of billed items.
+
+    ?group_by=month,category (any of month, category, payment_status, age_band),
+    optional filters ?category=...&payment_status=...&age_band=... (comma-separated labels)
+    and ?month_from=YYYY-MM&month_to=YYYY-MM. Each row sums amount and quantity and counts items.
+    """
+    group_by = _split_arg('group_by')
+    unknown = [dimension for dimension in group_by if dimension not in DIMENSIONS]
+    if unknown or len(set(group_by)) != len(group_by):
+        return jsonify({'message': f'group_by must be distinct values from: {", ".join(DIMENSIONS)}'}), HTTPStatus.BAD_REQUEST
+    try:
+        month_from = parse_month(request.args['month_from']) if request.args.get('month_from') else None
+        month_to = parse_month(request.args['month_to']) if request.args.get('month_to') else None
+    except ValueError:
+        return jsonify({'message': 'month_from and month_to must be formatted as YYYY-MM'}), HTTPStatus.BAD_REQUEST
+    filters = {dimension: _split_arg(dimension) for dimension in DIMENSIONS if dimension != 'month' and _split_arg(dimension)}
+
+    try:
+        cube = refresh_cube()
+        result = cube.query(group_by, filters, month_from, month_to)
+    except Exception as e:
+        current_app.logger.error(f"Error querying billing cube: {str(e)}", exc_info=True)
+        return jsonify({'message': 'Error querying billing cube', 'error': str(e)}), HTTPStatus.INTERNAL_SERVER_ERROR
+
+    result.update({'group_by': group_by, 'as_of': cube.meta['watermark'], 'fact_rows': cube.rows})
+    return jsonify(result), HTTPStatus.OK
+
+@report_bp.route('/cube/refresh', methods=['POST'])
+@jwt_required()
+def refresh_billing_cube():
+    """Rebuilds the billing cube from scratch (admins only)."""
+    if not is_admin():
+        return jsonify({'message': 'Admin access required'}), HTTPStatus.FORBIDDEN
+    try:
+        cube = rebuild_cube()
+    except Exception as e:
+        current_app.logger.error(f"Error rebuilding billing cube: {str(e)}", exc_info=True)
+        return jsonify({'message': 'Error rebuilding billing cube', 'error': str(e)}), HTTPStatus.INTERNAL_SERVER_ERROR
+    return jsonify({'generation': cube.generation, 'fact_rows': cube.rows, 'as_of': cube.meta['watermark']}), HTTPStatus.OK
+
+def _get_visible_job(job_id):
+    """Returns the job if it exists and belongs to the caller (admins see all), else None."""
+    job = ReportJob.query.get(job_id)
+    if job is None:
+        return None
+    if job.created_by != get_jwt_identity() and not is_admin():
+        return None
+    return job
+
+@report_bp.route('/jobs', methods=['POST'])
+@jwt_required()
+def create_report_job():
+    """Queues a report to run in the background. Poll the returned job for progress."""
+    data = request.get_json(silent=True) or {}
+    report_type = data.get('report_type')
+    if not report_type:
+        return jsonify({'message': 'report_type is required'}), HTTPStatus.BAD_REQUEST
+    if report_type not in REPORT_BUILDERS:
+        return jsonify({'message': 'Invalid report_type specified'}), HTTPStatus.BAD_REQUEST
+    if report_type in BACKGROUND_ADMIN_REPORTS and not is_admin():
+        return jsonify({'message': 'Admin access required'}), HTTPStatus.FORBIDDEN
+
+    if count_active_jobs() >= current_app.config['REPORT_JOB_MAX_PENDING']:
+        return jsonify({'message': 'Too many report jobs are pending. Try again shortly.'}), HTTPStatus.TOO_MANY_REQUESTS, {'Retry-After': '30'}
+
+    params = {'start_date': data.get('start_date'), 'end_date': data.get('end_date')}
+    try:
+        job = submit_report_job(report_type, params, get_jwt_identity())
+    except Exception as e:
+        current_app.logger.error(f"Error queuing report job: {str(e)}")
+        return jsonify({'message': 'Error queuing report job', 'error': str(e)}), HTTPStatus.INTERNAL_SERVER_ERROR
+
+    return jsonify(report_job_schema.dump(job)), HTTPStatus.ACCEPTED, {'Location': f'/api/reports/jobs/{job.id}'}
+
+@report_bp.route('/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_report_job(job_id):
+    job = _get_visible_job(job_id)
+    if job is None:
+        return jsonify({'message': 'Report job not found'}), HTTPStatus.NOT_FOUND
+    return jsonify(report_job_schema.dump(job)), HTTPStatus.OK
+
+@report_bp.route('/jobs/<job_id>/result', methods=['GET'])
+@jwt_required()
+def get_report_job_result(job_id):
+    job = _get_visible_job(job_id)
+    if job is None:
+        return jsonify({'message': 'Report job not found'}), HTTPStatus.NOT_FOUND
+    if job.status != 'succeeded':
+        return jsonify({'message': f'Report job is {job.status}', 'job': report_job_schema.dump(job)}), HTTPStatus.CONFLICT
+    try:
+        return send_file(job.result_path, mimetype='application/json')
+    except FileNotFoundError:
+        return jsonify({'message': 'Report result is no longer available'}), HTTPStatus.GONE
@@ -1,4 +1,5 @@
-from marshmallow import Schema, fields, validate, post_load
+import json
+from marshmallow import Schema, fields, validate, post_load, validates_schema, ValidationError
 from datetime import datetime, timezone
 
 # Helper for common fields
@@ -12,6 +13,7 @@ class UserSchema(BaseSchema):
     email = fields.Email(required=True, validate=validate.Length(max=120))
     password = fields.Str(required=True, load_only=True, validate=validate.Length(min=6))
     role = fields.Str(validate=validate.OneOf(['admin', 'doctor', 'receptionist']), default='receptionist')
+    clinic = fields.Str(allow_none=True, validate=validate.Length(max=50))
 
     # @post_load
     # def make_user(self, data, **kwargs):
@@ -25,6 +27,9 @@ class PatientSchema(BaseSchema):
     date_of_birth = fields.Date(allow_none=True)
     address = fields.Str(allow_none=True)
     medical_history_summary = fields.Str(allow_none=True)
+    is_archived = fields.Bool(dump_only=True)
+    archived_at = fields.DateTime(dump_only=True)
+    version_id = fields.Int(dump_only=True)
 
 class DoctorSchema(BaseSchema):
     full_name = fields.Str(required=True, validate=validate.Length(max=150))
@@ -39,10 +44,40 @@ class AppointmentSchema(BaseSchema):
     appointment_datetime = fields.DateTime(required=True)
     status = fields.Str(validate=validate.OneOf(['Scheduled', 'Confirmed', 'Cancelled', 'Completed']), default='Scheduled')
     notes = fields.Str(allow_none=True)
+    series_id = fields.Int(dump_only=True, allow_none=True)
+    version_id = fields.Int(dump_only=True)
     # For dumping related data (optional)
     patient = fields.Nested('PatientSchema', dump_only=True, only=("id", "full_name"))
     doctor = fields.Nested('DoctorSchema', dump_only=True, only=("id", "full_name"))
 
+class RecurrenceRuleSchema(Schema):
+    freq = fields.Str(required=True, validate=validate.OneOf(['DAILY', 'WEEKLY', 'MONTHLY']))
+    interval = fields.Int(missing=1, validate=validate.Range(min=1, max=52))
+    count = fields.Int(allow_none=True, validate=validate.Range(min=1))
+    until = fields.DateTime(allow_none=True)
+    byweekday = fields.List(fields.Int(validate=validate.Range(min=0, max=6)), allow_none=True) # 0=Monday
+
+    @validates_schema
+    def validate_bounded(self, data, **kwargs):
+        if data.get('count') is None and data.get('until') is None:
+            raise ValidationError("A recurrence rule needs either 'count' or 'until'.", field_name='count')
+
+class AppointmentSeriesSchema(BaseSchema):
+    patient_id = fields.Int(required=True)
+    doctor_id = fields.Int(required=True)
+    start_datetime = fields.DateTime(required=True)
+    rule = fields.Nested(RecurrenceRuleSchema, required=True)
+    status = fields.Str(dump_only=True)
+    notes = fields.Str(allow_none=True)
+    skip_conflicts = fields.Bool(load_only=True, missing=False) # Book the free slots instead of rejecting the series
+    patient = fields.Nested('PatientSchema', dump_only=True, only=("id", "full_name"))
+    doctor = fields.Nested('DoctorSchema', dump_only=True, only=("id", "full_name"))
+
+class AppointmentSeriesUpdateSchema(Schema):
+    status = fields.Str(validate=validate.OneOf(['Scheduled', 'Confirmed', 'Cancelled']))
+    notes = fields.Str(allow_none=True)
+    effective_from = fields.DateTime(load_only=True) # Only occurrences at or after this change; defaults to now
+
 class InventoryItemSchema(BaseSchema):
     name = fields.Str(required=True, validate=validate.Length(max=150))
     category = fields.Str(validate=validate.Length(max=100), allow_none=True)
@@ -51,6 +86,7 @@ class InventoryItemSchema(BaseSchema):
     reorder_level = fields.Int(validate=validate.Range(min=0), allow_none=True, default=0)
     unit_price = fields.Decimal(required=True, places=2, as_string=True) # as_string for precision
     supplier_info = fields.Str(validate=validate.Length(max=255), allow_none=True)
+    version_id = fields.Int(dump_only=True)
 
 class BillItemSchema(BaseSchema):
     # id field is part of BaseSchema, useful for updates
@@ -83,7 +119,31 @@ class BillSchema(BaseSchema):
     total_amount = fields.Decimal(dump_only=True, places=2, as_string=True) # Typically calculated on the server
     payment_status = fields.Str(validate=validate.OneOf(['Unpaid', 'Paid', 'Partially Paid']), missing='Unpaid')
     notes = fields.Str(allow_none=True)
+    version_id = fields.Int(dump_only=True)
     bill_items = fields.List(fields.Nested(BillItemSchema), required=True, validate=validate.Length(min=1))
     
     # For dumping related data (optional)
     patient = fields.Nested(PatientSchema, dump_only=True, only=("id", "full_name"))
+
+class AuditEventSchema(Schema):
+    id = fields.Int(dump_only=True)
+    occurred_at = fields.DateTime(dump_only=True)
+    user_id = fields.Str(dump_only=True)
+    action = fields.Str(dump_only=True)
+    resource = fields.Str(dump_only=True)
+    resource_id = fields.Int(dump_only=True)
+    patient_id = fields.Int(dump_only=True)
+    endpoint = fields.Str(dump_only=True)
+
+class ReportJobSchema(Schema):
+    id = fields.Str(dump_only=True)
+    report_type = fields.Str(dump_only=True)
+    params = fields.Function(lambda job: json.loads(job.params) if job.params else None, dump_only=True)
+    status = fields.Str(dump_only=True)
+    progress = fields.Int(dump_only=True)
+    error = fields.Str(dump_only=True)
+    clinic = fields.Str(dump_only=True)
+    created_at = fields.DateTime(dump_only=True)
+    started_at = fields.DateTime(dump_only=True)
+    finished_at = fields.DateTime(dump_only=True)
+    expires_at = fields.DateTime(dump_only=True)
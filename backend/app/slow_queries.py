@@ -0,0 +1,216 @@
+"""Slow-query log.
+
+Engine event listeners time every statement. One that takes at least
+SLOW_QUERY_THRESHOLD_MS is recorded with its parameters redacted, the Flask endpoint (or
+thread) that issued it and the clinic. Recording is cheap on the request thread: the
+entry goes into a bounded ring buffer and into per-fingerprint aggregates, while the
+EXPLAIN plan and the line in instance/slow_queries.log are produced by a background
+worker. Statements are fingerprinted by normalizing literals, placeholders and IN lists,
+so the same query shape from different requests aggregates together.
+
+GET /api/admin/slow-queries browses the log.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+
+from flask import current_app, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .clinics import current_clinic
+from .metrics import metrics
+from .query_plans import EXPLAINABLE_PREFIXES
+
+MAX_FINGERPRINTS = 500 # Aggregates kept; the least recently seen shape is evicted first
+MAX_PENDING_EXPLAINS = 100
+PLAN_CACHE_SECONDS = 600 # A fingerprint is re-EXPLAINed at most this often
+# SQLite plan rows that visit every row of a table, including walks over a whole index
+# (e.g. an ilike filter on an indexed column), which the query-plan check tolerates.
+SCAN_PATTERN = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+
+_NORMALIZERS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'), # String literals
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'), # Numeric literals
+    (re.compile(r'%\(\w+\)s|:\w+|\$\d+|%s'), '?'), # Named / numbered placeholders of other drivers
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'), # Expanded IN lists of any length
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def normalize_sql(statement):
+    for pattern, replacement in _NORMALIZERS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def fingerprint_sql(normalized):
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+
+def _redact(value):
+    # Ids, limits and flags help reading a plan; anything else may be patient data.
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return f'<{type(value).__name__}>'
+
+
+def redact_parameters(parameters, executemany):
+    if executemany:
+        return {'rows': len(parameters)}
+    if isinstance(parameters, dict):
+        return {key: _redact(value) for key, value in parameters.items()}
+    return [_redact(value) for value in (parameters or ())]
+
+
+def _origin():
+    if has_request_context():
+        return request.endpoint or request.path
+    return f'thread:{threading.current_thread().name}'
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms, buffer_size, explain, log_path, log_max_bytes, log_backups):
+        self.threshold = threshold_ms / 1000
+        self.explain = explain
+        self.entries = deque(maxlen=buffer_size)
+        self.aggregates = OrderedDict()
+        self._plans = {} # fingerprint -> (captured at, plan)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='slow-query-log')
+        self._file_logger = logging.getLogger(f'slow_queries.{id(self)}')
+        self._file_logger.propagate = False
+        self._file_logger.setLevel(logging.INFO)
+        if log_path:
+            self._file_logger.addHandler(RotatingFileHandler(log_path, maxBytes=log_max_bytes, backupCount=log_backups, delay=True)) # Opened on the first slow query
+
+    def record(self, engine, statement, parameters, executemany, duration):
+        normalized = normalize_sql(statement)
+        fingerprint = fingerprint_sql(normalized)
+        entry = {
+            'at': datetime.now(timezone.utc).isoformat(),
+            'duration_ms': round(duration * 1000, 2),
+            'fingerprint': fingerprint,
+            'statement': ' '.join(statement.split()),
+            'parameters': redact_parameters(parameters, executemany),
+            'endpoint': _origin(),
+            'clinic': current_clinic(),
+            'plan': None,
+        }
+        with self._lock:
+            self.entries.append(entry)
+            aggregate = self.aggregates.pop(fingerprint, None)
+            if aggregate is None:
+                aggregate = {'fingerprint': fingerprint, 'sql': normalized, 'count': 0, 'total_ms': 0.0,
+                             'max_ms': 0.0, 'endpoints': {}, 'plan': None, 'scans': []}
+                if len(self.aggregates) >= MAX_FINGERPRINTS:
+                    self.aggregates.popitem(last=False)
+            self.aggregates[fingerprint] = aggregate # Re-inserted last: most recently seen
+            aggregate['count'] += 1
+            aggregate['total_ms'] += entry['duration_ms']
+            aggregate['max_ms'] = max(aggregate['max_ms'], entry['duration_ms'])
+            aggregate['endpoints'][entry['endpoint']] = aggregate['endpoints'].get(entry['endpoint'], 0) + 1
+            if self._pending >= MAX_PENDING_EXPLAINS:
+                metrics.increment('slow_queries.dropped')
+                return
+            self._pending += 1
+        metrics.increment('slow_queries.recorded')
+        # Parameters are passed to the worker for EXPLAIN only; they are never stored.
+        explain_args = (engine, statement, parameters) if self.explain and not executemany else None
+        self._executor.submit(self._finish_entry, entry, explain_args)
+
+    def _plan_for(self, fingerprint, engine, statement, parameters):
+        cached = self._plans.get(fingerprint)
+        if cached is not None and time.monotonic() - cached[0] < PLAN_CACHE_SECONDS:
+            return cached[1]
+        if not statement.lstrip().upper().startswith(EXPLAINABLE_PREFIXES):
+            return None
+        prefix = 'EXPLAIN QUERY PLAN' if engine.dialect.name == 'sqlite' else 'EXPLAIN'
+        try:
+            with engine.connect() as connection:
+                rows = connection.exec_driver_sql(f'{prefix} {statement}', parameters).fetchall()
+            plan = [str(row[-1]) if engine.dialect.name == 'sqlite' else ' '.join(str(column) for column in row)
+                    for row in rows]
+        except Exception as e:
+            plan = [f'EXPLAIN failed: {e}']
+        self._plans[fingerprint] = (time.monotonic(), plan)
+        return plan
+
+    def _finish_entry(self, entry, explain_args):
+        """Worker: attaches the plan to the entry and its aggregate, then appends it to the log file."""
+        try:
+            if explain_args is not None:
+                plan = self._plan_for(entry['fingerprint'], *explain_args)
+                scans = [match.group(1) for match in map(SCAN_PATTERN.match, plan or []) if match]
+                entry['plan'] = plan
+                with self._lock:
+                    aggregate = self.aggregates.get(entry['fingerprint'])
+                    if aggregate is not None:
+                        aggregate['plan'], aggregate['scans'] = plan, scans
+            self._file_logger.info(json.dumps(entry, default=str))
+        except Exception as e:
+            logging.getLogger(__name__).warning(f'Slow query log worker failed: {e}')
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def snapshot(self, limit):
+        with self._lock:
+            recent = list(self.entries)[-limit:][::-1] if limit else []
+            fingerprints = [dict(aggregate, endpoints=dict(aggregate['endpoints']))
+                            for aggregate in self.aggregates.values()]
+        for aggregate in fingerprints:
+            aggregate['avg_ms'] = round(aggregate['total_ms'] / aggregate['count'], 2)
+            aggregate['total_ms'] = round(aggregate['total_ms'], 2)
+        fingerprints.sort(key=lambda aggregate: aggregate['total_ms'], reverse=True)
+        return {'threshold_ms': self.threshold * 1000, 'recent': recent, 'fingerprints': fingerprints}
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.aggregates.clear()
+            self._plans.clear()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._slow_query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_slow_query_started', None)
+    if started is None:
+        return
+    duration = time.perf_counter() - started
+    if not has_app_context():
+        return
+    log = current_app.extensions.get('slow_queries')
+    if log is not None and duration >= log.threshold and not statement.startswith('EXPLAIN'):
+        log.record(conn.engine, statement, parameters, executemany, duration)
+
+
+def init_app(app):
+    config = app.config
+    if not config['SLOW_QUERY_LOG_ENABLED']:
+        return
+    app.extensions['slow_queries'] = SlowQueryLog(
+        threshold_ms=config['SLOW_QUERY_THRESHOLD_MS'],
+        buffer_size=config['SLOW_QUERY_BUFFER_SIZE'],
+        explain=config['SLOW_QUERY_EXPLAIN'],
+        log_path=os.path.join(app.instance_path, 'slow_queries.log') if config['SLOW_QUERY_LOG_FILE'] else None,
+        log_max_bytes=config['SLOW_QUERY_LOG_MAX_BYTES'],
+        log_backups=config['SLOW_QUERY_LOG_BACKUPS'],
+    )
+    # Listening on the Engine class covers the main database and every lazily created
+    # clinic engine; statements run outside an app with the log enabled are ignored.
+    if not event.contains(Engine, 'after_cursor_execute', _after_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
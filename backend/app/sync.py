@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app, request
+
+from .database import db
+from .models import DeletionLog
+
+
+def utcnow_naive():
+    """Current UTC time without tzinfo, matching how DateTime columns are stored."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def parse_iso_timestamp(raw_value):
+    """Parses an ISO 8601 timestamp (e.g. a previous high_water_mark) into naive UTC.
+
+    Raises ValueError if the value cannot be parsed.
+    """
+    parsed = datetime.fromisoformat(raw_value.strip())
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def record_tombstones(resource, ids):
+    """Records hard-deleted row ids in the deletion log so syncing clients can prune them.
+
+    Rows are added to the current session; the caller's commit makes them durable
+    together with the delete itself. Tombstones older than the retention window
+    are pruned at the same time to keep the log compact.
+    """
+    ids = [row_id for row_id in ids if row_id is not None]
+    if not ids:
+        return
+    now = utcnow_naive()
+    db.session.execute(
+        db.insert(DeletionLog),
+        [{'resource': resource, 'resource_id': row_id, 'deleted_at': now} for row_id in ids]
+    )
+    horizon = now - timedelta(days=current_app.config['SYNC_TOMBSTONE_RETENTION_DAYS'])
+    db.session.execute(
+        db.delete(DeletionLog).where(DeletionLog.resource == resource, DeletionLog.deleted_at < horizon)
+    )
+
+
+def record_tombstones_from_select(resource, id_select):
+    """Set-based variant of record_tombstones: INSERT ... SELECT of the ids ``id_select`` yields.
+
+    Used by bulk purges so tombstoning thousands of rows is one statement.
+    """
+    now = utcnow_naive()
+    db.session.execute(
+        db.insert(DeletionLog).from_select(
+            ['resource', 'resource_id', 'deleted_at'],
+            db.select(db.literal(resource), id_select.subquery().c[0], db.literal(now))
+        )
+    )
+
+
+class DeltaSync:
+    """Delta-sync state for one list request carrying ``?updated_since=<ts>``.
+
+    The high-water mark is captured before the list query runs, so a row written
+    while the response is being built is sent again on the next sync rather than
+    missed. Clients should apply ``deleted`` before upserting ``data``.
+    """
+
+    def __init__(self, resource, model, since):
+        self.resource = resource
+        self.model = model
+        self.high_water_mark = utcnow_naive()
+        retention = timedelta(days=current_app.config['SYNC_TOMBSTONE_RETENTION_DAYS'])
+        # Tombstones older than the retention window are gone, so a client that
+        # has been offline longer than that must rebuild its local copy.
+        self.reset = since < self.high_water_mark - retention
+        self.since = None if self.reset else since
+
+    @classmethod
+    def from_request(cls, resource, model):
+        """Returns a DeltaSync if the request asks for one, else None.
+
+        Raises ValueError if ``updated_since`` is present but malformed.
+        """
+        raw_value = request.args.get('updated_since')
+        if raw_value is None:
+            return None
+        return cls(resource, model, parse_iso_timestamp(raw_value))
+
+    def filter(self, query):
+        """Restricts a list query to rows changed since the client's last sync."""
+        if self.since is None:
+            return query
+        return query.filter(self.model.updated_at > self.since)
+
+    def deleted_ids(self):
+        if self.since is None:
+            return []
+        rows = db.session.query(DeletionLog.resource_id).filter(
+            DeletionLog.resource == self.resource,
+            DeletionLog.deleted_at > self.since
+        ).all()
+        return [resource_id for (resource_id,) in rows]
+
+    def envelope(self, data):
+        return {
+            'data': data,
+            'deleted': self.deleted_ids(),
+            'high_water_mark': self.high_water_mark.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+            'reset': self.reset,
+        }
@@ -0,0 +1,268 @@
+"""Hot/cold tiering for appointments, bills and bill items.
+
+``flask move-cold-data`` moves settled rows older than TIERING_HORIZON_DAYS (paid bills,
+appointments no longer Scheduled or Confirmed) out of the hot tables into a cold archive:
+a SQLite database in the instance folder (archive_<clinic>.db), created by the first move
+and from then on attached to the clinic's connections as schema ``cold``; until then,
+reads see no cold tier. The cold tables mirror the hot ones without foreign keys and are
+never written by the API, so unsettled rows stay hot however old they are and remain
+editable. Rows move in chunks of TIERING_CHUNK_SIZE; each chunk copies and deletes in
+one transaction, so a row is always in exactly one tier and the hot tables and their
+indexes stay bounded.
+
+``cold.tiering_state`` holds, per resource, the cutoff below which rows may be cold. Read
+paths call reaches_cold_tier() and query the Archived* models only when their range
+starts before that cutoff. Tiering needs SQLite; on other databases it is inactive.
+"""
+import heapq
+import os
+from datetime import datetime, time, timedelta
+
+import click
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from flask import current_app, g
+from sqlalchemy import Column, DateTime, Index, MetaData, String, Table, delete, event, insert, select, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import DeclarativeBase, foreign, relationship
+
+from .clinics import current_clinic, default_clinic
+from .database import db
+from .models import Appointment, Bill, BillItem, Doctor, InventoryItem, Patient
+from .sync import utcnow_naive
+
+COLD_SCHEMA = 'cold'
+ATTACHED_KEY = 'cold_tier_attached' # Set in a pooled connection's info once the archive is attached
+
+cold_metadata = MetaData(schema=COLD_SCHEMA)
+
+
+def _cold_copy(table, *indexed_columns):
+    columns = [Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+               for column in table.columns]
+    indexes = [Index(f"ix_{table.name}_{'_'.join(names)}", *names) for names in indexed_columns]
+    return Table(table.name, cold_metadata, *columns, *indexes)
+
+
+cold_bills = _cold_copy(Bill.__table__, ('patient_id', 'bill_date'), ('bill_date',))
+cold_bill_items = _cold_copy(BillItem.__table__, ('bill_id',))
+cold_appointments = _cold_copy(Appointment.__table__, ('appointment_datetime',),
+                               ('patient_id', 'appointment_datetime'), ('doctor_id', 'appointment_datetime'))
+tiering_state = Table(
+    'tiering_state', cold_metadata,
+    Column('resource', String(20), primary_key=True), # 'bills', 'appointments'
+    Column('cold_before', DateTime, nullable=False),
+)
+
+
+class ColdBase(DeclarativeBase):
+    metadata = cold_metadata
+
+
+class ArchivedBillItem(ColdBase):
+    __table__ = cold_bill_items
+    inventory_item = relationship(InventoryItem, primaryjoin=foreign(cold_bill_items.c.inventory_item_id) == InventoryItem.id,
+                                  viewonly=True)
+
+
+class ArchivedBill(ColdBase):
+    """A bill in the cold tier. Read-only; serializes with BillSchema like a Bill."""
+    __table__ = cold_bills
+    bill_items = relationship(ArchivedBillItem, primaryjoin=cold_bills.c.id == foreign(cold_bill_items.c.bill_id),
+                              viewonly=True, lazy='selectin')
+    patient = relationship(Patient, primaryjoin=foreign(cold_bills.c.patient_id) == Patient.id, viewonly=True)
+
+
+class ArchivedAppointment(ColdBase):
+    """An appointment in the cold tier. Read-only; serializes with AppointmentSchema."""
+    __table__ = cold_appointments
+    patient = relationship(Patient, primaryjoin=foreign(cold_appointments.c.patient_id) == Patient.id, viewonly=True)
+    doctor = relationship(Doctor, primaryjoin=foreign(cold_appointments.c.doctor_id) == Doctor.id, viewonly=True)
+
+
+# resource -> (hot table, cold table, age column, settled criterion, [(hot child, cold child, child foreign key)])
+TIERED_RESOURCES = {
+    'bills': (Bill.__table__, cold_bills, Bill.bill_date, Bill.payment_status == 'Paid',
+              [(BillItem.__table__, cold_bill_items, BillItem.bill_id)]),
+    'appointments': (Appointment.__table__, cold_appointments, Appointment.appointment_datetime,
+                     Appointment.status.notin_(('Scheduled', 'Confirmed')), []),
+}
+
+
+def cold_tier_available():
+    """True if the current clinic's connection has its archive attached (see attach_cold_tier())."""
+    if not current_app.config['TIERING_ENABLED']:
+        return False
+    connection = db.session.connection(bind_arguments={'mapper': Bill})
+    if connection.dialect.name != 'sqlite':
+        return False
+    return bool(connection.connection.info.get(ATTACHED_KEY))
+
+
+def _as_datetime(value):
+    return value if isinstance(value, datetime) else datetime.combine(value, time.min)
+
+
+def reaches_cold_tier(resource, range_start):
+    """True if a read of ``resource`` starting at ``range_start`` (None: unbounded) may find cold rows."""
+    if not cold_tier_available():
+        return False
+    boundary = db.session.execute(
+        select(tiering_state.c.cold_before).where(tiering_state.c.resource == resource)
+    ).scalar()
+    return boundary is not None and (range_start is None or _as_datetime(range_start) < boundary)
+
+
+def merge_tiers(hot_rows, cold_rows, key, reverse=False):
+    """Merges hot and cold rows that are each already sorted by ``key``."""
+    if not cold_rows:
+        return hot_rows
+    return list(heapq.merge(hot_rows, cold_rows, key=key, reverse=reverse))
+
+
+def _raise_boundary(resource, cutoff):
+    stmt = sqlite_insert(tiering_state).values(resource=resource, cold_before=cutoff)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[tiering_state.c.resource],
+        set_={'cold_before': func.max(tiering_state.c.cold_before, stmt.excluded.cold_before)},
+    ))
+
+
+def _reserve_cold_ids(hot_table, cold_table):
+    """Makes sure ``hot_table`` never hands out an id already used in ``cold_table``.
+
+    Without AUTOINCREMENT SQLite assigns max(id) + 1, so moving the newest rows would let
+    their ids be reused. Tables created before the models declared sqlite_autoincrement
+    are rebuilt with it (autogenerated migrations don't detect the change), and the id
+    sequence is raised past the cold tier's highest id.
+    """
+    connection = db.session.connection(bind_arguments={'mapper': Bill})
+    sql = connection.exec_driver_sql(
+        "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (hot_table.name,)
+    ).scalar()
+    if 'AUTOINCREMENT' not in (sql or '').upper():
+        operations = Operations(MigrationContext.configure(connection))
+        with operations.batch_alter_table(hot_table.name, recreate='always',
+                                          table_kwargs={'sqlite_autoincrement': True}):
+            pass
+    highest = max(
+        connection.execute(select(func.max(hot_table.c.id))).scalar() or 0,
+        connection.execute(select(func.max(cold_table.c.id))).scalar() or 0,
+        connection.exec_driver_sql(
+            'SELECT seq FROM main.sqlite_sequence WHERE name = ?', (hot_table.name,)
+        ).scalar() or 0,
+    )
+    connection.exec_driver_sql('DELETE FROM main.sqlite_sequence WHERE name = ?', (hot_table.name,))
+    connection.exec_driver_sql('INSERT INTO main.sqlite_sequence (name, seq) VALUES (?, ?)', (hot_table.name, highest))
+    db.session.commit()
+
+
+def _move_resource(resource, cutoff, chunk_size):
+    hot_table, cold_table, age_column, settled, children = TIERED_RESOURCES[resource]
+    for hot, cold in [(hot_table, cold_table)] + [(hot_child, cold_child) for hot_child, cold_child, _ in children]:
+        _reserve_cold_ids(hot, cold)
+    # Readers must look at the cold tier before the first row lands there.
+    _raise_boundary(resource, cutoff)
+    db.session.commit()
+
+    limit = cutoff.date() if isinstance(age_column.type, db.Date) else cutoff
+    moved, last_id = 0, 0
+    while True:
+        # Unsettled rows stay behind, so each chunk continues after the last id seen.
+        ids = db.session.scalars(
+            select(hot_table.c.id).where(age_column < limit, settled, hot_table.c.id > last_id)
+            .order_by(hot_table.c.id).limit(chunk_size)
+        ).all()
+        if not ids:
+            return moved
+        last_id = ids[-1]
+        for hot_child, cold_child, foreign_key in children:
+            db.session.execute(insert(cold_child).from_select(
+                [column.name for column in hot_child.columns], select(hot_child).where(foreign_key.in_(ids))
+            ))
+        db.session.execute(insert(cold_table).from_select(
+            [column.name for column in hot_table.columns], select(hot_table).where(hot_table.c.id.in_(ids))
+        ))
+        for hot_child, _, foreign_key in children:
+            db.session.execute(delete(hot_child).where(foreign_key.in_(ids)))
+        db.session.execute(delete(hot_table).where(hot_table.c.id.in_(ids)))
+        db.session.commit()
+        moved += len(ids)
+
+
+def _open_archive():
+    """Creates the current clinic's archive on its first move and attaches it to the session's connection."""
+    if not cold_tier_available():
+        path = current_app.extensions['cold_archives'].get(current_clinic())
+        if path is None:
+            raise RuntimeError('Tiering is disabled or the database is not SQLite')
+        open(path, 'a').close() # An empty file is an empty SQLite database
+        db.session.close() # The next checkout attaches it
+    cold_metadata.create_all(db.session.connection(bind_arguments={'mapper': Bill}))
+    db.session.commit()
+
+
+def move_to_cold_tier(horizon_days=None):
+    """Moves the current clinic's rows older than the horizon to the cold tier. Returns {resource: rows moved}."""
+    _open_archive()
+    config = current_app.config
+    horizon_days = config['TIERING_HORIZON_DAYS'] if horizon_days is None else horizon_days
+    cutoff = datetime.combine(utcnow_naive().date() - timedelta(days=horizon_days), time.min)
+    return {resource: _move_resource(resource, cutoff, config['TIERING_CHUNK_SIZE']) for resource in TIERED_RESOURCES}
+
+
+def purge_cold_rows_for_patients(patient_ids):
+    """Deletes purged patients' cold bills, bill items and appointments. The caller commits."""
+    if not cold_tier_available():
+        return
+    cold_bill_ids = select(cold_bills.c.id).where(cold_bills.c.patient_id.in_(patient_ids))
+    db.session.execute(delete(cold_bill_items).where(cold_bill_items.c.bill_id.in_(cold_bill_ids)))
+    db.session.execute(delete(cold_bills).where(cold_bills.c.patient_id.in_(patient_ids)))
+    db.session.execute(delete(cold_appointments).where(cold_appointments.c.patient_id.in_(patient_ids)))
+
+
+def attach_cold_tier(app, engine, clinic):
+    """Attaches the clinic's archive to connections of ``engine`` as they are checked out, once it exists.
+
+    The archive file is only created by the first move (see _open_archive()), so creating
+    an app, e.g. for ``flask db upgrade``, leaves the instance folder alone. Attaching at
+    checkout rather than connect lets pooled connections pick up an archive created later
+    by another process; SQLite can't attach inside a transaction, and none is open then.
+    """
+    if not app.config['TIERING_ENABLED'] or engine.dialect.name != 'sqlite':
+        return
+    database = engine.url.database
+    if not database or database == ':memory:':
+        path = ':memory:' # Throwaway databases get a throwaway archive
+    else:
+        path = os.path.join(app.instance_path, f'archive_{clinic}.db')
+    app.extensions['cold_archives'][clinic] = path
+
+    @event.listens_for(engine, 'checkout')
+    def attach(dbapi_connection, connection_record, connection_proxy):
+        if not connection_record.info.get(ATTACHED_KEY) and (path == ':memory:' or os.path.exists(path)):
+            dbapi_connection.execute(f'ATTACH DATABASE ? AS {COLD_SCHEMA}', (path,))
+            connection_record.info[ATTACHED_KEY] = True
+
+    if path == ':memory:':
+        cold_metadata.create_all(engine)
+
+
+@click.command('move-cold-data')
+@click.option('--horizon-days', type=int, default=None, help='Override TIERING_HORIZON_DAYS.')
+@click.option('--clinic', 'clinics', multiple=True, help='Clinic to tier (repeatable); default: all.')
+def move_cold_data_command(horizon_days, clinics):
+    """Move appointments and bills older than the horizon to the cold tier."""
+    for clinic in clinics or current_app.config['CLINICS']:
+        with current_app.app_context():
+            g.clinic = clinic
+            moved = move_to_cold_tier(horizon_days)
+        click.echo(f"{clinic}: moved {moved['bills']} bills and {moved['appointments']} appointments to the cold tier.")
+
+
+def init_app(app):
+    app.extensions['cold_archives'] = {} # clinic -> archive path
+    with app.app_context():
+        attach_cold_tier(app, db.engine, default_clinic())
+    app.extensions['clinic_engines'].engine_hooks.append(attach_cold_tier)
+    app.cli.add_command(move_cold_data_command)
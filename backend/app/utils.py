@@ -13,3 +13,8 @@ def is_admin():
     user = User.query.get(current_user_id)
     # Ensure user exists and has a 'role' attribute matching 'admin'
     return user is not None and user.role == 'admin'
+
+def chunked(items, size):
+    """Yields successive slices of at most `size` items (for IN-list batching)."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
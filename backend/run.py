@@ -8,6 +8,7 @@ if os.path.exists(dotenv_path):
     load_dotenv(dotenv_path)
 
 from app import create_app
+from app.reminders import start_reminder_scheduler
 
 # Determine the configuration name from FLASK_ENV or default to 'development'
 # create_app expects 'development', 'production', or 'testing'
@@ -57,4 +58,9 @@ if __name__ == '__main__':
         # Only warn if FLASK_ENV was explicitly 'development' but debug is still off
         print(f"Warning: Running with 'development' config but debug mode is OFF. Check config.py.")
 
+    # Only the serving process runs the reminder scheduler; with the debug reloader that is
+    # the child process, not the one watching for file changes.
+    if not debug_mode or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_reminder_scheduler(app)
+
     app.run(host='0.0.0.0', port=port, debug=debug_mode)
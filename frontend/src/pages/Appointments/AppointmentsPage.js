@@ -21,10 +21,10 @@ const AppointmentsPage = () => {
     setLoading(true);
     setError(null);
     try {
-      const [appointmentsRes, doctorsRes, patientsRes] = await Promise.all([
-        api.get('/appointments'),
-        api.get('/doctors'),
-        api.get('/patients'),
+      const [appointmentsRes, doctorsRes, patientsRes] = await api.batchGet([
+        '/appointments',
+        '/doctors',
+        '/patients',
       ]);
       setAppointments(appointmentsRes || []);
       setDoctors(doctorsRes || []);
@@ -106,7 +106,7 @@ const AppointmentsPage = () => {
         await api.put(`/appointments/${selectedAppointment.id}`, payload);
         toast({ title: 'Appointment Updated', status: 'success', duration: 3000, isClosable: true });
       } else {
-        await api.post('/appointments', payload);
+        await api.postIdempotent('/appointments', payload);
         toast({ title: 'Appointment Booked', status: 'success', duration: 3000, isClosable: true });
       }
       fetchData(); 
@@ -21,10 +21,10 @@ function BillingPage() {
     setLoading(true);
     setError(null);
     try {
-      const [billsRes, patientsRes, inventoryRes] = await Promise.all([
-        api.get('/bills'),
-        api.get('/patients'),
-        api.get('/inventory')
+      const [billsRes, patientsRes, inventoryRes] = await api.batchGet([
+        '/bills',
+        '/patients',
+        '/inventory'
       ]);
       setBills(billsRes || []);
       setPatients(patientsRes || []);
@@ -70,7 +70,7 @@ function BillingPage() {
         await api.put(`/bills/${selectedBill.id}`, updatePayload);
         toast({ title: 'Bill Updated', description: `Bill B${String(selectedBill.id).padStart(3, '0')} status/notes updated.`, status: 'success', duration: 3000, isClosable: true });
       } else {
-        await api.post('/bills', payload);
+        await api.postIdempotent('/bills', payload);
         toast({ title: 'Bill Created', status: 'success', duration: 3000, isClosable: true });
       }
       fetchData();
@@ -4,6 +4,8 @@ import { FiPlus, FiEdit, FiTrash2, FiSearch, FiUser, FiMail, FiPhone, FiCalendar
 import PatientModal from '../../components/Patients/PatientModal';
 import api from '../../services/apiService';
 
+const PATIENT_LIST_FIELDS = 'full_name,email,phone,date_of_birth';
+
 const PatientsPage = () => {
   const { isOpen, onOpen, onClose } = useDisclosure();
   const toast = useToast();
@@ -17,7 +19,9 @@ const PatientsPage = () => {
     setLoading(true);
     setError(null);
     try {
-      const params = currentSearchTerm ? { search: currentSearchTerm } : {};
+      // The table only shows these columns; the edit modal fetches the full record.
+      const params = { fields: PATIENT_LIST_FIELDS };
+      if (currentSearchTerm) params.search = currentSearchTerm;
       const data = await api.get('/patients', params);
       setPatients(data || []);
     } catch (err) {
@@ -41,7 +45,14 @@ const PatientsPage = () => {
     onOpen();
   };
 
-  const handleEditPatient = (patient) => {
+  const handleEditPatient = async (patient) => {
+    try {
+      patient = await api.get(`/patients/${patient.id}`);
+    } catch (err) {
+      console.error("Error fetching patient:", err);
+      toast({ title: 'Error Loading Patient', description: err.response?.data?.msg || err.message, status: 'error', duration: 5000, isClosable: true });
+      return;
+    }
     const formattedPatient = {
         ...patient,
         dob: patient.date_of_birth ? new Date(patient.date_of_birth).toISOString().split('T')[0] : '',
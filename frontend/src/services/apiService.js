@@ -8,10 +8,11 @@ const BASE_URL = process.env.REACT_APP_API_URL || '/api';
  * @param {string} [method='GET'] - HTTP method.
  * @param {object|FormData|null} [body=null] - Request body for POST, PUT, PATCH.
  * @param {boolean} [isFormData=false] - Set to true if body is FormData.
+ * @param {object} [extraHeaders={}] - Additional request headers.
  * @returns {Promise<any>} - The JSON response from the API.
  */
-const request = async (endpoint, method = 'GET', body = null, isFormData = false) => {
-  const headers = {};
+const request = async (endpoint, method = 'GET', body = null, isFormData = false, extraHeaders = {}) => {
+  const headers = { ...extraHeaders };
   
   // Set Content-Type header unless it's FormData (browser sets it with boundary)
   if (!isFormData) {
@@ -66,6 +67,10 @@ const request = async (endpoint, method = 'GET', body = null, isFormData = false
   }
 };
 
+const newIdempotencyKey = () => (
+  window.crypto?.randomUUID ? window.crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`
+);
+
 export const api = {
   get: (endpoint, params) => {
     let url = endpoint;
@@ -79,6 +84,43 @@ export const api = {
   put: (endpoint, body, isFormData = false) => request(endpoint, 'PUT', body, isFormData),
   patch: (endpoint, body, isFormData = false) => request(endpoint, 'PATCH', body, isFormData),
   delete: (endpoint) => request(endpoint, 'DELETE'),
+  /**
+   * POSTs with an Idempotency-Key, retrying network failures with the same key so the
+   * server applies the request at most once (supported by /bills and /appointments).
+   * @param {string} endpoint - The API endpoint.
+   * @param {object} body - Request body.
+   * @param {number} [retries=2] - Extra attempts after a failure where no response arrived.
+   */
+  postIdempotent: async (endpoint, body, retries = 2) => {
+    const headers = { 'Idempotency-Key': newIdempotencyKey() };
+    for (let attempt = 0; ; attempt += 1) {
+      try {
+        return await request(endpoint, 'POST', body, false, headers);
+      } catch (error) {
+        // HTTP errors carry a status and are final; fetch rejects without one when the link drops.
+        if (error.status !== undefined || attempt >= retries) throw error;
+      }
+    }
+  },
+  /**
+   * Fetches several GET endpoints in one round trip via /api/batch.
+   * @param {string[]} endpoints - Endpoints relative to BASE_URL (e.g., ['/patients', '/doctors']).
+   * @returns {Promise<any[]>} - Response bodies in the same order; rejects if any sub-request failed.
+   */
+  batchGet: async (endpoints) => {
+    const result = await request('/batch', 'POST', {
+      requests: endpoints.map((endpoint, index) => ({ id: String(index), method: 'GET', path: `/api${endpoint}` })),
+    });
+    return result.responses.map((item) => {
+      if (item.status < 200 || item.status >= 300) {
+        const error = new Error(item.body?.message || item.body?.msg || `HTTP error! Status: ${item.status}`);
+        error.status = item.status;
+        error.data = item.body;
+        throw error;
+      }
+      return item.body;
+    });
+  },
 };
 
 export default api;
@@ -156,6 +156,10 @@ else
 fi
 echo "Database migrations complete."
 
+# Clinic databases (CLINICS beyond the first) are not covered by flask db upgrade.
+echo "Bringing clinic databases up to the current models..."
+"$FLASK_EXEC" upgrade-clinics
+
 # Start the backend server
 # The backend will serve the frontend and listen on specified port (default 9000 from run.py)
 echo "Starting backend Flask server..."